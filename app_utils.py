@@ -1,18 +1,28 @@
-import os
 import re
 import json
+import socket
 import time
+import hashlib
 import datetime
+import threading
 import traceback
-import tkinter as tk
-from tkinter import messagebox
+import importlib
+from collections import OrderedDict
 
-import openai
-import pandas as pd
+from types import SimpleNamespace
+from concurrent.futures import Future, wait as wait_futures
+
+from prompt_templates import TRANSLATION_PLACEHOLDERS, PromptTemplate, compile_template, build_prefix_cached_messages
+from quality_checks import DEFAULT_SKIP_PATTERNS
+from segment_filter import PASSTHROUGH_RULES
+from settings_store import SettingsStore
+from term_store import format_term_list
 
 
 SETTINGS_FILE = "settings.json"
 ERROR_LOG_FILE = "error_log.txt"
+HEAVY_MODULES = ("openai", "pandas", "openpyxl", "numpy")
+SINGLE_FLIGHT_CACHE_SIZE = 10000
 
 
 def log_error(error_message):
@@ -27,14 +37,45 @@ def log_error(error_message):
         print(f"Failed to write to error log: {e}")
 
 
-def load_settings():
-    default_settings = {
+def default_settings():
+    return {
         "max_tokens": 8000,
         "context_before": 1,
         "context_after": 1,
         "retry_attempts": 3,
         "paragraph_timeout": 300,
         "request_interval": 5,
+        "max_workers": 4,
+        "adaptive_concurrency": False,
+        "cache_friendly_prompts": False,
+        "hedging": {
+            "enabled": False,
+            "budget_percent": 5,
+            "min_delay": 5,
+            "percentile": 95,
+            "alternate_provider": "",
+            "alternate_key_name": "",
+            "alternate_model": ""
+        },
+        "post_edit_triage": {
+            "enabled": False,
+            "skip_patterns": list(DEFAULT_SKIP_PATTERNS)
+        },
+        "passthrough": {
+            "enabled": False,
+            "rules": list(PASSTHROUGH_RULES),
+            "target_scripts": [],
+            "min_target_share": 0.9,
+            "profiles": {}
+        },
+        "reuse_previous_translations": False,
+        "translation_glossary": "",
+        "translation_memory": {
+            "enabled": False,
+            "min_similarity": 0.75,
+            "auto_apply_similarity": 1.0,
+            "max_references": 3
+        },
         "api_providers": {
             "DeepSeek": {
                 "base_url": "https://api.deepseek.com",
@@ -83,67 +124,538 @@ def load_settings():
             )
         }
     }
-    if not os.path.exists(SETTINGS_FILE):
-        return default_settings
-    try:
-        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
 
-        for key, value in default_settings.items():
-            settings.setdefault(key, value)
-        
-        default_providers = default_settings.get("api_providers", {})
-        loaded_providers = settings.get("api_providers", {})
-        for p_name, p_defaults in default_providers.items():
-            loaded_providers.setdefault(p_name, p_defaults)
-            for sub_key, sub_default in p_defaults.items():
-                if isinstance(sub_default, dict):
-                    loaded_providers[p_name].setdefault(sub_key, {})
-                    for k, v in sub_default.items():
-                         loaded_providers[p_name][sub_key].setdefault(k, v)
-                else:
-                    loaded_providers[p_name].setdefault(sub_key, sub_default)
-        settings["api_providers"] = loaded_providers
-    
-        settings.pop("api_keys", None)
-        settings.pop("model_names", None)
-            
-        return settings
-    except (json.JSONDecodeError, Exception) as e:
-        log_error(f"Failed to load settings.json: {e}. Using default settings.")
-        return default_settings
+
+def _normalize_settings(settings):
+    defaults = default_settings()
+    for key, value in defaults.items():
+        settings.setdefault(key, value)
+
+    default_providers = defaults.get("api_providers", {})
+    loaded_providers = settings.get("api_providers", {})
+    for p_name, p_defaults in default_providers.items():
+        loaded_providers.setdefault(p_name, p_defaults)
+        for sub_key, sub_default in p_defaults.items():
+            if isinstance(sub_default, dict):
+                loaded_providers[p_name].setdefault(sub_key, {})
+                for k, v in sub_default.items():
+                     loaded_providers[p_name][sub_key].setdefault(k, v)
+            else:
+                loaded_providers[p_name].setdefault(sub_key, sub_default)
+    settings["api_providers"] = loaded_providers
+
+    settings.pop("api_keys", None)
+    settings.pop("model_names", None)
+    return settings
+
+
+SETTINGS_STORE = SettingsStore(SETTINGS_FILE, default_settings, _normalize_settings, on_error=log_error)
+
+
+def load_settings():
+    return SETTINGS_STORE.load()
 
 def save_settings(settings):
+    SETTINGS_STORE.save(settings)
+
+
+CANCEL_POLL_SECONDS = 0.2
+
+
+class RequestCancelled(Exception):
+
+    def __init__(self, call=None):
+        super().__init__("Request cancelled")
+        # Future of the abandoned call; it is done once the call's connection has been closed.
+        self.call = call
+
+
+class CancelToken:
+    # Stop flag for a run. It keeps the threading.Event interface (set/is_set/clear/wait) the workers
+    # already use and adds pause/resume plus child tokens that are cancelled together with their parent.
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.cancelled = threading.Event()
+        self.running = threading.Event()
+        self.running.set()
+        self.lock = threading.Lock()
+        self.children = set()
+
+    def is_set(self):
+        return self.cancelled.is_set()
+
+    def wait(self, timeout=None):
+        return self.cancelled.wait(timeout)
+
+    def set(self):
+        with self.lock:
+            self.cancelled.set()
+            self.running.set()
+            children = list(self.children)
+        for child in children:
+            child.set()
+
+    def clear(self):
+        with self.lock:
+            self.cancelled.clear()
+            self.running.set()
+            self.children.clear()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    @property
+    def paused(self):
+        return not self.running.is_set() and not self.cancelled.is_set()
+
+    def wait_while_paused(self):
+        token = self
+        while token is not None:
+            token.running.wait()
+            token = token.parent
+        return not self.cancelled.is_set()
+
+    def child(self):
+        child = CancelToken(self)
+        with self.lock:
+            if self.cancelled.is_set():
+                child.set()
+            else:
+                self.children.add(child)
+        return child
+
+    def discard(self, child):
+        with self.lock:
+            self.children.discard(child)
+
+
+def _wait_until_runnable(cancel_event):
+    if cancel_event is None:
+        return True
+    if hasattr(cancel_event, 'wait_while_paused'):
+        return cancel_event.wait_while_paused()
+    return not cancel_event.is_set()
+
+
+_active_calls = set()
+_active_calls_lock = threading.Lock()
+_no_stream_usage = set()
+
+
+def active_requests():
+    with _active_calls_lock:
+        return len(_active_calls)
+
+
+def _abort_stream(stream):
+    # Closing a response does not wake a read blocked in another thread; shutting the socket down does, and
+    # the provider sees the disconnect and stops generating (and billing) the answer.
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _read_stream(stream, deadline):
+    import openai
+    parts, finish_reason, usage, has_choices = [], None, None, False
+    for chunk in stream:
+        if getattr(chunk, 'usage', None):
+            usage = chunk.usage
+        for choice in chunk.choices:
+            has_choices = True
+            if choice.delta is not None and choice.delta.content:
+                parts.append(choice.delta.content)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+        if time.monotonic() > deadline:
+            raise openai.APITimeoutError(request=stream.response.request)
+    # Shaped like a non-streamed completion, so callers read it the same way.
+    message = SimpleNamespace(content="".join(parts) if parts or finish_reason else None)
+    choices = [SimpleNamespace(message=message, finish_reason=finish_reason)] if has_choices else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def _stream_completion(client, timeout, cancel_event, stream_holder, **kwargs):
+    import openai
+    usage_key = str(getattr(client, 'base_url', ''))
+    options = {} if usage_key in _no_stream_usage else {"stream_options": {"include_usage": True}}
     try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to save settings file: {e}")
-        log_error(f"Failed to save settings.json: {e}")
+        stream = client.chat.completions.create(stream=True, timeout=timeout, **options, **kwargs)
+    except openai.BadRequestError as e:
+        if not options or 'stream_options' not in str(e):
+            raise
+        # Some OpenAI-compatible servers reject stream_options; token usage is then not reported.
+        _no_stream_usage.add(usage_key)
+        stream = client.chat.completions.create(stream=True, timeout=timeout, **kwargs)
+    stream_holder.append(stream)
+    try:
+        # Stop may have come while the response headers were still on their way.
+        if cancel_event.is_set():
+            _abort_stream(stream)
+        return _read_stream(stream, time.monotonic() + timeout)
+    finally:
+        stream.close()
+
+
+def _create_completion(client, cancel_event, timeout, **kwargs):
+    # With a stop flag the answer is streamed on a helper thread, so Stop can cut the connection within
+    # CANCEL_POLL_SECONDS instead of leaving the request running until paragraph_timeout.
+    if cancel_event is None:
+        return client.chat.completions.create(stream=False, timeout=timeout, **kwargs)
+    future, stream_holder = Future(), []
+
+    def run():
+        try:
+            future.set_result(_stream_completion(client, timeout, cancel_event, stream_holder, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _active_calls_lock:
+                _active_calls.discard(future)
+
+    with _active_calls_lock:
+        _active_calls.add(future)
+    threading.Thread(target=run, daemon=True).start()
+    while not wait_futures([future], timeout=CANCEL_POLL_SECONDS).done:
+        if cancel_event.is_set():
+            # A call still waiting for response headers has no stream yet; the helper cuts it once one arrives.
+            if stream_holder:
+                _abort_stream(stream_holder[0])
+            raise RequestCancelled(future)
+    return future.result()
+
+
+class RequestPacer:
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self, stop_event=None):
+        # A paused run takes no slots, so resuming does not release a burst of overdue requests.
+        if not _wait_until_runnable(stop_event):
+            return False
+        if self.interval <= 0:
+            return True
+        with self.lock:
+            slot = max(time.monotonic(), self.next_slot)
+            self.next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            if stop_event is not None:
+                return not stop_event.wait(delay)
+            time.sleep(delay)
+        return True
+
+
+def request_pacer(settings, default_interval=5):
+    # With adaptive concurrency the limiter sets the pace from throttling and latency; a fixed interval on top
+    # would serialize request starts, so its limit could never take effect.
+    return RequestPacer(0 if settings.get('adaptive_concurrency') else settings.get('request_interval', default_interval))
+
+
+class SingleFlight:
+
+    def __init__(self, is_reusable=None, stats=None, max_results=SINGLE_FLIGHT_CACHE_SIZE):
+        self.is_reusable = is_reusable or (lambda result: result is not None)
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # Finished results are kept for the most recent prompts only, so memory does not grow with the corpus.
+        self.results = OrderedDict()
+        self.max_results = max_results
+
+    @staticmethod
+    def key_for(prompt):
+        text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).digest()
+
+    def do(self, key, fn):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                result, future, leader = self.results[key], None, False
+            else:
+                future = self.in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = self.in_flight[key] = Future()
+        if future is None or not leader:
+            if self.stats is not None:
+                self.stats.record_coalesced()
+            return result if future is None else future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.in_flight[key]
+            # Failures are shared with callers already waiting but not kept, so later duplicates retry.
+            if self.is_reusable(result):
+                self.results[key] = result
+                if len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+        future.set_result(result)
+        return result
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, max_limit, min_limit=1, initial=None, decrease_factor=0.5, latency_tolerance=2.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial or max(self.min_limit, self.max_limit // 2))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.recent_latency = None
+        self.typical_latency = None
+        self.last_decrease = 0.0
+        self.peak = int(self.limit)
+        self.throttled = 0
+        self.timeouts = 0
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self, stop_event=None):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self.condition.wait(0.5)
+            self.in_flight += 1
+            return True
+
+    def release(self, outcome, latency=None):
+        with self.condition:
+            self.in_flight -= 1
+            if outcome in ("throttled", "timeout"):
+                if outcome == "throttled":
+                    self.throttled += 1
+                else:
+                    self.timeouts += 1
+                now = time.monotonic()
+                # Requests already in flight fail together; cut once per round trip, not once per failure.
+                if now - self.last_decrease > (self.recent_latency or 1.0):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            elif outcome == "ok" and latency is not None:
+                if self.recent_latency is None:
+                    self.recent_latency = self.typical_latency = latency
+                self.recent_latency = 0.8 * self.recent_latency + 0.2 * latency
+                self.typical_latency = 0.98 * self.typical_latency + 0.02 * latency
+                if self.recent_latency <= self.latency_tolerance * self.typical_latency:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self.peak = max(self.peak, int(self.limit))
+            self.condition.notify_all()
+
+    def summary(self):
+        with self.condition:
+            return f"concurrency {int(self.limit)} (peak {self.peak}), {self.throttled} throttled, {self.timeouts} timed out"
+
+
+class RunStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.coalesced = 0
+        self.passed_through = 0
+
+    def record(self, usage):
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        # OpenAI reports cache hits under prompt_tokens_details, DeepSeek as prompt_cache_hit_tokens.
+        cached = getattr(details, 'cached_tokens', None) or getattr(usage, 'prompt_cache_hit_tokens', None) or 0
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+            self.cached_tokens += cached
+            self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def record_hedge(self, won):
+        with self.lock:
+            self.hedged_requests += 1
+            self.hedge_wins += int(won)
+
+    def record_coalesced(self):
+        with self.lock:
+            self.coalesced += 1
+
+    def record_passthrough(self):
+        with self.lock:
+            self.passed_through += 1
+
+    @property
+    def cache_hit_rate(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def summary(self):
+        with self.lock:
+            if not self.requests and not self.coalesced and not self.passed_through:
+                return ""
+            summary = (f"{self.requests} requests, {self.prompt_tokens:,} prompt tokens "
+                       f"({self.cache_hit_rate:.0%} cached), {self.completion_tokens:,} completion tokens")
+            if self.hedged_requests:
+                summary += f", {self.hedged_requests} hedged ({self.hedge_wins} won by the hedge)"
+            if self.coalesced:
+                summary += f", {self.coalesced} duplicate paragraphs shared a request"
+            if self.passed_through:
+                summary += f", {self.passed_through} non-translatable paragraphs copied without a request"
+            return summary
+
+
+def preload_modules(module_names=HEAVY_MODULES):
+    for name in module_names:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            log_error(f"Background import of {name} failed: {e}")
+
+
+def create_client(settings, provider_name, api_key):
+    if not provider_name:
+        raise ValueError("API Provider must be selected.")
+    if not api_key:
+        raise ValueError("API Key is required.")
+    import openai
+
+    provider_config = settings['api_providers'][provider_name]
+
+    if provider_name == "OpenAI (Azure)":
+        azure_endpoint = provider_config.get('azure_endpoint')
+        api_version = provider_config.get('api_version')
+        if not azure_endpoint or not api_version:
+            raise ValueError("Azure Endpoint and API Version must be configured.")
+        return openai.AzureOpenAI(
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            api_version=api_version,
+        )
+    elif provider_name == "DeepSeek (Azure)":
+        azure_endpoint = provider_config.get('azure_endpoint')
+        if not azure_endpoint:
+            raise ValueError("Azure Endpoint must be configured.")
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=azure_endpoint
+        )
+    else:
+        base_url = provider_config.get('base_url')
+        if not base_url:
+            raise ValueError(f"Base URL for '{provider_name}' is not configured.")
+        return openai.OpenAI(api_key=api_key, base_url=base_url)
 
 
 def split_text_into_paragraphs(text):
     paragraphs = re.split(r'\n+', text)
     return [p.strip() for p in paragraphs if p.strip()]
 
-def translate_single_paragraph(client, model_name, full_prompt, max_tokens, retry_attempts, paragraph_timeout):
+def build_paragraph_prompt(prompt_template, paragraphs, j, context_before, context_after, term_matcher=None, references=None, cache_friendly=False, file_name=""):
+    template = prompt_template if isinstance(prompt_template, PromptTemplate) else compile_template(prompt_template, TRANSLATION_PLACEHOLDERS)
+    total_paragraphs = len(paragraphs)
+    context_parts = []
+    if references: context_parts.extend(list(references) + [""])
+
+    start = max(0, j - context_before)
+    if start < j: context_parts.extend(["[Previous Context]"] + paragraphs[start:j] + [""])
+
+    context_parts.extend(["[Text to Translate]", paragraphs[j]])
+
+    end = min(total_paragraphs, j + 1 + context_after)
+    if j + 1 < end: context_parts.extend(["\n[Next Context]"] + paragraphs[j+1:end])
+
+    terms_text = ""
+    if term_matcher:
+        matched_terms = term_matcher.find_terms(paragraphs[j], *paragraphs[start:j], *paragraphs[j+1:end])
+        terms_text = format_term_list(matched_terms)
+
+    context_text = "\n".join(context_parts)
+    if cache_friendly:
+        values = {"terms": terms_text}
+        if "file_name" in template: values["file_name"] = file_name
+        if "index" in template: values["index"] = str(j + 1)
+        values["context"] = context_text
+        return build_prefix_cached_messages(template, values)
+    if terms_text and "terms" not in template:
+        context_text = f"[Terminology]\n{terms_text}\n\n{context_text}"
+    return template.render(context=context_text, terms=terms_text, file_name=file_name, index=j + 1)
+
+def prompt_messages(full_prompt):
+    if isinstance(full_prompt, list):
+        return full_prompt
+    lines = full_prompt.split('\n', 1)
+    return [
+        {"role": "system", "content": lines[0]},
+        {"role": "user", "content": lines[1] if len(lines) > 1 else ""},
+    ]
+
+def _limiter_outcome(error):
+    import openai
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if getattr(error, 'status_code', None) in (429, 503):
+        return "throttled"
+    return "error"
+
+def _retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    try:
+        return min(60.0, float(response.headers.get('retry-after')))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+def translate_single_paragraph(client, model_name, full_prompt, max_tokens, retry_attempts, paragraph_timeout, stats=None, cancel_event=None, limiter=None):
+    import openai
     last_exception = None
+    messages = prompt_messages(full_prompt)
     for attempt in range(retry_attempts):
+        if not _wait_until_runnable(cancel_event):
+            return None
+        backoff = 2 ** attempt
         try:
-            lines = full_prompt.split('\n', 1)
-            system_message = lines[0]
-            user_message = lines[1] if len(lines) > 1 else ""
-
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message},
-                ],
-                stream=False,
-                max_tokens=max_tokens,
-                timeout=paragraph_timeout
-            )
+            if limiter is not None and not limiter.acquire(cancel_event):
+                return None
+            started = time.monotonic()
+            try:
+                response = _create_completion(
+                    client, cancel_event, paragraph_timeout, model=model_name, messages=messages, max_tokens=max_tokens
+                )
+            except RequestCancelled as e:
+                if limiter is not None:
+                    # The slot stays taken until the abandoned call has actually closed its connection.
+                    e.call.add_done_callback(lambda call: limiter.release("cancelled"))
+                return None
+            except Exception as e:
+                if limiter is not None:
+                    limiter.release(_limiter_outcome(e))
+                raise
+            if limiter is not None:
+                limiter.release("ok", time.monotonic() - started)
+            if stats is not None:
+                stats.record(getattr(response, 'usage', None))
     
             if response.choices:
                 choice = response.choices[0]
@@ -168,9 +680,18 @@ def translate_single_paragraph(client, model_name, full_prompt, max_tokens, retr
             log_error(error_message)
             if 'content_filter' in str(e).lower():
                 return "[ERROR_CONTENT_FILTER]"
+            if limiter is not None and _limiter_outcome(e) == "throttled":
+                # The limiter has already cut concurrency; only honour the server's own retry hint.
+                backoff = _retry_after_seconds(e) or 1.0
+            else:
+                backoff = max(backoff, _retry_after_seconds(e))
     
         if attempt < retry_attempts - 1:
-            time.sleep(2 ** attempt)
+            if cancel_event is not None:
+                if cancel_event.wait(backoff):
+                    return None
+            else:
+                time.sleep(backoff)
     
     if last_exception is None:
         return "[ERROR_OTHER: Unknown error, no exception caught.]"
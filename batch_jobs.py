@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import hashlib
+import datetime
+
+from app_utils import load_settings, log_error, build_paragraph_prompt, prompt_messages, create_client
+from corpus_io import corpus_paths, write_corpus, write_translated_text
+from paragraph_index import index_path_for, split_file_with_index, save_index
+from prompt_templates import PromptTemplateError, compile_template
+from work_queue import _resolve_api_key
+
+BATCH_DIR = "batch_jobs"
+MANIFEST_FILE = os.path.join(BATCH_DIR, "jobs.json")
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_BATCH = 50000
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def load_manifest(manifest_path=MANIFEST_FILE):
+    if not os.path.exists(manifest_path):
+        return {"jobs": []}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=MANIFEST_FILE):
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def _custom_id(file_number, paragraph_index):
+    return f"{file_number}-{paragraph_index}"
+
+
+def _paragraphs_digest(index):
+    return hashlib.sha1("".join(entry[2] for entry in index['paragraphs']).encode('ascii')).hexdigest()
+
+
+def write_batch_requests(job_dir, files, prompt_template, model_name, settings, term_matcher=None):
+    context_before = settings.get('context_before', 1)
+    context_after = settings.get('context_after', 1)
+    cache_friendly = settings.get('cache_friendly_prompts', False)
+    body_defaults = {"model": model_name, "max_tokens": settings.get('max_tokens', 8000)}
+
+    file_entries, request_paths = [], []
+    out, lines_in_chunk = None, 0
+    try:
+        for file_number, file_path in enumerate(files):
+            paragraphs, index = split_file_with_index(file_path)
+            file_entries.append({
+                'file_path': os.path.abspath(file_path), 'paragraphs': len(paragraphs),
+                'digest': _paragraphs_digest(index)
+            })
+            for j in range(len(paragraphs)):
+                if out is None or lines_in_chunk >= MAX_REQUESTS_PER_BATCH:
+                    if out is not None:
+                        out.close()
+                    request_paths.append(os.path.join(job_dir, f"input_{len(request_paths) + 1}.jsonl"))
+                    out = open(request_paths[-1], 'w', encoding='utf-8')
+                    lines_in_chunk = 0
+                prompt = build_paragraph_prompt(
+                    prompt_template, paragraphs, j, context_before, context_after, term_matcher,
+                    cache_friendly=cache_friendly, file_name=os.path.basename(file_path)
+                )
+                request = {
+                    "custom_id": _custom_id(file_number, j), "method": "POST", "url": BATCH_ENDPOINT,
+                    "body": dict(body_defaults, messages=prompt_messages(prompt))
+                }
+                out.write(json.dumps(request, ensure_ascii=False) + "\n")
+                lines_in_chunk += 1
+    finally:
+        if out is not None:
+            out.close()
+    return file_entries, request_paths
+
+
+def _record_batch_state(entry, batch):
+    entry['status'] = batch.status
+    entry['output_file_id'] = getattr(batch, 'output_file_id', None)
+    entry['error_file_id'] = getattr(batch, 'error_file_id', None)
+    counts = getattr(batch, 'request_counts', None)
+    if counts is not None:
+        entry['request_counts'] = {'total': counts.total, 'completed': counts.completed, 'failed': counts.failed}
+
+
+def submit_batch_job(client, files, prompt_template, model_name, settings, term_matcher=None, provider_name="", manifest_path=MANIFEST_FILE, key_name=None):
+    job_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    job_dir = os.path.join(os.path.dirname(manifest_path) or ".", job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    file_entries, request_paths = write_batch_requests(job_dir, files, prompt_template, model_name, settings, term_matcher)
+    if not request_paths:
+        raise ValueError("The selected files contain no paragraphs to translate.")
+
+    job = {
+        'id': job_id, 'created': time.time(), 'provider': provider_name, 'key_name': key_name, 'model': model_name,
+        'status': 'submitted', 'files': file_entries, 'batches': []
+    }
+    manifest = load_manifest(manifest_path)
+    manifest['jobs'].append(job)
+    for request_path in request_paths:
+        with open(request_path, 'rb') as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window="24h", metadata={"aipta_job": job_id}
+        )
+        entry = {'batch_id': batch.id, 'input_file_id': uploaded.id, 'input_path': request_path}
+        # A small batch can already be finished in the create response.
+        _record_batch_state(entry, batch)
+        job['batches'].append(entry)
+        # Persist after every submission so a crash never loses a batch id.
+        save_manifest(manifest, manifest_path)
+    return job
+
+
+def refresh_job(client, job):
+    for entry in job['batches']:
+        # Terminal entries without result files were recorded before their files were known; look again.
+        if entry['status'] in TERMINAL_STATUSES and (entry.get('output_file_id') or entry.get('error_file_id')):
+            continue
+        _record_batch_state(entry, client.batches.retrieve(entry['batch_id']))
+    # A completed batch always has a result file; without one it cannot be collected yet.
+    return all(
+        entry['status'] in TERMINAL_STATUSES and (entry['status'] != 'completed' or entry.get('output_file_id') or entry.get('error_file_id'))
+        for entry in job['batches']
+    )
+
+
+def _result_text(record):
+    response = record.get('response') or {}
+    body = response.get('body') or {}
+    if response.get('status_code') == 200 and body.get('choices'):
+        choice = body['choices'][0]
+        if choice.get('finish_reason') == 'content_filter':
+            return "[ERROR_CONTENT_FILTER]"
+        content = (choice.get('message') or {}).get('content')
+        if content is not None:
+            return content.strip()
+    error = record.get('error') or body.get('error') or {}
+    message = error.get('message') if isinstance(error, dict) else str(error)
+    if 'content_filter' in str(message).lower() or 'content_filter' in str(error).lower():
+        return "[ERROR_CONTENT_FILTER]"
+    return f"[ERROR_OTHER: {str(message or 'No result returned by the batch')[:100]}...]"
+
+
+def _download(client, file_id, path):
+    if not os.path.exists(path):
+        content = client.files.content(file_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content.read())
+        os.replace(tmp_path, path)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def collect_job(client, job):
+    results = {}
+    for number, entry in enumerate(job['batches'], start=1):
+        job_dir = os.path.dirname(entry['input_path'])
+        for kind in ('error_file_id', 'output_file_id'):
+            if entry.get(kind):
+                for record in _download(client, entry[kind], os.path.join(job_dir, f"{kind[:-8]}_{number}.jsonl")):
+                    results[record['custom_id']] = _result_text(record)
+
+    written = []
+    for file_number, file_entry in enumerate(job['files']):
+        file_path = file_entry['file_path']
+        paragraphs, index = split_file_with_index(file_path)
+        if _paragraphs_digest(index) != file_entry['digest']:
+            log_error(f"Batch job {job['id']}: {file_path} changed after submission, results not written.")
+            continue
+        translations = [
+            results.get(_custom_id(file_number, j), "[ERROR_OTHER: No result returned by the batch...]")
+            for j in range(len(paragraphs))
+        ]
+        dir_name = os.path.splitext(os.path.basename(file_path))[0]
+        output_dir = os.path.join(os.path.dirname(file_path), dir_name)
+        os.makedirs(output_dir, exist_ok=True)
+        translated_file_path, excel_path = corpus_paths(output_dir, dir_name)
+        write_translated_text(translated_file_path, translations)
+        write_corpus(excel_path, paragraphs, translations)
+        save_index(index_path_for(output_dir, dir_name), index)
+        failed = sum(1 for t in translations if t.startswith("[ERROR_"))
+        written.append((excel_path, failed))
+    job['status'] = 'collected'
+    return written
+
+
+def check_jobs(client_for, manifest_path=MANIFEST_FILE, on_collected=None):
+    # client_for(job) returns a client for the provider the job was submitted to, or raises ValueError.
+    manifest = load_manifest(manifest_path)
+    pending, collected = [], []
+    for job in manifest['jobs']:
+        if job['status'] == 'collected':
+            continue
+        try:
+            client = client_for(job)
+        except ValueError as e:
+            log_error(f"Batch job {job['id']} not checked: {e}")
+            pending.append(job)
+            continue
+        if refresh_job(client, job):
+            written = collect_job(client, job)
+            collected.append((job, written))
+            if on_collected:
+                on_collected(job, written)
+        else:
+            pending.append(job)
+        save_manifest(manifest, manifest_path)
+    return pending, collected
+
+
+def job_progress(job):
+    total = sum(entry.get('request_counts', {}).get('total', 0) for entry in job['batches'])
+    done = sum(entry.get('request_counts', {}).get('completed', 0) + entry.get('request_counts', {}).get('failed', 0) for entry in job['batches'])
+    statuses = sorted({entry['status'] for entry in job['batches']})
+    return f"{job['id']}: {', '.join(statuses)} ({done}/{total} requests)"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI-PTA offline Batch API translation.")
+    parser.add_argument("--provider", required=True)
+    parser.add_argument("--key-name", help="Name of a saved API key; defaults to the AIPTA_API_KEY environment variable.")
+    parser.add_argument("--manifest", default=MANIFEST_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Build and submit batch requests for TXT files.")
+    submit_parser.add_argument("files", nargs="+")
+    submit_parser.add_argument("--model", required=True)
+    submit_parser.add_argument("--prompt", required=True, help="Name of a translation prompt saved in settings.json.")
+    submit_parser.add_argument("--glossary", help="Terminology CSV used to fill {terms}.")
+
+    subparsers.add_parser("status", help="Show the state of every job that has not been collected yet.")
+
+    collect_parser = subparsers.add_parser("collect", help="Poll submitted jobs and write outputs for finished ones.")
+    collect_parser.add_argument("--wait", type=int, default=0, help="Keep polling every N seconds until every job is collected.")
+
+    args = parser.parse_args(argv)
+    settings = load_settings()
+    client = create_client(settings, args.provider, _resolve_api_key(settings, args.provider, args.key_name))
+
+    def client_for(job):
+        if job.get('provider') and job['provider'] != args.provider:
+            raise ValueError(f"it was submitted to {job['provider']}; run again with --provider {job['provider']}.")
+        return client
+
+    if args.command == "submit":
+        prompt_text = settings['prompts'].get(args.prompt)
+        if prompt_text is None:
+            parser.error(f"Prompt '{args.prompt}' not found in settings.")
+        try:
+            prompt_template = compile_template(prompt_text)
+        except PromptTemplateError as e:
+            parser.error(str(e))
+        term_matcher = None
+        if args.glossary:
+            from term_store import TermStore
+            term_store = TermStore(args.glossary)
+            term_matcher = term_store.matcher()
+            term_store.close()
+        job = submit_batch_job(client, args.files, prompt_template, args.model, settings, term_matcher, args.provider, args.manifest, args.key_name)
+        print(f"Submitted job {job['id']} with {len(job['batches'])} batch(es).")
+    elif args.command == "status":
+        manifest = load_manifest(args.manifest)
+        for job in manifest['jobs']:
+            if job['status'] == 'collected':
+                print(f"{job['id']}: collected")
+                continue
+            try:
+                refresh_job(client_for(job), job)
+            except ValueError as e:
+                print(f"{job['id']}: not checked, {e}")
+                continue
+            print(job_progress(job))
+        save_manifest(manifest, args.manifest)
+    elif args.command == "collect":
+        while True:
+            pending, collected = check_jobs(client_for, args.manifest)
+            for job, written in collected:
+                for excel_path, failed in written:
+                    print(f"{job['id']}: wrote {excel_path}" + (f" ({failed} failed paragraphs)" if failed else ""))
+            for job in pending:
+                print(job_progress(job))
+            if not pending or args.wait <= 0:
+                break
+            time.sleep(args.wait)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
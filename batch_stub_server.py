@@ -0,0 +1,157 @@
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the provider Batch API, used to exercise batch_jobs.py without spending tokens.
+# Each request is "translated" by echoing the paragraph that follows the [Text to Translate] marker.
+
+
+def _echo_translation(body):
+    text = body['messages'][-1]['content']
+    marker = "[Text to Translate]"
+    if marker in text:
+        text = text.split(marker, 1)[1].strip().split("\n", 1)[0]
+    if "FAIL" in text:
+        return None
+    return f"[stub] {text}"
+
+
+class StubBatchState:
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.RLock()
+
+    def add_file(self, data, purpose):
+        file_id = "file-" + uuid.uuid4().hex[:12]
+        with self.lock:
+            self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()), "filename": "input.jsonl", "purpose": purpose, "status": "processed"}
+
+    def create_batch(self, params):
+        batch_id = "batch_" + uuid.uuid4().hex[:12]
+        with self.lock:
+            self.batches[batch_id] = {"params": params, "created": time.time(), "result": None}
+        return self.describe(batch_id)
+
+    def _finish(self, batch_id):
+        batch = self.batches[batch_id]
+        lines = self.files[batch["params"]["input_file_id"]].decode('utf-8').splitlines()
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            translation = _echo_translation(request["body"])
+            if translation is None:
+                errors.append({"id": "req_" + uuid.uuid4().hex[:8], "custom_id": request["custom_id"], "response": None,
+                               "error": {"code": "server_error", "message": "Stub failure requested by the paragraph text."}})
+                continue
+            outputs.append({"id": "req_" + uuid.uuid4().hex[:8], "custom_id": request["custom_id"], "error": None, "response": {
+                "status_code": 200, "request_id": uuid.uuid4().hex,
+                "body": {"id": "chatcmpl-stub", "object": "chat.completion", "model": request["body"].get("model"),
+                         "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": translation}}],
+                         "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+            }})
+        output_id = self.add_file("".join(json.dumps(r) + "\n" for r in outputs).encode('utf-8'), "batch_output")["id"] if outputs else None
+        error_id = self.add_file("".join(json.dumps(r) + "\n" for r in errors).encode('utf-8'), "batch_output")["id"] if errors else None
+        batch["result"] = (output_id, error_id, len(outputs) + len(errors), len(outputs), len(errors))
+
+    def describe(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            finished = time.time() - batch["created"] >= self.delay
+            if finished and batch["result"] is None:
+                self._finish(batch_id)
+            output_id, error_id, total, completed, failed = batch["result"] or (None, None, 0, 0, 0)
+        params = batch["params"]
+        return {
+            "id": batch_id, "object": "batch", "endpoint": params["endpoint"], "input_file_id": params["input_file_id"],
+            "completion_window": params["completion_window"], "status": "completed" if finished else "in_progress",
+            "created_at": int(batch["created"]), "output_file_id": output_id, "error_file_id": error_id,
+            "metadata": params.get("metadata"), "request_counts": {"total": total, "completed": completed, "failed": failed}
+        }
+
+
+class StubBatchHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json({"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        if self.path == "/v1/files":
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('latin-1') + data
+            )
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.iter_parts()}
+            self._send_json(self.state.add_file(fields.get("file", b""), (fields.get("purpose") or b"batch").decode()))
+        elif self.path == "/v1/batches":
+            self._send_json(self.state.create_batch(json.loads(data)))
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 3 and parts[:2] == ["v1", "batches"]:
+            batch = self.state.describe(parts[2])
+            return self._send_json(batch) if batch else self._not_found()
+        if len(parts) == 4 and parts[:2] == ["v1", "files"] and parts[3] == "content":
+            data = self.state.files.get(parts[2])
+            if data is None:
+                return self._not_found()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return None
+        return self._not_found()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=0, delay=0.0):
+    handler = type("BoundStubBatchHandler", (StubBatchHandler,), {"state": StubBatchState(delay)})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Batch API. Point a provider's base URL at http://127.0.0.1:PORT/v1.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0, help="Seconds before a submitted batch reports completed.")
+    args = parser.parse_args(argv)
+    server = make_server(args.port, args.delay)
+    print(f"Stub batch endpoint listening on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import os
+
+
+def red_bold_font():
+    from openpyxl.styles import Font
+    return Font(color="FF0000", bold=True)
+
+
+def display_error_value(value):
+    if not isinstance(value, str):
+        return None
+    if value == "[ERROR_CONTENT_FILTER]":
+        return "Rejected by API (content policy)"
+    if value == "[ERROR_NETWORK]":
+        return "Network Issue"
+    if value.startswith("[ERROR_OTHER:"):
+        return f"Failed: {value[13:-3]}"
+    return None
+
+
+def is_error_display_value(value):
+    if not isinstance(value, str):
+        return False
+    return value in ("Rejected by API (content policy)", "Network Issue") or value.startswith("Failed: ")
+
+
+def format_error_cell(cell):
+    from openpyxl.styles import Font
+    display_value = display_error_value(cell.value)
+    if display_value is not None:
+        cell.value = display_value
+        cell.font = red_bold_font()
+    else:
+        cell.font = Font()
+
+
+def format_error_column(ws, col_idx):
+    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
+        cell = row[col_idx]
+        if isinstance(cell.value, str) and display_error_value(cell.value) is not None:
+            format_error_cell(cell)
+
+
+def find_column(ws, header):
+    for col_idx, cell in enumerate(ws[1]):
+        if cell.value == header:
+            return col_idx
+    return -1
+
+
+def corpus_paths(output_dir, dir_name):
+    return (
+        os.path.join(output_dir, f"{dir_name}_translated.txt"),
+        os.path.join(output_dir, f"{dir_name}_corpus.xlsx"),
+    )
+
+
+def write_translated_text(txt_path, translations):
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join("" if t is None else str(t) for t in translations))
+
+
+def cell_text(value):
+    return "" if value is None else str(value)
+
+
+class SheetRows:
+
+    def __init__(self, wb, rows, width):
+        self.wb = wb
+        self.rows = rows
+        self.width = width
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.rows, None) if self.wb is not None else None
+        if row is None:
+            self.close()
+            raise StopIteration
+        return tuple(row) + (None,) * (self.width - len(row))
+
+    def close(self):
+        if self.wb is not None:
+            self.wb.close()
+            self.wb = None
+
+
+def open_sheet_rows(excel_path):
+    from openpyxl import load_workbook
+    # Read-only mode parses rows lazily, so the first rows are usable before the rest of the sheet is read.
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    ws = wb.active
+    rows = ws.iter_rows(values_only=True)
+    header = [cell_text(h) for h in next(rows, None) or ()]
+    total = ws.max_row - 1 if ws.max_row and ws.max_row > 1 else None
+    return header, SheetRows(wb, rows, len(header)), total
+
+
+class SheetAppender:
+
+    def __init__(self, excel_path, header, error_columns=(), text_path=None, text_column=None):
+        from openpyxl import Workbook
+        # Write-only mode spools rows to a temporary file instead of keeping the sheet in memory; the text
+        # output is written in place, so it can be inspected while rows are still being added.
+        self.excel_path = excel_path
+        self.text_path = text_path
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet()
+        self.ws.append(header)
+        self.error_columns = error_columns
+        self.text_column = text_column
+        self.text_file = open(text_path, 'w', encoding='utf-8') if text_path else None
+        self.rows = 0
+
+    def append(self, values):
+        from openpyxl.cell import WriteOnlyCell
+        values = list(values)
+        if self.text_file:
+            self.text_file.write(("\n\n" if self.rows else "") + cell_text(values[self.text_column]))
+        for col in self.error_columns:
+            display_value = display_error_value(values[col])
+            if display_value is not None or is_error_display_value(values[col]):
+                values[col] = WriteOnlyCell(self.ws, value=display_value or values[col])
+                values[col].font = red_bold_font()
+        self.ws.append(values)
+        self.rows += 1
+
+    def flush(self):
+        if self.text_file:
+            self.text_file.flush()
+
+    def close(self, excel_path=None, text_path=None):
+        # The workbook goes through a temporary file, so an interrupted save never replaces a complete output.
+        excel_path = excel_path or self.excel_path
+        self.wb.save(excel_path + ".tmp")
+        os.replace(excel_path + ".tmp", excel_path)
+        if self.text_file:
+            self.text_file.close()
+            self.text_file = None
+            if text_path and text_path != self.text_path:
+                os.replace(self.text_path, text_path)
+
+    def discard(self):
+        if self.text_file:
+            self.text_file.close()
+            self.text_file = None
+
+
+def read_corpus(excel_path):
+    import pandas as pd
+    df = pd.read_excel(excel_path, dtype=str, keep_default_na=False)
+    if 'Source' not in df.columns or 'Translation' not in df.columns:
+        raise ValueError(f"'{os.path.basename(excel_path)}' must contain 'Source' and 'Translation' columns.")
+    return df['Source'].tolist(), df['Translation'].tolist()
+
+
+def write_corpus(excel_path, paragraphs, translations, origins=None):
+    import pandas as pd
+    from openpyxl import load_workbook
+    columns = {'Source': list(paragraphs), 'Translation': translations}
+    if origins is not None:
+        columns['Origin'] = origins
+    df = pd.DataFrame(columns)
+    df.to_excel(excel_path, index=False, engine='openpyxl')
+
+    wb = load_workbook(excel_path)
+    ws = wb.active
+    format_error_column(ws, 1)
+    wb.save(excel_path)
+
+
+def count_corpus_rows(excel_path):
+    header, rows, total = open_sheet_rows(excel_path)
+    try:
+        # Write-only workbooks carry no dimension, so their rows have to be counted.
+        return total if total is not None else sum(1 for _ in rows)
+    finally:
+        rows.close()
+
+
+def patch_corpus_cells(excel_path, translations_by_index, origins_by_index=None, sources_by_index=None):
+    from openpyxl import load_workbook
+    wb = load_workbook(excel_path)
+    ws = wb.active
+    col_idx = find_column(ws, 'Translation')
+    if col_idx == -1:
+        raise ValueError(f"'{os.path.basename(excel_path)}' has no 'Translation' column.")
+    origin_col_idx = find_column(ws, 'Origin')
+    source_col_idx = find_column(ws, 'Source')
+
+    for index, translation in translations_by_index.items():
+        cell = ws.cell(row=index + 2, column=col_idx + 1)
+        cell.value = translation
+        format_error_cell(cell)
+        if origins_by_index is not None and origin_col_idx != -1:
+            ws.cell(row=index + 2, column=origin_col_idx + 1).value = origins_by_index[index]
+        if sources_by_index is not None and source_col_idx != -1:
+            ws.cell(row=index + 2, column=source_col_idx + 1).value = sources_by_index[index]
+    wb.save(excel_path)
+
+    return [row[0] for row in ws.iter_rows(min_row=2, min_col=col_idx + 1, max_col=col_idx + 1, values_only=True)]
+
+
+def patch_corpus_rows(excel_path, first_index, translations, origins=None, sources=None):
+    return patch_corpus_cells(
+        excel_path,
+        {first_index + offset: t for offset, t in enumerate(translations)},
+        {first_index + offset: o for offset, o in enumerate(origins)} if origins is not None else None,
+        {first_index + offset: s for offset, s in enumerate(sources)} if sources is not None else None
+    )
+
+
+def find_failed_rows(excel_path):
+    sources, translations = read_corpus(excel_path)
+    failed = [i for i, t in enumerate(translations) if is_error_display_value(t) or display_error_value(t) is not None]
+    return sources, failed
+
+
+def translated_text_path_for(excel_path):
+    if not excel_path.endswith("_corpus.xlsx"):
+        return None
+    return excel_path[:-len("_corpus.xlsx")] + "_translated.txt"
@@ -0,0 +1,122 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from app_utils import CancelToken, translate_single_paragraph
+from corpus_io import display_error_value
+
+
+class LatencyTracker:
+
+    def __init__(self, window=200, percentile=95, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def threshold(self):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+
+class HedgedTranslator:
+
+    def __init__(self, client, model_name, max_tokens, retry_attempts, paragraph_timeout,
+                 hedge_client=None, hedge_model=None, budget_percent=5, min_delay=5.0, percentile=95,
+                 stats=None, max_workers=8, limiter=None):
+        self.client = client
+        self.model_name = model_name
+        self.hedge_client = hedge_client or client
+        self.hedge_model = hedge_model or model_name
+        self.max_tokens = max_tokens
+        self.retry_attempts = retry_attempts
+        self.paragraph_timeout = paragraph_timeout
+        self.budget_percent = budget_percent
+        self.min_delay = min_delay
+        self.stats = stats
+        self.limiter = limiter
+        self.latency = LatencyTracker(percentile=percentile)
+        self.lock = threading.Lock()
+        self.primary_requests = 0
+        self.hedged_requests = 0
+        self.max_workers = max_workers
+        self.executor = None
+
+    def _submit(self, *args):
+        with self.lock:
+            if self.executor is None:
+                # Abandoned losers keep a worker busy until they return, so hedges get their own headroom.
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers * 2)
+            return self.executor.submit(self._call, *args)
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+    def _call(self, client, model_name, prompt, cancel_event):
+        started = time.monotonic()
+        result = translate_single_paragraph(
+            client, model_name, prompt, self.max_tokens, self.retry_attempts, self.paragraph_timeout,
+            self.stats, cancel_event, self.limiter
+        )
+        if result is not None and display_error_value(result) is None:
+            self.latency.record(time.monotonic() - started)
+        return result
+
+    def _take_hedge_budget(self):
+        with self.lock:
+            if (self.hedged_requests + 1) * 100 > self.primary_requests * self.budget_percent:
+                return False
+            self.hedged_requests += 1
+            return True
+
+    def translate(self, prompt, cancel_event=None):
+        # Both attempts get child tokens, so stopping or pausing the run reaches them as well.
+        parent = cancel_event if isinstance(cancel_event, CancelToken) else CancelToken()
+        primary_cancel, hedge_cancel = parent.child(), parent.child()
+        try:
+            return self._translate(prompt, primary_cancel, hedge_cancel)
+        finally:
+            parent.discard(primary_cancel)
+            parent.discard(hedge_cancel)
+
+    def _translate(self, prompt, primary_cancel, hedge_cancel):
+        with self.lock:
+            self.primary_requests += 1
+        primary = self._submit(self.client, self.model_name, prompt, primary_cancel)
+
+        threshold = self.latency.threshold()
+        if threshold is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=max(self.min_delay, threshold))
+        if done or not self._take_hedge_budget():
+            return primary.result()
+
+        hedge = self._submit(self.hedge_client, self.hedge_model, prompt, hedge_cancel)
+        pending = {primary: primary_cancel, hedge: hedge_cancel}
+        fallback = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                result = future.result()
+                if result is not None and display_error_value(result) is None:
+                    for cancel_event in pending.values():
+                        cancel_event.set()
+                    if self.stats is not None:
+                        self.stats.record_hedge(won=future is hedge)
+                    return result
+                fallback = fallback or result
+        if self.stats is not None:
+            self.stats.record_hedge(won=False)
+        return fallback
@@ -1,19 +1,27 @@
 import os
 import json
 import time
+import multiprocessing
 import threading
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import ttk, filedialog, messagebox, simpledialog, scrolledtext
 
-import openai
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font
-
-from app_utils import load_settings, save_settings, log_error, split_text_into_paragraphs, translate_single_paragraph, test_api_connection
+from app_utils import SETTINGS_STORE, load_settings, save_settings, log_error, translate_single_paragraph, test_api_connection, build_paragraph_prompt, request_pacer, RunStats, AdaptiveLimiter, CancelToken, create_client, preload_modules, active_requests
+from batch_jobs import submit_batch_job, check_jobs, job_progress
+from corpus_io import write_translated_text, patch_corpus_cells, find_failed_rows, translated_text_path_for, display_error_value
+from pipeline import TranslationPipeline
+from prompt_templates import TRANSLATION_PLACEHOLDERS, PromptTemplateError, compile_template
+from quality_checks import run_term_compliance, run_quality_estimation
+from sentence_aligner import align_files
+from segment_filter import passthrough_settings
+from term_store import TERM_DIR, TermStore, list_term_files
+from translation_memory import TranslationMemory
 from ui_tools import TermAnnotatorApp, PostEditingWindow
 
 RESUME_FILE = "resume_info.json"
+CLOSE_TIMEOUT = 15
+NO_GLOSSARY = "(None)"
 
 class TranslationApp(tk.Tk):
     def __init__(self):
@@ -24,8 +32,9 @@ class TranslationApp(tk.Tk):
         self.post_editor_window = None
         
 
-        self.stop_requested = threading.Event()
+        self.stop_requested = CancelToken()
         self.is_processing = False
+        self.closing = False
         self.resume_data = None
         self.timer_id = None
         
@@ -34,16 +43,54 @@ class TranslationApp(tk.Tk):
         self._post_ui_setup()
         
         self.protocol("WM_DELETE_WINDOW", self._on_closing)
+        SETTINGS_STORE.on_error = self._on_settings_error
+        SETTINGS_STORE.watch(lambda settings: self.after(0, self._on_settings_changed, settings))
         self.after(100, self._check_for_resume_task)
+        self.after(200, lambda: threading.Thread(target=preload_modules, daemon=True).start())
     
     def _on_closing(self):
+        if self.closing:
+            return
         if self.is_processing:
             if not messagebox.askyesno("Confirm Exit", "A translation task is currently in progress. Exiting now will stop it. Are you sure you want to exit?"):
                 return
             self.stop_requested.set()
-        
+            self._update_status("Stopping and saving progress before exit...", "orange")
+        if self.post_editor_window and self.post_editor_window.winfo_exists() and self.post_editor_window.is_processing:
+            self.post_editor_window.stop_requested.set()
+        self.closing = True
+        self._close_when_idle(time.monotonic() + CLOSE_TIMEOUT)
+
+    def _close_when_idle(self, deadline):
+        # Let the worker thread save its resume state and finish writing outputs before the window goes away.
+        post_editing = self.post_editor_window and self.post_editor_window.winfo_exists() and self.post_editor_window.is_processing
+        # Cancelled requests close their connections on helper threads; exiting earlier would cut them mid-request.
+        if (self.is_processing or post_editing or active_requests()) and time.monotonic() < deadline:
+            self.after(100, self._close_when_idle, deadline)
+            return
         save_settings(self.settings)
+        SETTINGS_STORE.flush()
         self.destroy()
+
+    def _on_settings_error(self, message):
+        log_error(message)
+        if "save" in message:
+            self.after(0, messagebox.showerror, "Error", message)
+
+    def _on_settings_changed(self, settings):
+        # Another process (a CLI worker or a second window) edited settings.json; adopt its values in place
+        # so every window holding a reference to self.settings sees them.
+        self.settings.clear()
+        self.settings.update(settings)
+        SETTINGS_STORE.adopt(settings)
+        self._update_api_provider_combo()
+        self._update_api_key_combo()
+        self._update_model_name_combo()
+        self._update_prompt_combo()
+        if self.post_editor_window and self.post_editor_window.winfo_exists():
+            self.post_editor_window._update_prompt_combo()
+        if not self.is_processing:
+            self._update_status("Settings reloaded from settings.json.", "blue")
     
     def _setup_style(self):
         self.style = ttk.Style(self)
@@ -79,6 +126,15 @@ class TranslationApp(tk.Tk):
         self.menu_bar.add_cascade(label="Tools", menu=tools_menu)
         tools_menu.add_command(label="Term Annotator", command=self._open_annotator)
         tools_menu.add_command(label="Post-editing", command=self._open_post_editor)
+        tools_menu.add_separator()
+        tools_menu.add_command(label="Import Corpus into Translation Memory...", command=self._import_into_translation_memory)
+        tools_menu.add_command(label="Align Existing Translation...", command=self._align_existing_translation)
+        tools_menu.add_command(label="Repair Failed Paragraphs...", command=self._start_repair)
+        tools_menu.add_command(label="Check Terminology Compliance...", command=self._check_term_compliance)
+        tools_menu.add_command(label="Flag Suspicious Translations...", command=self._run_quality_estimation)
+        tools_menu.add_separator()
+        tools_menu.add_command(label="Submit Batch Job...", command=self._submit_batch_job)
+        tools_menu.add_command(label="Check Batch Jobs", command=self._check_batch_jobs)
     
         help_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label="Help", menu=help_menu)
@@ -134,6 +190,15 @@ class TranslationApp(tk.Tk):
         prompt_scrollbar = ttk.Scrollbar(prompt_frame, orient=tk.VERTICAL, command=self.prompt_text.yview)
         prompt_scrollbar.grid(row=1, column=1, sticky="ns")
         self.prompt_text.config(yscrollcommand=prompt_scrollbar.set)
+
+        glossary_frame = ttk.Frame(prompt_frame)
+        glossary_frame.grid(row=2, column=0, columnspan=2, sticky="ew", pady=(5, 0))
+        glossary_frame.columnconfigure(1, weight=1)
+        ttk.Label(glossary_frame, text="Glossary ({terms}):").grid(row=0, column=0, padx=(0, 5))
+        self.glossary_var = tk.StringVar()
+        self.glossary_combo = ttk.Combobox(glossary_frame, textvariable=self.glossary_var, state="readonly", postcommand=self._update_glossary_combo)
+        self.glossary_combo.grid(row=0, column=1, sticky="ew")
+        self.glossary_combo.bind("<<ComboboxSelected>>", self._on_glossary_select)
     
         right_pane.rowconfigure(0, weight=0)
         right_pane.columnconfigure(0, weight=1)
@@ -191,9 +256,31 @@ class TranslationApp(tk.Tk):
         self.api_version_entry.grid(row=1, column=1, sticky="ew", padx=5, pady=2)
     
         ttk.Button(self.azure_settings_frame, text="Save Azure Config", command=self._save_azure_config).grid(row=2, column=1, sticky="e", padx=5, pady=(5,2))
-    
-        self.process_button = ttk.Button(main_frame, text="Start Processing", command=self._start_processing, style="Accent.TButton")
-        self.process_button.grid(row=1, column=0, pady=10, sticky="ew")
+
+        range_frame = ttk.LabelFrame(right_pane, text="Partial Re-translation", padding="10")
+        range_frame.grid(row=1, column=0, sticky="new", pady=(10, 0))
+        range_frame.columnconfigure(1, weight=1)
+        range_frame.columnconfigure(3, weight=1)
+
+        self.range_from_var = tk.StringVar()
+        self.range_to_var = tk.StringVar()
+        ttk.Label(range_frame, text="From:").grid(row=0, column=0, sticky="w", padx=5, pady=5)
+        ttk.Entry(range_frame, textvariable=self.range_from_var, width=8).grid(row=0, column=1, sticky="ew", padx=5, pady=5)
+        ttk.Label(range_frame, text="To:").grid(row=0, column=2, sticky="w", padx=5, pady=5)
+        ttk.Entry(range_frame, textvariable=self.range_to_var, width=8).grid(row=0, column=3, sticky="ew", padx=5, pady=5)
+        ttk.Label(range_frame, text="Leave empty to translate all paragraphs.", foreground="gray").grid(row=1, column=0, columnspan=4, sticky="w", padx=5)
+
+        self.reuse_previous_var = tk.BooleanVar(value=self.settings.get("reuse_previous_translations", False))
+        ttk.Checkbutton(range_frame, text="Reuse translations of unchanged paragraphs from the previous corpus",
+                        variable=self.reuse_previous_var, command=self._on_reuse_previous_toggled).grid(row=2, column=0, columnspan=4, sticky="w", padx=5, pady=(5, 0))
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=1, column=0, pady=10, sticky="ew")
+        button_frame.columnconfigure(0, weight=1)
+        self.process_button = ttk.Button(button_frame, text="Start Processing", command=self._start_processing, style="Accent.TButton")
+        self.process_button.grid(row=0, column=0, sticky="ew")
+        self.pause_button = ttk.Button(button_frame, text="Pause", command=self._toggle_pause, state=tk.DISABLED)
+        self.pause_button.grid(row=0, column=1, sticky="e", padx=(5, 0))
         
         status_bar = ttk.Frame(self)
         status_bar.grid(row=1, column=0, sticky="ew")
@@ -237,6 +324,41 @@ class TranslationApp(tk.Tk):
         
         ttk.Label(content_frame, text="Request Interval (seconds):").grid(row=5, column=0, sticky="w", padx=5, pady=5)
         ttk.Entry(content_frame, textvariable=request_interval, width=15).grid(row=5, column=1, sticky="w", padx=5, pady=5)
+
+        max_workers = tk.IntVar(value=self.settings.get("max_workers", 4))
+        ttk.Label(content_frame, text="Concurrent Requests:").grid(row=9, column=0, sticky="w", padx=5, pady=5)
+        ttk.Entry(content_frame, textvariable=max_workers, width=15).grid(row=9, column=1, sticky="w", padx=5, pady=5)
+
+        adaptive_concurrency = tk.BooleanVar(value=self.settings.get("adaptive_concurrency", False))
+        ttk.Checkbutton(content_frame, text="Adapt concurrency automatically (Concurrent Requests is the upper limit; Request Interval is ignored)",
+                        variable=adaptive_concurrency).grid(row=10, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+
+        cache_friendly = tk.BooleanVar(value=self.settings.get("cache_friendly_prompts", False))
+        ttk.Checkbutton(content_frame, text="Cache-friendly prompts (fixed instructions first, paragraph last)",
+                        variable=cache_friendly).grid(row=11, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+
+        hedging_settings = self.settings.get("hedging", {})
+        hedging_enabled = tk.BooleanVar(value=hedging_settings.get("enabled", False))
+        hedging_budget = tk.DoubleVar(value=hedging_settings.get("budget_percent", 5))
+        hedging_key = tk.StringVar(value=hedging_settings.get("alternate_key_name", ""))
+        provider_keys = list(self.settings['api_providers'].get(self.api_provider_var.get(), {}).get('api_keys', {}).keys())
+        ttk.Checkbutton(content_frame, text="Hedge slow requests (duplicate calls slower than the p95 latency)",
+                        variable=hedging_enabled).grid(row=12, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        ttk.Label(content_frame, text="Hedging Budget (% of requests):").grid(row=13, column=0, sticky="w", padx=5, pady=5)
+        ttk.Entry(content_frame, textvariable=hedging_budget, width=15).grid(row=13, column=1, sticky="w", padx=5, pady=5)
+        ttk.Label(content_frame, text="Hedge With API Key:").grid(row=14, column=0, sticky="w", padx=5, pady=5)
+        ttk.Combobox(content_frame, textvariable=hedging_key, values=[""] + provider_keys, state="readonly", width=13).grid(row=14, column=1, sticky="w", padx=5, pady=5)
+
+        tm_settings = self.settings.get("translation_memory", {})
+        tm_enabled = tk.BooleanVar(value=tm_settings.get("enabled", False))
+        tm_min_similarity = tk.DoubleVar(value=tm_settings.get("min_similarity", 0.75))
+        tm_auto_apply = tk.DoubleVar(value=tm_settings.get("auto_apply_similarity", 1.0))
+
+        ttk.Checkbutton(content_frame, text="Use Translation Memory", variable=tm_enabled).grid(row=6, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        ttk.Label(content_frame, text="TM Reference Similarity (0-1):").grid(row=7, column=0, sticky="w", padx=5, pady=5)
+        ttk.Entry(content_frame, textvariable=tm_min_similarity, width=15).grid(row=7, column=1, sticky="w", padx=5, pady=5)
+        ttk.Label(content_frame, text="TM Skip-API Similarity (0-1):").grid(row=8, column=0, sticky="w", padx=5, pady=5)
+        ttk.Entry(content_frame, textvariable=tm_auto_apply, width=15).grid(row=8, column=1, sticky="w", padx=5, pady=5)
     
         def save_and_close():
             try:
@@ -251,6 +373,25 @@ class TranslationApp(tk.Tk):
                 self.settings['retry_attempts'] = retry_attempts.get()
                 self.settings['paragraph_timeout'] = paragraph_timeout.get()
                 self.settings['request_interval'] = new_interval
+                if max_workers.get() < 1:
+                    messagebox.showerror("Invalid Input", "Concurrent requests must be at least 1.", parent=dialog)
+                    return
+                self.settings['max_workers'] = max_workers.get()
+                self.settings['adaptive_concurrency'] = adaptive_concurrency.get()
+                self.settings['cache_friendly_prompts'] = cache_friendly.get()
+
+                min_similarity, auto_apply = tm_min_similarity.get(), tm_auto_apply.get()
+                if not (0 < min_similarity <= 1 and 0 < auto_apply <= 1):
+                    messagebox.showerror("Invalid Input", "Translation Memory similarities must be between 0 and 1.", parent=dialog)
+                    return
+                tm_settings.update({"enabled": tm_enabled.get(), "min_similarity": min_similarity, "auto_apply_similarity": auto_apply})
+                self.settings['translation_memory'] = tm_settings
+
+                if not 0 <= hedging_budget.get() <= 100:
+                    messagebox.showerror("Invalid Input", "Hedging budget must be between 0 and 100.", parent=dialog)
+                    return
+                hedging_settings.update({"enabled": hedging_enabled.get(), "budget_percent": hedging_budget.get(), "alternate_key_name": hedging_key.get()})
+                self.settings['hedging'] = hedging_settings
                 save_settings(self.settings)
                 messagebox.showinfo("Success", "Settings saved.", parent=dialog)
                 dialog.destroy()
@@ -277,6 +418,171 @@ class TranslationApp(tk.Tk):
             return
         self.post_editor_window = PostEditingWindow(self)
     
+    def _import_into_translation_memory(self):
+        files = filedialog.askopenfilenames(title="Select corpus files to import", filetypes=[("Excel files", "*.xlsx")])
+        if not files:
+            return
+        self._update_status(f"Importing {len(files)} corpus files into the Translation Memory...", "orange")
+        threading.Thread(target=self._import_tm_task, args=(list(files),), daemon=True).start()
+
+    def _import_tm_task(self, files):
+        translation_memory = TranslationMemory()
+        added, failed = 0, 0
+        try:
+            for file_path in files:
+                try:
+                    added += translation_memory.import_corpus(file_path)
+                except Exception as e:
+                    failed += 1
+                    log_error(f"Failed to import '{file_path}' into the Translation Memory: {e}")
+            total = len(translation_memory)
+        finally:
+            translation_memory.close()
+        color = "green" if not failed else "orange"
+        self.after(0, self._update_status, f"Translation Memory: added {added} new segments ({total} total), {failed} files failed.", color)
+    
+    def _align_existing_translation(self):
+        source_path = filedialog.askopenfilename(title="Select the source TXT file", filetypes=[("Text files", "*.txt")])
+        if not source_path:
+            return
+        target_path = filedialog.askopenfilename(title="Select its existing translation (TXT)", filetypes=[("Text files", "*.txt")])
+        if not target_path:
+            return
+        self._update_status(f"Aligning {os.path.basename(source_path)} with {os.path.basename(target_path)}...", "orange")
+        threading.Thread(target=self._align_task, args=(source_path, target_path), daemon=True).start()
+
+    def _align_task(self, source_path, target_path):
+        try:
+            excel_path, total, one_to_one = align_files(source_path, target_path)
+            message = f"Aligned {total} segments ({one_to_one} one-to-one) into {os.path.basename(excel_path)}."
+            if self.settings.get('translation_memory', {}).get('enabled'):
+                translation_memory = TranslationMemory()
+                try:
+                    added = translation_memory.import_corpus(excel_path)
+                finally:
+                    translation_memory.close()
+                message += f" {added} new segments added to the Translation Memory."
+            self.after(0, self._update_status, message, "green")
+        except Exception as e:
+            log_error(f"Alignment of '{source_path}' and '{target_path}' failed: {e}")
+            self.after(0, self._update_status, f"Alignment failed: {e}", "red")
+
+    def _check_term_compliance(self):
+        glossary = self.glossary_var.get()
+        if not glossary or glossary == NO_GLOSSARY:
+            return messagebox.showerror("Error", "Please select a glossary under the prompt editor first.")
+        files = filedialog.askopenfilenames(title="Select corpus files to check", filetypes=[("Excel files", "*.xlsx")])
+        if not files:
+            return
+        self._update_status(f"Checking terminology in {len(files)} files...", "orange")
+        threading.Thread(target=self._term_compliance_task, args=(glossary, list(files)), daemon=True).start()
+
+    def _term_compliance_task(self, glossary, files):
+        try:
+            matcher = self._load_glossary_matcher(glossary)
+
+            total_violations, total_rows = 0, 0
+            for file_path in files:
+                report_path, violations, rows = run_term_compliance(file_path, matcher)
+                total_violations += violations
+                total_rows += rows
+            color = "green" if not total_violations else "orange"
+            self.after(0, self._update_status, f"Terminology check complete: {total_violations} of {total_rows} rows have violations. Reports saved as *_termcheck.xlsx.", color)
+        except Exception as e:
+            log_error(f"Terminology compliance check failed: {e}")
+            self.after(0, self._update_status, f"Terminology check failed: {e}", "red")
+
+    def _submit_batch_job(self):
+        if not self.selected_files: return messagebox.showerror("Error", "Please select TXT files first.")
+        if not self._get_current_api_key(): return messagebox.showerror("Error", "API Key cannot be empty.")
+        if not self.model_name_var.get().strip(): return messagebox.showerror("Error", "Model Name cannot be empty.")
+        if not self.prompt_text.get("1.0", tk.END).strip(): return messagebox.showerror("Error", "Prompt content cannot be empty.")
+        if not self._validate_prompt(): return
+        if not messagebox.askyesno("Submit Batch Job", f"Submit {len(self.selected_files)} files as an offline batch job?\n\nResults usually arrive within 24 hours. Use Tools > Check Batch Jobs to download them."):
+            return
+        self._update_status(f"Building batch requests for {len(self.selected_files)} files...", "orange")
+        threading.Thread(target=self._submit_batch_task, args=(list(self.selected_files),), daemon=True).start()
+
+    def _submit_batch_task(self, files):
+        try:
+            prompt_template = compile_template(self.prompt_text.get("1.0", tk.END).strip(), TRANSLATION_PLACEHOLDERS)
+            term_matcher = self._load_glossary_matcher(self.glossary_var.get())
+            provider = self.api_provider_var.get()
+            key_name = self.api_key_var.get().strip()
+            job = submit_batch_job(
+                self._create_client(), files, prompt_template, self.model_name_var.get().strip(), self.settings,
+                term_matcher, provider, key_name=key_name if key_name in self.settings['api_providers'].get(provider, {}).get('api_keys', {}) else None
+            )
+            self.after(0, self._update_status, f"Batch job {job['id']} submitted ({len(job['batches'])} batches).", "green")
+        except Exception as e:
+            log_error(f"Batch submission failed: {e}")
+            self.after(0, self._update_status, f"Batch submission failed: {e}", "red")
+
+    def _check_batch_jobs(self):
+        if not self._get_current_api_key(): return messagebox.showerror("Error", "API Key cannot be empty.")
+        self._update_status("Checking batch jobs...", "orange")
+        threading.Thread(target=self._check_batch_task, daemon=True).start()
+
+    def _batch_client_for(self, clients):
+        def client_for(job):
+            # Jobs are checked with the provider they were submitted to, not the one selected now.
+            provider = job.get('provider') or self.api_provider_var.get()
+            if provider not in clients:
+                if provider == self.api_provider_var.get():
+                    api_key = self._get_current_api_key()
+                else:
+                    saved_keys = self.settings['api_providers'].get(provider, {}).get('api_keys', {})
+                    api_key = saved_keys.get(job.get('key_name')) or next(iter(saved_keys.values()), None)
+                    if not api_key:
+                        raise ValueError(f"no API key is saved for {provider}.")
+                clients[provider] = create_client(self.settings, provider, api_key)
+            return clients[provider]
+        return client_for
+
+    def _check_batch_task(self):
+        clients = {}
+        try:
+            pending, collected = check_jobs(self._batch_client_for(clients))
+            lines = [job_progress(job) for job in pending]
+            for job, written in collected:
+                failed = sum(count for _, count in written)
+                lines.append(f"{job['id']}: collected {len(written)} files" + (f", {failed} failed paragraphs" if failed else ""))
+            if not lines:
+                self.after(0, self._update_status, "No open batch jobs.", "green")
+                return
+            color = "orange" if pending else "green"
+            self.after(0, self._update_status, f"Batch jobs: {len(pending)} pending, {len(collected)} collected.", color)
+            self.after(0, lambda: messagebox.showinfo("Batch Jobs", "\n".join(lines), parent=self))
+        except Exception as e:
+            log_error(f"Batch job check failed: {e}")
+            self.after(0, self._update_status, f"Batch job check failed: {e}", "red")
+        finally:
+            for client in clients.values():
+                client.close()
+
+    def _run_quality_estimation(self):
+        files = filedialog.askopenfilenames(title="Select corpus files to check", filetypes=[("Excel files", "*.xlsx")])
+        if not files:
+            return
+        self._update_status(f"Checking translation quality in {len(files)} files...", "orange")
+        threading.Thread(target=self._quality_estimation_task, args=(list(files),), daemon=True).start()
+
+    def _quality_estimation_task(self, files):
+        try:
+            total_flagged, total_rows, by_signal = 0, 0, {}
+            for file_path in files:
+                report_path, flagged, rows, counts = run_quality_estimation(file_path)
+                total_flagged += flagged
+                total_rows += rows
+                for name, count in counts.items():
+                    by_signal[name] = by_signal.get(name, 0) + int(count)
+            details = ", ".join(f"{name}: {count}" for name, count in by_signal.items() if count)
+            color = "green" if not total_flagged else "orange"
+            self.after(0, self._update_status, f"Quality check complete: {total_flagged} of {total_rows} rows flagged" + (f" ({details})" if details else "") + ". Reports saved as *_qe.xlsx.", color)
+        except Exception as e:
+            log_error(f"Quality estimation failed: {e}")
+            self.after(0, self._update_status, f"Quality check failed: {e}", "red")
+
     def _post_ui_setup(self):
         self._update_prompt_combo()
         if self.settings['prompts']:
@@ -284,6 +590,9 @@ class TranslationApp(tk.Tk):
             self.prompt_var.set(first_prompt_name)
             self._on_prompt_select()
         
+        glossary = self.settings.get('translation_glossary', "")
+        self.glossary_var.set(glossary if glossary in list_term_files() else NO_GLOSSARY)
+
         self._update_api_provider_combo()
         if self.settings.get('api_providers'):
             first_provider = list(self.settings['api_providers'].keys())[0]
@@ -492,39 +801,20 @@ SOFTWARE."""
             self.model_name_var.set("")
     
     def _create_client(self):
-        provider_name = self.api_provider_var.get()
-        api_key = self._get_current_api_key()
-    
-        if not provider_name:
-            raise ValueError("API Provider must be selected.")
+        return create_client(self.settings, self.api_provider_var.get(), self._get_current_api_key())
+
+    def _create_hedge_client(self):
+        hedging = self.settings.get('hedging', {})
+        if not hedging.get('enabled'):
+            return None
+        provider = hedging.get('alternate_provider') or self.api_provider_var.get()
+        key_name = hedging.get('alternate_key_name')
+        if not key_name and provider == self.api_provider_var.get():
+            return None
+        api_key = self.settings['api_providers'].get(provider, {}).get('api_keys', {}).get(key_name)
         if not api_key:
-            raise ValueError("API Key is required.")
-    
-        provider_config = self.settings['api_providers'][provider_name]
-    
-        if provider_name == "OpenAI (Azure)":
-            azure_endpoint = provider_config.get('azure_endpoint')
-            api_version = provider_config.get('api_version')
-            if not azure_endpoint or not api_version:
-                raise ValueError("Azure Endpoint and API Version must be configured.")
-            return openai.AzureOpenAI(
-                api_key=api_key,
-                azure_endpoint=azure_endpoint,
-                api_version=api_version,
-            )
-        elif provider_name == "DeepSeek (Azure)":
-            azure_endpoint = provider_config.get('azure_endpoint')
-            if not azure_endpoint:
-                raise ValueError("Azure Endpoint must be configured.")
-            return openai.OpenAI(
-                api_key=api_key, 
-                base_url=azure_endpoint
-            )
-        else:
-            base_url = provider_config.get('base_url')
-            if not base_url:
-                raise ValueError(f"Base URL for '{provider_name}' is not configured.")
-            return openai.OpenAI(api_key=api_key, base_url=base_url)
+            raise ValueError(f"Hedging API key '{key_name}' is not saved for {provider}.")
+        return create_client(self.settings, provider, api_key)
     
     def _test_api_connection(self):
         model_name = self.model_name_var.get().strip()
@@ -551,6 +841,14 @@ SOFTWARE."""
     def _update_api_provider_combo(self):
         self.api_provider_combo['values'] = list(self.settings.get('api_providers', {}).keys())
     
+    def _update_glossary_combo(self):
+        self.glossary_combo['values'] = [NO_GLOSSARY] + list_term_files()
+
+    def _on_glossary_select(self, event=None):
+        name = self.glossary_var.get()
+        self.settings['translation_glossary'] = "" if name == NO_GLOSSARY else name
+        save_settings(self.settings)
+
     def _update_prompt_combo(self):
         self.prompt_combo['values'] = list(self.settings['prompts'].keys())
     
@@ -604,7 +902,22 @@ SOFTWARE."""
     def _update_status(self, text, color):
         self.status_label.config(text=text, foreground=color)
         self.update_idletasks()
-    
+
+    def _on_reuse_previous_toggled(self):
+        self.settings['reuse_previous_translations'] = self.reuse_previous_var.get()
+        save_settings(self.settings)
+
+    def _get_paragraph_range(self):
+        first_text = self.range_from_var.get().strip()
+        last_text = self.range_to_var.get().strip()
+        if not first_text and not last_text:
+            return None
+        first = int(first_text) if first_text else 1
+        last = int(last_text) if last_text else None
+        if first < 1 or (last is not None and last < first):
+            raise ValueError("Paragraph range must start at 1 or later and end after it starts.")
+        return (first - 1, last)
+
     def _update_timer(self, start_time):
         elapsed = time.time() - start_time
         mins, secs = divmod(elapsed, 60)
@@ -641,16 +954,23 @@ SOFTWARE."""
         self.file_listbox.delete(0, tk.END)
         for f in self.selected_files:
             self.file_listbox.insert(tk.END, os.path.basename(f))
+
+        paragraph_range = data.get('paragraph_range')
+        self.range_from_var.set(str(paragraph_range[0] + 1) if paragraph_range else "")
+        self.range_to_var.set(str(paragraph_range[1]) if paragraph_range and paragraph_range[1] is not None else "")
         
         self._update_status(f"Ready to resume. {len(self.selected_files)} files loaded.", "blue")
         messagebox.showinfo("Resume Ready", "The previous task has been loaded. Click 'Start Processing' to continue.")
     
-    def _save_resume_state(self, current_file, last_index, translated_paras, all_files):
+    def _save_resume_state(self, current_file, last_index, translated_paras, all_files, paragraph_range=None, translated_origins=None, partial_path=None):
         state = {
             'current_file': current_file,
             'last_paragraph_index': last_index,
+            'partial_path': partial_path,
             'translated_paragraphs': translated_paras,
-            'all_files': all_files
+            'translated_origins': translated_origins,
+            'all_files': all_files,
+            'paragraph_range': list(paragraph_range) if paragraph_range else None
         }
         try:
             with open(RESUME_FILE, 'w', encoding='utf-8') as f:
@@ -663,126 +983,182 @@ SOFTWARE."""
         if not self._get_current_api_key(): return messagebox.showerror("Error", "API Key cannot be empty.")
         if not self.model_name_var.get().strip(): return messagebox.showerror("Error", "Model Name cannot be empty.")
         if not self.prompt_text.get("1.0", tk.END).strip(): return messagebox.showerror("Error", "Prompt content cannot be empty.")
+        if not self._validate_prompt(): return
+        try:
+            self._get_paragraph_range()
+        except ValueError as e:
+            return messagebox.showerror("Invalid Paragraph Range", str(e))
     
         self.is_processing = True
         self.stop_requested.clear()
         self.process_button.config(text="Stop Processing", command=self._stop_processing)
+        self.pause_button.config(text="Pause", state=tk.NORMAL)
         self._update_status("Processing, please wait...", "orange")
     
         threading.Thread(target=self._processing_task, args=(self.resume_data,), daemon=True).start()
         self.resume_data = None
     
+    def _validate_prompt(self):
+        try:
+            compile_template(self.prompt_text.get("1.0", tk.END).strip(), TRANSLATION_PLACEHOLDERS)
+            return True
+        except PromptTemplateError as e:
+            messagebox.showerror("Invalid Prompt", str(e))
+            return False
+
     def _stop_processing(self):
         self.stop_requested.set()
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
         self._cancel_timer()
         self._update_status("Stopping...", "orange")
+
+    def _toggle_pause(self):
+        if self.stop_requested.paused:
+            self.stop_requested.resume()
+            self.pause_button.config(text="Pause")
+            self._update_status("Resumed.", "orange")
+        else:
+            self.stop_requested.pause()
+            self.pause_button.config(text="Resume")
+            self._update_status("Paused. Requests already sent will finish; no new ones start until you resume.", "blue")
+
+    def _finish_task_buttons(self):
+        self.process_button.config(text="Start Processing", command=self._start_processing)
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
     
-    def _processing_task(self, resume_data=None):
+    def _start_repair(self):
+        if self.is_processing: return messagebox.showerror("Error", "A task is already running.")
+        if not self._get_current_api_key(): return messagebox.showerror("Error", "API Key cannot be empty.")
+        if not self.model_name_var.get().strip(): return messagebox.showerror("Error", "Model Name cannot be empty.")
+        if not self.prompt_text.get("1.0", tk.END).strip(): return messagebox.showerror("Error", "Prompt content cannot be empty.")
+        if not self._validate_prompt(): return
+        files = filedialog.askopenfilenames(title="Select corpus files to repair", filetypes=[("Excel files", "*_corpus.xlsx"), ("Excel files", "*.xlsx")])
+        if not files:
+            return
+
+        self.is_processing = True
+        self.stop_requested.clear()
+        self.process_button.config(text="Stop Processing", command=self._stop_processing)
+        self.pause_button.config(text="Pause", state=tk.NORMAL)
+        self._update_status("Scanning corpus files for failed paragraphs...", "orange")
+        threading.Thread(target=self._repair_task, args=(list(files),), daemon=True).start()
+
+    def _repair_task(self, files):
+        client = None
         try:
             model_name = self.model_name_var.get().strip()
-            user_prompt_template = self.prompt_text.get("1.0", tk.END).strip()
+            user_prompt_template = compile_template(self.prompt_text.get("1.0", tk.END).strip(), TRANSLATION_PLACEHOLDERS)
             context_before = self.settings.get('context_before', 1)
             context_after = self.settings.get('context_after', 1)
             max_tokens_value = self.settings.get('max_tokens', 8000)
             retry_attempts_value = self.settings.get('retry_attempts', 3)
             paragraph_timeout_value = self.settings.get('paragraph_timeout', 300)
-            request_interval_value = self.settings.get('request_interval', 5)
-    
+            pacer = request_pacer(self.settings)
+            cache_friendly = self.settings.get('cache_friendly_prompts', False)
+            term_matcher = self._load_glossary_matcher(self.glossary_var.get())
             client = self._create_client()
-    
-            total_files = len(self.selected_files)
-            start_file_index = 0
-            if resume_data:
-                try:
-                    start_file_index = self.selected_files.index(resume_data.get('current_file'))
-                except ValueError:
-                    log_error(f"Resumed file '{resume_data.get('current_file')}' not found in selection.")
-    
-            for i in range(start_file_index, total_files):
-                file_path = self.selected_files[i]
-                file_name = os.path.basename(file_path)
-                dir_name = os.path.splitext(file_name)[0]
-                output_dir = os.path.join(os.path.dirname(file_path), dir_name)
-                os.makedirs(output_dir, exist_ok=True)
-                
-                self.after(0, self._update_status, f"[{i+1}/{total_files}] Reading: {file_name}", "orange")
-    
-                with open(file_path, 'r', encoding='utf-8') as f: original_text = f.read()
-                
-                paragraphs = split_text_into_paragraphs(original_text)
-                if not paragraphs:
-                    log_error(f"File {file_name} is empty or contains no valid paragraphs, skipped.")
-                    continue
-    
-                translated_paragraphs, total_paragraphs = [], len(paragraphs)
-                start_paragraph_index = 0
-    
-                if resume_data and file_path == resume_data.get('current_file'):
-                    start_paragraph_index = resume_data.get('last_paragraph_index', -1) + 1
-                    translated_paragraphs = resume_data.get('translated_paragraphs', [])
-                    resume_data = None
-                
-                for j in range(start_paragraph_index, total_paragraphs):
+            stats = RunStats()
+            max_workers = max(1, self.settings.get('max_workers', 4))
+            limiter = AdaptiveLimiter(max_workers) if self.settings.get('adaptive_concurrency') else None
+
+            def repair_one(paragraphs, j, source_name):
+                if not pacer.wait(self.stop_requested):
+                    return None
+                full_prompt = build_paragraph_prompt(user_prompt_template, paragraphs, j, context_before, context_after, term_matcher, cache_friendly=cache_friendly, file_name=source_name)
+                return translate_single_paragraph(client, model_name, full_prompt, max_tokens_value, retry_attempts_value, paragraph_timeout_value, stats, self.stop_requested, limiter)
+
+            total_repaired, total_failed_again = 0, 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for i, excel_path in enumerate(files):
+                    file_name = os.path.basename(excel_path)
+                    paragraphs, failed_rows = find_failed_rows(excel_path)
+                    if not failed_rows:
+                        continue
+
+                    source_name = file_name.replace("_corpus.xlsx", ".txt")
+                    futures = {executor.submit(repair_one, paragraphs, j, source_name): j for j in failed_rows}
+                    patched = {}
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        result = future.result()
+                        if result is not None:
+                            patched[futures[future]] = result
+                        self.after(0, self._update_status, f"[{i+1}/{len(files)}] Repairing {file_name} ({done}/{len(failed_rows)})", "orange")
+                        if self.stop_requested.is_set():
+                            for pending in futures:
+                                pending.cancel()
+
+                    if patched:
+                        all_translations = patch_corpus_cells(excel_path, patched)
+                        txt_path = translated_text_path_for(excel_path)
+                        if txt_path and os.path.exists(txt_path):
+                            write_translated_text(txt_path, all_translations)
+                    still_failed = sum(1 for t in patched.values() if display_error_value(t) is not None)
+                    total_repaired += len(patched) - still_failed
+                    total_failed_again += still_failed + (len(failed_rows) - len(patched))
+
                     if self.stop_requested.is_set():
-                        self._save_resume_state(file_path, j - 1, translated_paragraphs, self.selected_files)
-                        self.after(0, self._update_status, f"Processing stopped. Progress for '{file_name}' saved.", "blue")
+                        self.after(0, self._update_status, f"Repair stopped. {total_repaired} paragraphs repaired so far.", "blue")
                         return
-    
-                    self.after(0, self._update_status, f"[{i+1}/{total_files}] Translating {file_name} paragraph ({j+1}/{total_paragraphs})", "orange")
-                    
-                    start_time = time.time()
-                    self.after(0, self._update_timer, start_time)
-    
-                    context_parts = []
-                    start = max(0, j - context_before)
-                    if start < j: context_parts.extend(["[Previous Context]"] + paragraphs[start:j] + [""])
-                    
-                    context_parts.extend(["[Text to Translate]", paragraphs[j]])
-                    
-                    end = min(total_paragraphs, j + 1 + context_after)
-                    if j + 1 < end: context_parts.extend(["\n[Next Context]"] + paragraphs[j+1:end])
-    
-                    full_prompt = user_prompt_template.format(context="\n".join(context_parts))
-                    translated_para = translate_single_paragraph(client, model_name, full_prompt, max_tokens_value, retry_attempts_value, paragraph_timeout_value)
-                    
-                    self.after(0, self._cancel_timer)
-                    translated_paragraphs.append(translated_para)
-
-                    if request_interval_value > 0 and j < total_paragraphs - 1:
-                        time.sleep(request_interval_value)
-    
-                full_translated_text = "\n\n".join(translated_paragraphs)
-                translated_file_path = os.path.join(output_dir, f"{dir_name}_translated.txt")
-                with open(translated_file_path, 'w', encoding='utf-8') as f: f.write(full_translated_text)
-    
-                self.after(0, self._update_status, f"[{i+1}/{total_files}] Generating Excel file...", "orange")
-                df = pd.DataFrame({'Source': paragraphs, 'Translation': translated_paragraphs})
-                excel_path = os.path.join(output_dir, f"{dir_name}_corpus.xlsx")
-                df.to_excel(excel_path, index=False, engine='openpyxl')
-                
-                red_bold_font = Font(color="FF0000", bold=True)
-                wb = load_workbook(excel_path)
-                ws = wb.active
-                for row in ws.iter_rows(min_row=2, max_col=ws.max_column, max_row=ws.max_row):
-                    cell = row[1]
-                    if not isinstance(cell.value, str): continue
-                    if cell.value == "[ERROR_CONTENT_FILTER]":
-                        cell.value = "Rejected by API (content policy)"
-                        cell.font = red_bold_font
-                    elif cell.value == "[ERROR_NETWORK]":
-                        cell.value = "Network Issue"
-                        cell.font = red_bold_font
-                    elif cell.value.startswith("[ERROR_OTHER:"):
-                        cell.value = f"Failed: {cell.value[13:-3]}"
-                        cell.font = red_bold_font
-                wb.save(excel_path)
-    
+
+            color = "green" if not total_failed_again else "orange"
+            summary = ", ".join(part for part in (stats.summary(), limiter.summary() if limiter else "") if part)
+            self.after(0, self._update_status, f"Repair complete: {total_repaired} paragraphs repaired, {total_failed_again} still failing." + (f" ({summary})" if summary else ""), color)
+
+        except Exception as e:
+            log_error(f"Repair task failed: {e}")
+            self.after(0, self._update_status, f"Repair failed: {e}", "red")
+            self.after(0, messagebox.showerror, "An Error Occurred", f"{e}\n\nDetailed information has been logged to error_log.txt")
+
+        finally:
+            if client is not None:
+                client.close()
+            self.is_processing = False
+            self.after(0, self._finish_task_buttons)
+
+    def _load_glossary_matcher(self, glossary):
+        if not glossary or glossary == NO_GLOSSARY:
+            return None
+        term_store = TermStore(os.path.join(TERM_DIR, glossary))
+        try:
+            return term_store.matcher()
+        finally:
+            term_store.close()
+
+    def _processing_task(self, resume_data=None):
+        translation_memory, client, hedge_client = None, None, None
+        try:
+            model_name = self.model_name_var.get().strip()
+            user_prompt_template = self.prompt_text.get("1.0", tk.END).strip()
+            paragraph_range = self._get_paragraph_range()
+            reuse_previous = self.reuse_previous_var.get()
+            term_matcher = self._load_glossary_matcher(self.glossary_var.get())
+            translation_memory = TranslationMemory() if self.settings.get('translation_memory', {}).get('enabled') else None
+            client = self._create_client()
+            hedge_client = self._create_hedge_client()
+
+            pipeline = TranslationPipeline(
+                client, model_name, user_prompt_template, self.settings, term_matcher, translation_memory,
+                on_status=lambda message, color: self.after(0, self._update_status, message, color),
+                hedge_client=hedge_client, passthrough=passthrough_settings(self.settings, self.prompt_var.get())
+            )
+            self.after(0, self._update_timer, time.time())
+            resume_state = pipeline.run(self.selected_files, paragraph_range, reuse_previous, resume_data, self.stop_requested)
+
+            if resume_state:
+                self._save_resume_state(
+                    resume_state['current_file'], resume_state['last_paragraph_index'], resume_state['translated_paragraphs'],
+                    self.selected_files, paragraph_range, resume_state['translated_origins'], resume_state['partial_path']
+                )
+                self.after(0, self._update_status, f"Processing stopped. Progress for '{os.path.basename(resume_state['current_file'])}' saved.", "blue")
+                return
+
             if os.path.exists(RESUME_FILE):
                 os.remove(RESUME_FILE)
     
             save_settings(self.settings)
     
-            self.after(0, self._update_status, "Processing complete! All files have been saved in their respective folders.", "green")
+            summary = pipeline.summary()
+            self.after(0, self._update_status, "Processing complete! All files have been saved in their respective folders." + (f" ({summary})" if summary else ""), "green")
     
         except Exception as e:
             error_message = f"Processing failed: {e}"
@@ -791,10 +1167,17 @@ SOFTWARE."""
             self.after(0, messagebox.showerror, "An Error Occurred", f"{e}\n\nDetailed information has been logged to error_log.txt")
         
         finally:
+            if translation_memory:
+                translation_memory.close()
+            for api_client in (client, hedge_client):
+                if api_client is not None:
+                    api_client.close()
             self.is_processing = False
-            self.after(0, lambda: self.process_button.config(text="Start Processing", command=self._start_processing))
+            self.after(0, self._finish_task_buttons)
             self.after(0, self._cancel_timer)
 
 if __name__ == "__main__":
+    # Spawned preprocessing workers of the frozen Windows build must not start another window.
+    multiprocessing.freeze_support()
     app = TranslationApp()
     app.mainloop()
\ No newline at end of file
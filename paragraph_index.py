@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import hashlib
+from difflib import SequenceMatcher
+
+INDEX_VERSION = 1
+_PARAGRAPH_PATTERN = re.compile(rb'[^\r\n]+')
+
+
+def hash_paragraph(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def index_path_for(output_dir, dir_name):
+    return os.path.join(output_dir, f"{dir_name}_index.json")
+
+
+def split_file_with_index(file_path):
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    paragraphs, entries = [], []
+    for match in _PARAGRAPH_PATTERN.finditer(data):
+        raw = match.group().decode('utf-8')
+        stripped = raw.strip()
+        if not stripped:
+            continue
+        leading = len(raw) - len(raw.lstrip())
+        offset = match.start() + len(raw[:leading].encode('utf-8'))
+        paragraphs.append(stripped)
+        entries.append([offset, len(stripped.encode('utf-8')), hash_paragraph(stripped)])
+
+    index = {
+        'version': INDEX_VERSION,
+        'source_file': os.path.abspath(file_path),
+        'size': len(data),
+        'mtime': os.path.getmtime(file_path),
+        'paragraphs': entries,
+    }
+    return paragraphs, index
+
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            return None
+        return index
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def save_index(index_path, index):
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+
+def is_index_current(index, file_path):
+    if not index:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime
+
+
+def read_paragraphs(file_path, index, start, end):
+    entries = index['paragraphs'][start:end]
+    if not entries:
+        return []
+    texts = []
+    with open(file_path, 'rb') as f:
+        for offset, length, _ in entries:
+            f.seek(offset)
+            texts.append(f.read(length).decode('utf-8'))
+    return texts
+
+
+class ParagraphWindow:
+
+    def __init__(self, total, start, texts):
+        self.total = total
+        self.start = start
+        self.texts = texts
+
+    def __len__(self):
+        return self.total
+
+    def _check(self, i):
+        if not self.start <= i < self.start + len(self.texts):
+            raise IndexError(f"Paragraph {i} is outside the loaded window.")
+        return i - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.total)
+            if start >= stop:
+                return []
+            return self.texts[self._check(start):self._check(stop - 1) + 1:step]
+        if key < 0:
+            key += self.total
+        return self.texts[self._check(key)]
+
+
+def load_paragraph_window(file_path, index, start, end):
+    return ParagraphWindow(len(index['paragraphs']), start, read_paragraphs(file_path, index, start, end))
+
+
+def match_previous_translations(paragraphs, previous_sources, previous_translations, is_reusable=None):
+    new_hashes = [hash_paragraph(p) for p in paragraphs]
+    old_hashes = [hash_paragraph(str(p)) for p in previous_sources]
+    reused = [None] * len(new_hashes)
+
+    matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag != 'equal':
+            continue
+        for offset in range(new_end - new_start):
+            translation = previous_translations[old_start + offset]
+            if translation and (is_reusable is None or is_reusable(translation)):
+                reused[new_start + offset] = translation
+    return reused
@@ -0,0 +1,568 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from app_utils import log_error, build_paragraph_prompt, translate_single_paragraph, request_pacer, RunStats, AdaptiveLimiter, SingleFlight
+from corpus_io import (
+    corpus_paths, read_corpus, write_corpus, write_translated_text, patch_corpus_rows, count_corpus_rows, SheetAppender, open_sheet_rows,
+    cell_text, display_error_value, is_error_display_value
+)
+from hedging import HedgedTranslator
+from paragraph_index import (
+    index_path_for, split_file_with_index, load_index, save_index, is_index_current,
+    load_paragraph_window, match_previous_translations
+)
+from prompt_templates import compile_template
+from segment_filter import SegmentFilter
+from term_store import TermMatcher
+from translation_memory import format_tm_references
+
+REORDER_LIMIT = 2000
+TM_BATCH_ROWS = 500
+
+_worker_state = {}
+
+
+def _init_preprocess_worker(prompt_template, context_before, context_after, terms, pattern_source, cache_friendly, passthrough=None):
+    _worker_state['prompt_template'] = compile_template(prompt_template)
+    _worker_state['cache_friendly'] = cache_friendly
+    _worker_state['context_before'] = context_before
+    _worker_state['context_after'] = context_after
+    _worker_state['term_matcher'] = TermMatcher(terms, pattern_source) if terms is not None else None
+    _worker_state['segment_filter'] = SegmentFilter.from_settings(passthrough)
+
+
+def prepare_file(file_path, paragraph_range, reuse_previous):
+    context_before = _worker_state['context_before']
+    context_after = _worker_state['context_after']
+    file_name = os.path.basename(file_path)
+    dir_name = os.path.splitext(file_name)[0]
+    output_dir = os.path.join(os.path.dirname(file_path), dir_name)
+    os.makedirs(output_dir, exist_ok=True)
+    translated_file_path, excel_path = corpus_paths(output_dir, dir_name)
+    plan = {
+        'file_path': file_path, 'file_name': file_name, 'translated_file_path': translated_file_path,
+        'excel_path': excel_path, 'index_path': index_path_for(output_dir, dir_name), 'skip': None
+    }
+
+    previous_index = load_index(plan['index_path'])
+    if is_index_current(previous_index, file_path):
+        paragraphs, index = None, previous_index
+    else:
+        paragraphs, index = split_file_with_index(file_path)
+
+    total_paragraphs = len(index['paragraphs'])
+    if not total_paragraphs:
+        plan['skip'] = f"File {file_name} is empty or contains no valid paragraphs, skipped."
+        return plan
+
+    first_paragraph, last_paragraph = 0, total_paragraphs
+    patch_existing = False
+    if paragraph_range:
+        first_paragraph = min(paragraph_range[0], total_paragraphs)
+        if paragraph_range[1] is not None:
+            last_paragraph = min(paragraph_range[1], total_paragraphs)
+        if first_paragraph >= last_paragraph:
+            plan['skip'] = f"File {file_name} has only {total_paragraphs} paragraphs; the selected range is empty, skipped."
+            return plan
+        if os.path.exists(excel_path) and not reuse_previous:
+            # The corpus itself decides whether a range can be patched in; it may predate the paragraph index.
+            try:
+                corpus_rows = count_corpus_rows(excel_path)
+            except Exception as e:
+                plan['skip'] = f"File {file_name} skipped: the existing corpus could not be read to patch the range into: {e}"
+                return plan
+            if corpus_rows != total_paragraphs:
+                plan['skip'] = f"File {file_name} skipped: the existing corpus has {corpus_rows} rows but the file has {total_paragraphs} paragraphs, so a range cannot be patched into it."
+                return plan
+            patch_existing = True
+
+    if paragraphs is None:
+        if patch_existing:
+            window_start = max(0, first_paragraph - context_before)
+            window_end = min(total_paragraphs, last_paragraph + context_after)
+            paragraphs = load_paragraph_window(file_path, index, window_start, window_end)
+        else:
+            paragraphs, index = split_file_with_index(file_path)
+
+    reused_translations = [None] * total_paragraphs
+    if reuse_previous and os.path.exists(excel_path):
+        try:
+            previous_sources, previous_translations = read_corpus(excel_path)
+            reused_translations = match_previous_translations(
+                paragraphs, previous_sources, previous_translations,
+                is_reusable=lambda t: not is_error_display_value(t)
+            )
+        except Exception as e:
+            log_error(f"Could not read previous corpus for {file_name}, translating all paragraphs: {e}")
+
+    passthrough = {}
+    if _worker_state['segment_filter']:
+        passthrough = _worker_state['segment_filter'].classify_range(
+            paragraphs, first_paragraph, last_paragraph, skip=lambda j: reused_translations[j] is not None
+        )
+
+    plan.update(
+        paragraphs=paragraphs, index=index, total=total_paragraphs, first=first_paragraph, last=last_paragraph,
+        patch_existing=patch_existing, reused=reused_translations, passthrough=passthrough,
+        prompts={
+            j: build_paragraph_prompt(
+                _worker_state['prompt_template'], paragraphs, j, context_before, context_after,
+                _worker_state['term_matcher'], cache_friendly=_worker_state['cache_friendly'], file_name=file_name
+            )
+            for j in range(first_paragraph, last_paragraph) if reused_translations[j] is None and j not in passthrough
+        }
+    )
+    return plan
+
+
+def write_file_outputs(plan, translated_paragraphs, translated_origins, write_origins):
+    first_paragraph, last_paragraph, total_paragraphs = plan['first'], plan['last'], plan['total']
+    if plan['patch_existing']:
+        # Source cells are rewritten too, in case the paragraphs were edited since the corpus was written.
+        sources = [plan['paragraphs'][j] for j in range(first_paragraph, first_paragraph + len(translated_paragraphs))]
+        all_translations = patch_corpus_rows(plan['excel_path'], first_paragraph, translated_paragraphs, translated_origins, sources)
+        write_translated_text(plan['translated_file_path'], all_translations)
+    else:
+        all_translations = [""] * first_paragraph + translated_paragraphs + [""] * (total_paragraphs - last_paragraph)
+        origins = [""] * first_paragraph + translated_origins + [""] * (total_paragraphs - last_paragraph)
+        for k in list(range(first_paragraph)) + list(range(last_paragraph, total_paragraphs)):
+            if plan['reused'][k] is not None:
+                all_translations[k] = plan['reused'][k]
+                origins[k] = "reused"
+        write_translated_text(plan['translated_file_path'], all_translations)
+        write_corpus(plan['excel_path'], plan['paragraphs'], all_translations, origins if write_origins else None)
+    save_index(plan['index_path'], plan['index'])
+    return plan['file_name']
+
+
+def partial_output_paths(plan):
+    return (
+        plan['translated_file_path'][:-len(".txt")] + ".partial.txt",
+        plan['excel_path'][:-len(".xlsx")] + ".partial.xlsx",
+    )
+
+
+class OrderedOutputSink:
+
+    def __init__(self, plan, write_origins, collect_pairs=False):
+        # Completions arrive in any order; a row is appended to the TXT and the corpus only once every row
+        # before it is there, so the files on disk always hold a complete prefix of the output.
+        self.plan = plan
+        self.write_origins = write_origins
+        self.text_path, self.excel_path = partial_output_paths(plan)
+        self.writer = SheetAppender(
+            self.excel_path, ['Source', 'Translation'] + (['Origin'] if write_origins else []),
+            error_columns=[1], text_path=self.text_path, text_column=1
+        )
+        self.buffer = {}
+        self.next_index = 0
+        self.completed = 0
+        self.memory_pairs = [] if collect_pairs else None
+        self._advance()
+
+    @property
+    def buffered(self):
+        return len(self.buffer)
+
+    @property
+    def written_in_range(self):
+        return min(max(0, self.next_index - self.plan['first']), self.plan['last'] - self.plan['first'])
+
+    def put(self, j, translation, origin):
+        self.completed += 1
+        self.buffer[j] = (translation, origin)
+        if j == self.next_index:
+            self._advance()
+
+    def _advance(self):
+        plan = self.plan
+        while self.next_index < plan['total']:
+            j = self.next_index
+            if plan['first'] <= j < plan['last']:
+                if j not in self.buffer:
+                    break
+                translation, origin = self.buffer.pop(j)
+                if self.memory_pairs is not None and origin == "translated" and display_error_value(translation) is None:
+                    self.memory_pairs.append((plan['paragraphs'][j], translation))
+            elif plan['reused'][j] is not None:
+                translation, origin = plan['reused'][j], "reused"
+            else:
+                translation, origin = "", ""
+            self.writer.append([plan['paragraphs'][j], translation] + ([origin] if self.write_origins else []))
+            self.next_index += 1
+        self.writer.flush()
+
+    def take_memory_pairs(self):
+        pairs, self.memory_pairs = self.memory_pairs, []
+        return pairs
+
+    def close(self):
+        self.writer.close(self.plan['excel_path'], self.plan['translated_file_path'])
+        # A partial corpus left by an earlier stop of this file is superseded by the complete one.
+        if os.path.exists(self.excel_path):
+            os.remove(self.excel_path)
+        save_index(self.plan['index_path'], self.plan['index'])
+        return self.plan['file_name']
+
+    def close_partial(self):
+        self.writer.close()
+        return self.excel_path
+
+    def discard(self, remove_partial=False):
+        self.writer.discard()
+        if remove_partial:
+            for path in (self.text_path, self.excel_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def resumed_rows(plan, resume_data):
+    # Stopped runs keep their finished rows in the partial corpus; range patches and resume files written by
+    # older versions carry them as lists instead.
+    if resume_data.get('partial_path') is None:
+        resumed = resume_data.get('translated_paragraphs', [])
+        origins = resume_data.get('translated_origins') or ["translated"] * len(resumed)
+        for k, translation in enumerate(resumed):
+            yield plan['first'] + k, translation, origins[k]
+        return
+    last_index = resume_data.get('last_paragraph_index')
+    if last_index is None:
+        return
+    if not os.path.exists(resume_data['partial_path']):
+        raise ValueError(f"The partial output of the interrupted task ({resume_data['partial_path']}) is missing; start the file again instead of resuming.")
+    header, rows, _ = open_sheet_rows(resume_data['partial_path'])
+    origin_col = header.index('Origin') if 'Origin' in header else None
+    try:
+        for j, values in enumerate(rows):
+            if j > last_index:
+                break
+            if j >= plan['first']:
+                yield j, cell_text(values[1]), cell_text(values[origin_col]) if origin_col is not None else "translated"
+    finally:
+        rows.close()
+
+
+def _stage_executor(workers, use_processes, **kwargs):
+    if use_processes:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), **kwargs)
+    if 'initializer' in kwargs:
+        kwargs['initializer'](*kwargs['initargs'])
+    return ThreadPoolExecutor(max_workers=1)
+
+
+class _FileJob:
+
+    def __init__(self, position, plan, start_paragraph, sink=None):
+        # Range patches go into an existing corpus in one pass, so only they keep their results in memory.
+        self.position = position
+        self.plan = plan
+        self.sink = sink
+        self.results = {}
+        self.pending = iter(range(start_paragraph, plan['last']))
+        self.fed_all = False
+        self.in_flight = 0
+
+    def record(self, j, translation, origin):
+        if self.sink:
+            self.sink.put(j, translation, origin)
+        else:
+            self.results[j] = (translation, origin)
+
+    @property
+    def backlogged(self):
+        return self.sink is not None and self.sink.buffered >= REORDER_LIMIT and self.in_flight > 0
+
+    @property
+    def done(self):
+        return self.sink.completed if self.sink else len(self.results)
+
+    @property
+    def size(self):
+        return self.plan['last'] - self.plan['first']
+
+    def prefix(self):
+        translated, origins = [], []
+        for j in range(self.plan['first'], self.plan['last']):
+            if j not in self.results:
+                break
+            translated.append(self.results[j][0])
+            origins.append(self.results[j][1])
+        return translated, origins
+
+
+class TranslationPipeline:
+
+    def __init__(self, client, model_name, prompt_template, settings, term_matcher=None, translation_memory=None,
+                 on_status=None, hedge_client=None, passthrough=None):
+        self.client = client
+        self.model_name = model_name
+        self.prompt_template = compile_template(prompt_template)
+        self.context_before = settings.get('context_before', 1)
+        self.context_after = settings.get('context_after', 1)
+        self.max_tokens = settings.get('max_tokens', 8000)
+        self.retry_attempts = settings.get('retry_attempts', 3)
+        self.paragraph_timeout = settings.get('paragraph_timeout', 300)
+        self.max_workers = max(1, settings.get('max_workers', 4))
+        self.cache_friendly = settings.get('cache_friendly_prompts', False)
+        self.preprocess_workers = max(1, settings.get('preprocess_workers', min(4, (os.cpu_count() or 2) - 1)))
+        self.pacer = request_pacer(settings)
+        tm_settings = settings.get('translation_memory', {})
+        self.tm_min_similarity = tm_settings.get('min_similarity', 0.75)
+        self.tm_auto_apply_similarity = tm_settings.get('auto_apply_similarity', 1.0)
+        self.tm_max_references = tm_settings.get('max_references', 3)
+        self.passthrough = passthrough if passthrough and passthrough.get('enabled') else None
+        if self.passthrough:
+            # Build one here so an unknown target script is reported before any worker starts.
+            SegmentFilter.from_settings(self.passthrough)
+        self.term_matcher = term_matcher
+        self.translation_memory = translation_memory
+        self.on_status = on_status or (lambda message, color: None)
+        self.stats = RunStats()
+        self.limiter = AdaptiveLimiter(self.max_workers) if settings.get('adaptive_concurrency') else None
+        self.single_flight = SingleFlight(lambda result: result is not None and display_error_value(result) is None, self.stats)
+        hedging = settings.get('hedging', {})
+        self.hedger = None
+        if hedging.get('enabled'):
+            self.hedger = HedgedTranslator(
+                client, model_name, self.max_tokens, self.retry_attempts, self.paragraph_timeout,
+                hedge_client, hedging.get('alternate_model') or None, hedging.get('budget_percent', 5),
+                hedging.get('min_delay', 5), hedging.get('percentile', 95), self.stats, self.max_workers, self.limiter
+            )
+
+    def _translate(self, prompt, stop_event):
+        # Identical prompts (repeated headers, disclaimers, table labels) share one request.
+        return self.single_flight.do(SingleFlight.key_for(prompt), lambda: self._request(prompt, stop_event))
+
+    def _request(self, prompt, stop_event):
+        if not self.pacer.wait(stop_event):
+            return None
+        if self.hedger:
+            return self.hedger.translate(prompt, stop_event)
+        return translate_single_paragraph(
+            self.client, self.model_name, prompt, self.max_tokens, self.retry_attempts, self.paragraph_timeout,
+            self.stats, stop_event, self.limiter
+        )
+
+    def summary(self):
+        parts = [self.stats.summary(), self.limiter.summary() if self.limiter else ""]
+        return ", ".join(part for part in parts if part)
+
+    def _next_item(self, job):
+        plan = job.plan
+        for j in job.pending:
+            if plan['reused'][j] is not None:
+                job.record(j, plan['reused'][j], "reused")
+                if job.backlogged:
+                    return None
+                continue
+            if j in plan['passthrough']:
+                # Numbers, URLs, code and text already in the target language are copied as they are.
+                job.record(j, plan['paragraphs'][j], f"passthrough ({plan['passthrough'][j]})")
+                self.stats.record_passthrough()
+                if job.backlogged:
+                    return None
+                continue
+            prompt = plan['prompts'][j]
+            if self.translation_memory:
+                tm_matches = self.translation_memory.lookup(plan['paragraphs'][j], self.tm_min_similarity, self.tm_max_references)
+                if tm_matches and tm_matches[0][0] >= self.tm_auto_apply_similarity:
+                    job.record(j, tm_matches[0][2], "tm")
+                    if job.backlogged:
+                        return None
+                    continue
+                if tm_matches:
+                    prompt = build_paragraph_prompt(
+                        self.prompt_template, plan['paragraphs'], j, self.context_before, self.context_after,
+                        self.term_matcher, format_tm_references(tm_matches), self.cache_friendly, plan['file_name']
+                    )
+            return j, prompt
+        job.fed_all = True
+        return None
+
+    def run(self, files, paragraph_range=None, reuse_previous=False, resume_data=None, stop_event=None):
+        total_files = len(files)
+        start_file_index = 0
+        if resume_data:
+            try:
+                start_file_index = files.index(resume_data.get('current_file'))
+            except ValueError:
+                log_error(f"Resumed file '{resume_data.get('current_file')}' not found in selection.")
+                resume_data = None
+        remaining_files = total_files - start_file_index
+        if remaining_files <= 0:
+            return None
+
+        use_processes = remaining_files > 1
+        terms = self.term_matcher.terms if self.term_matcher else None
+        pattern_source = self.term_matcher.pattern_source if self.term_matcher else None
+        preprocess_workers = min(self.preprocess_workers, remaining_files)
+        prefetch_limit = preprocess_workers * 2
+        output_limit = 2
+        write_origins = reuse_previous or self.translation_memory is not None or self.passthrough is not None
+
+        worker_setup = dict(
+            initializer=_init_preprocess_worker,
+            initargs=(
+                self.prompt_template.text, self.context_before, self.context_after, terms, pattern_source,
+                self.cache_friendly, self.passthrough
+            )
+        )
+        prepare_pool = _stage_executor(preprocess_workers, use_processes, **worker_setup)
+        # Spawned workers take a second or two to start, so the first file is read in this process meanwhile.
+        first_pool = _stage_executor(1, False, **worker_setup) if use_processes else prepare_pool
+        output_pool = _stage_executor(1, use_processes)
+        # Streamed outputs are already on disk; closing one only saves the spooled workbook, which needs no process.
+        close_pool = ThreadPoolExecutor(max_workers=1)
+        api_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        prefetched, pending_outputs = deque(), deque()
+        in_flight, active_jobs = {}, []
+        next_file = start_file_index
+        feeding = None
+        resume_state = None
+
+        def drain_outputs(limit):
+            while len(pending_outputs) > limit:
+                pending_outputs.popleft().result()
+
+        def add_to_memory(job, batch_rows=0):
+            if self.translation_memory is not None and job.sink and len(job.sink.memory_pairs) >= max(batch_rows, 1):
+                self.translation_memory.add_many(job.sink.take_memory_pairs())
+
+        def finish_job(job):
+            active_jobs.remove(job)
+            plan = job.plan
+            self.on_status(f"[{job.position + 1}/{total_files}] Writing output for {plan['file_name']}...", "orange")
+            if job.sink:
+                add_to_memory(job)
+                pending_outputs.append(close_pool.submit(job.sink.close))
+            else:
+                translated, origins = job.prefix()
+                if self.translation_memory is not None:
+                    self.translation_memory.add_many(
+                        (plan['paragraphs'][plan['first'] + k], t) for k, t in enumerate(translated)
+                        if origins[k] == "translated" and display_error_value(t) is None
+                    )
+                pending_outputs.append(output_pool.submit(write_file_outputs, plan, translated, origins, write_origins))
+            drain_outputs(output_limit)
+
+        try:
+            while True:
+                while next_file < total_files and len(prefetched) < prefetch_limit:
+                    pool = first_pool if next_file == start_file_index else prepare_pool
+                    prefetched.append((next_file, pool.submit(prepare_file, files[next_file], paragraph_range, reuse_previous)))
+                    next_file += 1
+
+                stopping = stop_event is not None and stop_event.is_set()
+                while not stopping and len(in_flight) < self.max_workers * 2:
+                    if feeding is not None and feeding.backlogged:
+                        # The reorder buffer is full; wait for the row holding up the prefix before feeding more.
+                        break
+                    if feeding is None:
+                        if not prefetched:
+                            break
+                        position, future = prefetched.popleft()
+                        if not future.done():
+                            self.on_status(f"[{position + 1}/{total_files}] Reading: {os.path.basename(files[position])}", "orange")
+                        plan = future.result()
+                        if plan['skip']:
+                            log_error(plan['skip'])
+                            continue
+                        start_paragraph = plan['first']
+                        resuming = resume_data is not None and plan['file_path'] == resume_data.get('current_file')
+                        if resuming:
+                            last_index = resume_data.get('last_paragraph_index')
+                            start_paragraph = plan['first'] if last_index is None else last_index + 1
+                        sink = None
+                        if not plan['patch_existing']:
+                            sink = OrderedOutputSink(plan, write_origins, self.translation_memory is not None)
+                        feeding = _FileJob(position, plan, start_paragraph, sink)
+                        active_jobs.append(feeding)
+                        if resuming:
+                            for j, translation, origin in resumed_rows(plan, resume_data):
+                                feeding.record(j, translation, origin)
+                            resume_data = None
+                        reused_count = sum(1 for t in plan['reused'][plan['first']:plan['last']] if t is not None)
+                        if reused_count:
+                            self.on_status(f"[{position + 1}/{total_files}] Reusing {reused_count} unchanged paragraphs of {plan['file_name']}", "orange")
+
+                    item = self._next_item(feeding)
+                    if item is None:
+                        if not feeding.fed_all:
+                            # Backlogged on local rows; carry on with the same file once the prefix moves.
+                            break
+                        if feeding.in_flight == 0:
+                            finish_job(feeding)
+                        feeding = None
+                        continue
+                    j, prompt = item
+                    feeding.in_flight += 1
+                    in_flight[api_pool.submit(self._translate, prompt, stop_event)] = (feeding, j)
+
+                if not in_flight:
+                    if stopping or (feeding is None and not prefetched and next_file >= total_files):
+                        break
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, j = in_flight.pop(future)
+                    job.in_flight -= 1
+                    result = future.result()
+                    if result is not None:
+                        job.record(j, result, "translated")
+                        add_to_memory(job, TM_BATCH_ROWS)
+                    parallel = f", {self.limiter.current} parallel" if self.limiter else ""
+                    self.on_status(f"[{job.position + 1}/{total_files}] Translating {job.plan['file_name']} ({job.done}/{job.size}{parallel})", "orange")
+                    if job.fed_all and job.in_flight == 0 and job.done == job.size:
+                        finish_job(job)
+
+            if active_jobs:
+                job = active_jobs.pop(0)
+                if job.sink:
+                    add_to_memory(job)
+                    resume_state = {
+                        'current_file': job.plan['file_path'],
+                        'last_paragraph_index': job.plan['first'] + job.sink.written_in_range - 1,
+                        'partial_path': job.sink.close_partial(),
+                        'translated_paragraphs': [],
+                        'translated_origins': []
+                    }
+                else:
+                    translated, origins = job.prefix()
+                    resume_state = {
+                        'current_file': job.plan['file_path'],
+                        'last_paragraph_index': job.plan['first'] + len(translated) - 1,
+                        'partial_path': None,
+                        'translated_paragraphs': translated,
+                        'translated_origins': origins
+                    }
+                # Later files are started again on resume, so their partial outputs are of no use.
+                for job in active_jobs:
+                    if job.sink:
+                        job.sink.discard(remove_partial=True)
+                active_jobs.clear()
+            elif stop_event is not None and stop_event.is_set() and (prefetched or next_file < total_files):
+                position = prefetched[0][0] if prefetched else next_file
+                resume_state = {
+                    'current_file': files[position], 'last_paragraph_index': None, 'partial_path': None,
+                    'translated_paragraphs': [], 'translated_origins': []
+                }
+            drain_outputs(0)
+            return resume_state
+        finally:
+            for job in active_jobs:
+                if job.sink:
+                    job.sink.discard()
+            for future in in_flight:
+                future.cancel()
+            for _, future in prefetched:
+                future.cancel()
+            api_pool.shutdown(wait=True)
+            if self.hedger:
+                self.hedger.close()
+            prepare_pool.shutdown(wait=True, cancel_futures=True)
+            first_pool.shutdown(wait=True, cancel_futures=True)
+            output_pool.shutdown(wait=True)
+            close_pool.shutdown(wait=True)
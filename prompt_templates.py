@@ -0,0 +1,70 @@
+import re
+from functools import lru_cache
+
+TRANSLATION_PLACEHOLDERS = ("context", "terms", "file_name", "index")
+POST_EDIT_PLACEHOLDERS = ("source", "target", "file_name", "index")
+PLACEHOLDER_LABELS = {
+    "context": "Passage",
+    "terms": "Terminology",
+    "file_name": "File",
+    "index": "Paragraph Number",
+    "source": "Source",
+    "target": "Translation",
+}
+
+_TOKEN = re.compile(r'\{\{|\}\}|\{(\w+)\}')
+
+
+class PromptTemplateError(ValueError):
+    pass
+
+
+class PromptTemplate:
+
+    def __init__(self, text, allowed=TRANSLATION_PLACEHOLDERS):
+        self.text = text
+        self._parts, self._slots = [], []
+        literal, pos = [], 0
+        for match in _TOKEN.finditer(text):
+            literal.append(text[pos:match.start()])
+            pos = match.end()
+            if match.group() == "{{":
+                literal.append("{")
+            elif match.group() == "}}":
+                literal.append("}")
+            else:
+                name = match.group(1)
+                if name not in allowed:
+                    available = ", ".join(f"{{{n}}}" for n in allowed)
+                    raise PromptTemplateError(f"Unknown placeholder {{{name}}} in prompt. Available placeholders: {available}. Write {{{{ and }}}} for literal braces.")
+                self._parts.append("".join(literal))
+                literal = []
+                self._slots.append((len(self._parts), name))
+                self._parts.append("")
+        literal.append(text[pos:])
+        self._parts.append("".join(literal))
+        self.placeholders = frozenset(name for _, name in self._slots)
+
+    def __contains__(self, name):
+        return name in self.placeholders
+
+    def render(self, **values):
+        parts = list(self._parts)
+        for position, name in self._slots:
+            value = values.get(name, "")
+            parts[position] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=64)
+def compile_template(text, allowed=TRANSLATION_PLACEHOLDERS):
+    return PromptTemplate(text, allowed)
+
+
+def build_prefix_cached_messages(template, values):
+    static_text = template.render(**{name: f"[{PLACEHOLDER_LABELS[name]}: see the user message]" for name in template.placeholders})
+    variable_text = "\n\n".join(f"[{PLACEHOLDER_LABELS[name]}]\n{value}" for name, value in values.items() if value != "")
+    return [
+        {"role": "system", "content": static_text},
+        {"role": "user", "content": variable_text},
+    ]
@@ -0,0 +1,263 @@
+import os
+import re
+
+from corpus_io import red_bold_font, find_column, open_sheet_rows, cell_text
+
+
+def _contains_elementwise(haystacks, needles):
+    import numpy as np
+    return np.fromiter((needle in haystack for haystack, needle in zip(haystacks, needles)), dtype=bool, count=len(haystacks))
+
+
+def check_term_compliance(df, matcher, source_col='Source', target_col='Translation'):
+    import numpy as np
+    import pandas as pd
+    sources = df[source_col].fillna("").astype(str)
+    translations = df[target_col].fillna("").astype(str).str.lower()
+    violations = pd.Series("", index=df.index, dtype=object)
+    if matcher.pattern is None or df.empty:
+        return violations
+
+    occurrences = sources.str.findall(matcher.pattern).explode().dropna()
+    if occurrences.empty:
+        return violations
+
+    pairs = pd.DataFrame({'row': occurrences.index, 'source_term': occurrences.to_numpy()}).drop_duplicates()
+    pairs['target_term'] = pairs['source_term'].map(matcher.terms)
+    found = _contains_elementwise(
+        translations.loc[pairs['row']].to_numpy(),
+        pairs['target_term'].str.lower().to_numpy()
+    )
+
+    missing = pairs[~found]
+    if missing.empty:
+        return violations
+    missing = missing.sort_values('row', kind='stable')
+    rows = missing['row'].to_numpy()
+    labels = (missing['source_term'] + " → " + missing['target_term'] + "; ").to_numpy(dtype=object)
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    joined = np.add.reduceat(labels, starts)
+    violations.loc[rows[starts]] = [label[:-2] for label in joined]
+    return violations
+
+
+def write_report(excel_path, df, highlight_columns):
+    from openpyxl import load_workbook
+    df.to_excel(excel_path, index=False, engine='openpyxl')
+    wb = load_workbook(excel_path)
+    ws = wb.active
+    for column in highlight_columns:
+        col_idx = find_column(ws, column)
+        if col_idx == -1:
+            continue
+        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
+            cell = row[col_idx]
+            if cell.value not in (None, "", 0, False):
+                cell.font = red_bold_font()
+    wb.save(excel_path)
+
+
+def run_term_compliance(file_path, matcher):
+    import pandas as pd
+    df = pd.read_excel(file_path, dtype=str, keep_default_na=False)
+    if 'Source' not in df.columns or 'Translation' not in df.columns:
+        raise ValueError(f"'{os.path.basename(file_path)}' must contain 'Source' and 'Translation' columns.")
+    df['Term Violations'] = check_term_compliance(df, matcher)
+    base_name = os.path.splitext(file_path)[0]
+    report_path = f"{base_name}_termcheck.xlsx"
+    write_report(report_path, df, ['Term Violations'])
+    return report_path, int((df['Term Violations'] != "").sum()), len(df)
+
+
+QE_WEIGHTS = {
+    "failed": 1.0,
+    "prompt marker": 0.6,
+    "untranslated": 0.6,
+    "length ratio": 0.3,
+    "number mismatch": 0.3,
+    "date mismatch": 0.3,
+    "URL mismatch": 0.3,
+    "truncated": 0.3,
+}
+LENGTH_RATIO_MAX_Z = 3.5
+MIN_SOURCE_CHARS = 5
+PROMPT_MARKERS = r'\[(?:Text to Translate|Previous Context|Next Context|Terminology|Passage|Reference[^\]]*)\]|see the user message'
+_CJK = r'[぀-ヿ㐀-䶿一-鿿가-힯]'
+_URL = r'(https?://[^\s<>"，。）)]+|www\.[^\s<>"，。）)]+|[\w.+-]+@[\w-]+(?:\.[\w-]+)+)'
+_DATE = r'(\d{4})\s*[年/.-]\s*(\d{1,2})\s*[月/.-]\s*(\d{1,2})\s*日?'
+_NUMBER = r'(\d+(?:[.,]\d+)*)'
+_SENTENCE_END = r'[。！？!?.…:：;；"”’」』)）\]]\s*$'
+_MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+
+
+def _visible_length(texts):
+    return texts.str.len() - texts.str.count(r'\s')
+
+
+def _missing_items(sources, translations, pattern, normalize=None):
+    import numpy as np
+    import pandas as pd
+    found = sources.str.findall(pattern).explode().dropna()
+    missing = pd.Series(False, index=sources.index)
+    if found.empty:
+        return missing
+    items = found.astype(str)
+    if normalize is not None:
+        items = normalize(items)
+    present = _contains_elementwise(
+        translations.loc[items.index].to_numpy(),
+        items.to_numpy()
+    )
+    rows = items.index[~present]
+    missing.loc[np.unique(rows)] = True
+    return missing
+
+
+def _date_mismatch(sources, translations):
+    import numpy as np
+    import pandas as pd
+    dates = sources.str.extractall(_DATE)
+    mismatch = pd.Series(False, index=sources.index)
+    if dates.empty:
+        return mismatch
+    rows = dates.index.get_level_values(0)
+    targets = translations.loc[rows].to_numpy()
+    years = _contains_elementwise(targets, dates[0].to_numpy())
+    months = dates[1].astype(int).clip(1, 12)
+    month_number = [f"{m}" for m in months]
+    month_name = [_MONTHS[m - 1] for m in months]
+    month_ok = _contains_elementwise(targets, month_name) | _contains_elementwise(targets, month_number)
+    days = _contains_elementwise(targets, dates[2].astype(int).astype(str).to_numpy())
+    bad = ~(years & month_ok & days)
+    mismatch.loc[np.unique(rows[bad])] = True
+    return mismatch
+
+
+def quality_signals(df, source_col='Source', target_col='Translation'):
+    import numpy as np
+    import pandas as pd
+    sources = df[source_col].fillna("").astype(str).str.strip()
+    translations = df[target_col].fillna("").astype(str).str.strip()
+    lowered = translations.str.lower()
+    has_source = _visible_length(sources) >= MIN_SOURCE_CHARS
+    signals = pd.DataFrame(index=df.index)
+
+    failed = translations.eq("") | translations.str.match(r'^(?:Failed: |Network Issue$|Rejected by API|\[ERROR_)')
+    signals["failed"] = failed & sources.ne("")
+    signals["prompt marker"] = translations.str.contains(PROMPT_MARKERS, regex=True)
+
+    source_cjk = sources.str.count(_CJK)
+    target_cjk = translations.str.count(_CJK)
+    target_length = _visible_length(translations).clip(lower=1)
+    copied = translations.str.casefold().eq(sources.str.casefold()) & has_source & ~sources.str.fullmatch(r'[\d\W_]*')
+    # Only meaningful when the source is CJK and the target language is not.
+    leftover_cjk = (source_cjk > 0) & (target_cjk / target_length > 0.3) & (source_cjk / _visible_length(sources).clip(lower=1) > 0.5)
+    signals["untranslated"] = (copied | leftover_cjk) & ~failed
+    if 'Origin' in df.columns:
+        # Paragraphs copied on purpose by the passthrough classifier are not missed translations.
+        signals["untranslated"] &= ~df['Origin'].fillna("").astype(str).str.startswith("passthrough")
+
+    usable = has_source & ~failed
+    log_ratio = np.log(target_length / _visible_length(sources).clip(lower=1))
+    reference = log_ratio[usable]
+    if len(reference) >= 10:
+        median = reference.median()
+        spread = (reference - median).abs().median() * 1.4826 or reference.std() or 1.0
+        signals["length ratio"] = usable & ((log_ratio - median).abs() / spread > LENGTH_RATIO_MAX_Z)
+    else:
+        signals["length ratio"] = False
+
+    sources_without_dates = sources.str.replace(_DATE, " ", regex=True)
+    signals["number mismatch"] = usable & _missing_items(
+        sources_without_dates.str.replace(_URL, " ", regex=True), lowered.str.replace(",", "", regex=False),
+        _NUMBER, lambda items: items.str.replace(",", "", regex=False)
+    )
+    signals["date mismatch"] = usable & _date_mismatch(sources, lowered)
+    signals["URL mismatch"] = usable & _missing_items(sources, lowered, _URL, lambda items: items.str.lower())
+    signals["truncated"] = usable & sources.str.contains(_SENTENCE_END, regex=True) & ~translations.str.contains(_SENTENCE_END, regex=True)
+    return signals
+
+
+def score_signals(signals):
+    import numpy as np
+    weights = np.array([QE_WEIGHTS[name] for name in signals.columns])
+    score = np.clip(1.0 - signals.to_numpy(dtype=float) @ weights, 0.0, 1.0).round(2)
+    labels = np.full(len(signals), "", dtype=object)
+    for name in signals.columns:
+        labels = labels + np.where(signals[name].to_numpy(), name + "; ", "")
+    return score, [label[:-2] for label in labels]
+
+
+def run_quality_estimation(file_path):
+    import pandas as pd
+    df = pd.read_excel(file_path, dtype=str, keep_default_na=False)
+    if 'Source' not in df.columns or 'Translation' not in df.columns:
+        raise ValueError(f"'{os.path.basename(file_path)}' must contain 'Source' and 'Translation' columns.")
+    signals = quality_signals(df)
+    df['QE Score'], df['QE Flags'] = score_signals(signals)
+    base_name = os.path.splitext(file_path)[0]
+    report_path = f"{base_name}_qe.xlsx"
+    write_report(report_path, df, ['QE Flags'])
+    return report_path, int((df['QE Flags'] != "").sum()), len(df), signals.sum().to_dict()
+
+
+TRIAGE_SHORT_CHARS = 12
+DEFAULT_SKIP_PATTERNS = [
+    r'[\d\s\W_]*',
+    r'\s*(?:第[一二三四五六七八九十百千零\d]+[章节卷部回篇]|(?:Chapter|Part|Section|Volume)\s+[\dIVXLC]+)\b.{0,30}',
+]
+
+
+def load_previous_post_edits(excel_path):
+    if not os.path.exists(excel_path):
+        return {}
+    header, rows, _ = open_sheet_rows(excel_path)
+    if not {'Source', 'Translation', 'Post-edited'} <= set(header):
+        rows.close()
+        return {}
+    source_col, target_col, edited_col = header.index('Source'), header.index('Translation'), header.index('Post-edited')
+    failed = re.compile(r'(?:Failed: |Network Issue$|Rejected by API)')
+    cache = {}
+    for row in rows:
+        edited = cell_text(row[edited_col])
+        if edited and not failed.match(edited):
+            cache[(cell_text(row[source_col]), cell_text(row[target_col]))] = edited
+    return cache
+
+
+def triage_rows(df, skip_patterns=None, cache=None, short_chars=TRIAGE_SHORT_CHARS, source_col='Source', target_col='Translation'):
+    import numpy as np
+    import pandas as pd
+    sources = df[source_col].fillna("").astype(str)
+    targets = df[target_col].fillna("").astype(str)
+    reasons = pd.Series("", index=df.index, dtype=object)
+    copied = targets.copy()
+
+    # Cheapest and most specific rules first; a row keeps the first reason that applies. A row whose length
+    # ratio is far from the file's median is never skipped, whatever rule it matches.
+    failed = targets.str.strip().eq("") | targets.str.match(r'^(?:Failed: |Network Issue$|Rejected by API|\[ERROR_)')
+    reasons[failed] = "failed"
+
+    source_length = _visible_length(sources)
+    log_ratio = np.log(_visible_length(targets).clip(lower=1) / source_length.clip(lower=1))
+    sentences = (source_length >= MIN_SOURCE_CHARS) & ~failed
+    median = log_ratio[sentences].median() if sentences.any() else 0.0
+    normal_length = (log_ratio - median).abs() <= 1.0
+
+    for pattern in (DEFAULT_SKIP_PATTERNS if skip_patterns is None else skip_patterns):
+        matched = (reasons == "") & normal_length & sources.str.fullmatch(pattern) & targets.str.fullmatch(pattern)
+        reasons[matched] = "skip pattern"
+
+    unchanged = (reasons == "") & normal_length & targets.str.strip().eq(sources.str.strip())
+    reasons[unchanged] = "unchanged source"
+
+    # Short rows without closing punctuation are headings and labels.
+    heading = (reasons == "") & normal_length & (source_length <= short_chars) & ~sources.str.contains(_SENTENCE_END, regex=True)
+    reasons[heading] = "heading"
+
+    if cache:
+        keys = pd.Series(list(zip(sources, targets)), index=df.index)
+        hits = (reasons == "") & normal_length & keys.isin(cache.keys())
+        reasons[hits] = "cached"
+        copied[hits] = keys[hits].map(cache)
+    return reasons, copied
@@ -0,0 +1,120 @@
+import re
+
+PASSTHROUGH_RULES = ("number", "page marker", "url", "code", "table separator", "target language")
+MIN_LETTERS_FOR_LANGUAGE = 4
+MAX_CODE_BLOCK_LINES = 200
+
+_NUMBER = re.compile(r'[\d\s.,:;%‰+\-–—−×/()\[\]#№°$€£¥￥¢*=<>~≈±]*\d[\d\s.,:;%‰+\-–—−×/()\[\]#№°$€£¥￥¢*=<>~≈±]*')
+_ROMAN = r'(?=[ivx])x{0,3}(?:ix|iv|v?i{0,3})'
+# A bare Roman numeral only counts in lowercase and with two or more letters, so "I" or "V" stay prose;
+# with a page word or dashes around it any numeral does.
+_PAGE_MARKER = re.compile(
+    r'(?i)(?:[-–—\s]*\d+[-–—\s]*|(?:page|p\.|pg\.?|seite|página)\s*(?:\d+(?:\s*(?:of|/)\s*\d+)?|' + _ROMAN + ')'
+    r'|第\s*[\d一二三四五六七八九十百千]+\s*页(?:\s*[/，,]?\s*共\s*\d+\s*页)?|\d+\s*/\s*\d+'
+    r'|[-–—]\s*' + _ROMAN + r'\s*[-–—]|(?-i:(?=[ivx]{2})' + _ROMAN + '))'
+)
+_URL = re.compile(r'(?i)[\s<(\[]*(?:(?:https?|ftp)://\S+|www\.\S+|[\w.+-]+@[\w-]+(?:\.[\w-]+)+|(?:[a-z]:)?[\\/]?(?:[\w.-]+[\\/])+[\w.-]+\.\w{1,5})[\s>)\].,;]*')
+_CODE_FENCE = re.compile(r'```[\w+-]*')
+# Each keyword only counts together with the syntax that follows it in code, so prose such as
+# "class notes are due:" or "return to sender;" is not mistaken for it.
+_CODE_LINE = re.compile(
+    r'(?:#include\s*[<"]|import\s+(?:\w+(?:\.\w+)+|\w+\s+as\s+\w+)(?:\s+as\s+\w+)?;?$|import\s+[\w.]+\*?;$'
+    r'|from\s+(?:\.+[\w.]*|[\w.]+)\s+import\s+(?:\*|\(|\w+(?:\s+as\s+\w+)?(?:\s*,\s*\w+(?:\s+as\s+\w+)?)*)$'
+    r'|def\s+\w+\s*\(.*\)\s*(?:->.*)?:$|class\s+\w+(?:\s*\([\w.,\s]*\))?:$'
+    r'|class\s+\w+(?:\s+(?:extends|implements)\s+[\w.,<>\s]+)?\s*\{$|function\s*\w*\s*\(.*\)\s*\{$'
+    r'|(?:public|private|protected|static)\s+[\w<>\[\],\s]*\w\(.*\)\s*(?:throws\s+[\w.,\s]+)?\{?$'
+    r'|(?:var|let|const)\s+\w+\s*(?::\s*[\w<>\[\]|]+\s*)?=.*;?$|(?:void|int|char|float|double|bool|auto)\s+\*?\w+\s*(?:\(.*\)\s*\{?|=.*;|;)$'
+    r'|return(?:\s+\S+(?:\s*[-+*/%<>=!&|?:]+\s*\S+)*)?;$'
+    r'|[\w.\[\]]+\s*(?:[+\-*/]?=\s*[^=].*|\+\+|--);$|[{}()\[\];]+$|</?[a-zA-Z][\w-]*(?:\s[^<>]*)?/?>$)'
+)
+# CJK text or sentence punctuation marks a line as prose even inside a fenced block.
+_PROSE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯。！？，、；]|[.!?…]["\'”’]*(?:\s+[A-Z"\'“‘(]|$)')
+_TABLE_SEPARATOR = re.compile(r'[\s|+:=\-–—_*.·•#~─━│┃┼╋├┤┬┴┌┐└┘═║╔╗╚╝╠╣╦╩╬]*[|+=\-–—_*─━│┃┼╋═║]{3}[\s|+:=\-–—_*.·•#~─━│┃┼╋├┤┬┴┌┐└┘═║╔╗╚╝╠╣╦╩╬]*')
+
+SCRIPTS = {
+    "Latin": re.compile(r'[A-Za-zÀ-ɏḀ-ỿ]'),
+    "Han": re.compile(r'[㐀-䶿一-鿿豈-﫿]'),
+    "Kana": re.compile(r'[぀-ヿㇰ-ㇿ]'),
+    "Hangul": re.compile(r'[ᄀ-ᇿ㄰-㆏가-힯]'),
+    "Cyrillic": re.compile(r'[Ѐ-ӿ]'),
+    "Greek": re.compile(r'[Ͱ-Ͽ]'),
+    "Arabic": re.compile(r'[؀-ۿݐ-ݿ]'),
+    "Hebrew": re.compile(r'[֐-׿]'),
+    "Thai": re.compile(r'[฀-๿]'),
+    "Devanagari": re.compile(r'[ऀ-ॿ]'),
+}
+
+
+def passthrough_settings(settings, prompt_name=None):
+    # A prompt can override any of the shared passthrough keys, e.g. to set its own target script.
+    profile = dict(settings.get('passthrough', {}))
+    overrides = profile.pop('profiles', {}).get(prompt_name or "", {})
+    profile.update(overrides)
+    return profile
+
+
+
+class SegmentFilter:
+
+    def __init__(self, rules=PASSTHROUGH_RULES, target_scripts=(), min_target_share=0.9):
+        unknown = set(target_scripts) - set(SCRIPTS)
+        if unknown:
+            raise ValueError(f"Unknown target script(s): {', '.join(sorted(unknown))}. Choose from {', '.join(SCRIPTS)}.")
+        self.rules = set(rules)
+        self.target_scripts = [SCRIPTS[name] for name in target_scripts]
+        self.other_scripts = [pattern for name, pattern in SCRIPTS.items() if name not in target_scripts]
+        self.min_target_share = min_target_share
+
+    @classmethod
+    def from_settings(cls, profile):
+        if not profile or not profile.get('enabled'):
+            return None
+        return cls(profile.get('rules', PASSTHROUGH_RULES), profile.get('target_scripts', []), profile.get('min_target_share', 0.9))
+
+    def _in_target_language(self, paragraph):
+        if not self.target_scripts:
+            return False
+        target = sum(len(pattern.findall(paragraph)) for pattern in self.target_scripts)
+        if target < MIN_LETTERS_FOR_LANGUAGE:
+            return False
+        other = sum(len(pattern.findall(paragraph)) for pattern in self.other_scripts)
+        return target / (target + other) >= self.min_target_share
+
+    def classify(self, paragraph):
+        text = paragraph.strip()
+        if "number" in self.rules and _NUMBER.fullmatch(text):
+            return "number"
+        if "page marker" in self.rules and _PAGE_MARKER.fullmatch(text):
+            return "page marker"
+        if "url" in self.rules and _URL.fullmatch(text):
+            return "url"
+        if "table separator" in self.rules and _TABLE_SEPARATOR.fullmatch(text):
+            return "table separator"
+        if "code" in self.rules and _CODE_LINE.match(text) and not _PROSE.search(text):
+            return "code"
+        if "target language" in self.rules and self._in_target_language(text):
+            return "target language"
+        return None
+
+    def _block_end(self, paragraphs, start, last):
+        for k in range(start + 1, min(last, start + 1 + MAX_CODE_BLOCK_LINES)):
+            if _CODE_FENCE.fullmatch(paragraphs[k].strip()):
+                return k
+        return -1
+
+    def classify_range(self, paragraphs, first, last, skip=None):
+        # Paragraphs are single lines, so a fenced code block spans several of them. A fence only opens a
+        # block when it is closed within MAX_CODE_BLOCK_LINES; an unmatched fence must not swallow the rest
+        # of the file. Prose lines inside a block are still translated.
+        reasons, block_start, block_end = {}, -1, -1
+        for j in range(first, last):
+            text = paragraphs[j].strip()
+            if j > block_end and "code" in self.rules and _CODE_FENCE.fullmatch(text):
+                block_start, block_end = j, self._block_end(paragraphs, j, last)
+            if j <= block_end and (j in (block_start, block_end) or not _PROSE.search(text)):
+                reason = "code"
+            else:
+                reason = self.classify(text)
+            if reason and not (skip and skip(j)):
+                reasons[j] = reason
+        return reasons
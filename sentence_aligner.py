@@ -0,0 +1,188 @@
+import os
+import re
+import sys
+import argparse
+
+from corpus_io import write_corpus
+
+# Gale & Church (1993) bead priors; 0-1 is included so extra target sentences can be skipped too.
+BEAD_PRIORS = {(1, 1): 0.89, (1, 0): 0.0099 / 2, (0, 1): 0.0099 / 2, (2, 1): 0.089 / 2, (1, 2): 0.089 / 2}
+BEADS = [(1, 1), (1, 0), (2, 1), (1, 2), (0, 1)]
+VARIANCE_PER_CHAR = 6.8
+MIN_BAND = 30
+COST_BLOCK_ROWS = 1024
+
+_SENTENCE = re.compile(r'.+?(?:[。！？!?…]+[”’」』"\'）)]*|(?<!\bMr)(?<!\bMrs)(?<!\bMs)(?<!\bDr)(?<!\bSt)(?<!\bvs)(?<!\bNo)\.+[”’"\')]*(?=\s|$)|$)', re.S)
+_WHITESPACE = re.compile(r'\s+')
+_CJK_END = re.compile(r'[\u3000-\u30ff\u4e00-\u9fff\uff00-\uffef][”’」』"\'）)]*$')
+
+
+def split_sentences(paragraph):
+    return [s.strip() for s in _SENTENCE.findall(paragraph) if s.strip()]
+
+
+def join_sentences(sentences):
+    # CJK sentences are written without a separating space.
+    return "".join(s if i + 1 == len(sentences) or _CJK_END.search(s) else s + " " for i, s in enumerate(sentences))
+
+
+def sentence_length(sentence):
+    return len(_WHITESPACE.sub("", sentence))
+
+
+def _bead_costs(source_lengths, target_lengths, ratio, log_priors):
+    import numpy as np
+    mean = np.maximum((source_lengths + target_lengths / ratio) / 2, 1e-9)
+    z = np.abs((ratio * mean - target_lengths) / np.sqrt(VARIANCE_PER_CHAR * ratio * mean))
+    # Abramowitz & Stegun 26.2.17, as in the original Gale & Church implementation.
+    t = 1 / (1 + 0.2316419 * z)
+    tail = 0.3989423 * np.exp(-z * z / 2) * ((((1.330274429 * t - 1.821255978) * t + 1.781477937) * t - 0.356563782) * t + 0.319381530) * t
+    return -np.log(np.maximum(2 * tail, 1e-300)) - log_priors
+
+
+def _band_limits(n, m, band):
+    import numpy as np
+    centre = np.arange(n + 1) * (m / n if n else 0)
+    lo = np.clip(np.floor(centre - band), 0, m).astype(int)
+    hi = np.clip(np.ceil(centre + band), 0, m).astype(int)
+    return lo, hi
+
+
+def _block_costs(sl, tl, lo, first_row, last_row, width, ratio, log_priors):
+    import numpy as np
+    # Costs of the 1-1, 1-0, 2-1 and 1-2 beads ending at every banded cell of rows first_row..last_row-1.
+    # sl and tl are shifted by two so the sums never index before the first sentence.
+    s_i = np.arange(first_row, last_row)[:, None] + 1
+    t_j = np.minimum(lo[first_row:last_row, None] + np.arange(width) + 1, len(tl) - 1)
+    source_sums = np.stack([sl[s_i], sl[s_i], sl[s_i] + sl[s_i - 1], sl[s_i]])
+    target_sums = np.stack([tl[t_j], np.zeros(t_j.shape), tl[t_j], tl[t_j] + tl[t_j - 1]])
+    return _bead_costs(source_sums, target_sums, ratio, log_priors[:, :, None])
+
+
+def _align_banded(source_lengths, target_lengths, ratio, band):
+    import numpy as np
+    n, m = len(source_lengths), len(target_lengths)
+    sl = np.concatenate([[0.0, 0.0], np.asarray(source_lengths, dtype=float)])
+    tl = np.concatenate([[0.0, 0.0], np.asarray(target_lengths, dtype=float)])
+    lo, hi = _band_limits(n, m, band)
+    width = int((hi - lo).max()) + 1
+    log_priors = np.log([[BEAD_PRIORS[bead]] for bead in BEADS[:4]])
+    insert_costs = _bead_costs(np.zeros(m + 2), tl, ratio, np.log(BEAD_PRIORS[(0, 1)]))
+
+    # Row i of the banded matrices holds columns lo[i]..hi[i], stored after two cells of padding so
+    # predecessors one or two columns left of the band read as unreachable.
+    pad = 2
+    right_pad = 2 * int(np.diff(lo).max(initial=0)) + pad
+    totals = np.full((n + 1, pad + width + right_pad), np.inf)
+    moves = np.zeros((n + 1, width), dtype=np.int8)
+    costs, block_start = None, 0
+    for i in range(n + 1):
+        count = hi[i] - lo[i] + 1
+        if i == 0:
+            best = np.where(np.arange(count) == 0, 0.0, np.inf)
+            move = moves[0, :count]
+        else:
+            if costs is None or i - block_start >= costs.shape[1]:
+                block_start = i
+                costs = _block_costs(sl, tl, lo, i, min(n + 1, i + COST_BLOCK_ROWS), width, ratio, log_priors)
+            candidates = costs[:, i - block_start, :count].copy()
+            for bead_index, (source_step, target_step) in enumerate(BEADS[:4]):
+                if i - source_step < 0:
+                    candidates[bead_index] = np.inf
+                    continue
+                start = pad + lo[i] - target_step - lo[i - source_step]
+                candidates[bead_index] += totals[i - source_step, start:start + count]
+            move = moves[i, :count]
+            move[:] = candidates.argmin(axis=0)
+            best = candidates.min(axis=0)
+        # 0-1 beads chain along the row: D[j] = min(best[j], D[j-1] + insert[j]), solved as a prefix minimum.
+        if count > 1:
+            cumulative = np.concatenate([[0.0], np.cumsum(insert_costs[lo[i] + 2:lo[i] + count + 1])])
+            chained = np.minimum.accumulate(best - cumulative) + cumulative
+            move[chained < best - 1e-9] = 4
+            best = chained
+        totals[i, pad:pad + count] = best
+
+    if not np.isfinite(totals[n, pad + m - lo[n]]):
+        return None, False
+    beads, i, j, touches_edge = [], n, m, False
+    while i > 0 or j > 0:
+        if (j == lo[i] and j > 0) or (j == hi[i] and j < m):
+            touches_edge = True
+        step = BEADS[moves[i, j - lo[i]]]
+        beads.append(step)
+        i, j = i - step[0], j - step[1]
+    beads.reverse()
+    return beads, touches_edge
+
+
+def align_lengths(source_lengths, target_lengths, band=None):
+    n, m = len(source_lengths), len(target_lengths)
+    if n == 0 or m == 0:
+        return [(1, 0)] * n + [(0, 1)] * m
+    ratio = max(sum(target_lengths), 1) / max(sum(source_lengths), 1)
+    band = band or max(MIN_BAND, abs(n - m) + MIN_BAND // 2)
+    while True:
+        beads, touches_edge = _align_banded(source_lengths, target_lengths, ratio, band)
+        # A path that runs along the band edge may have been squeezed by it; widen and retry.
+        if beads is not None and (not touches_edge or band >= max(n, m)):
+            return beads
+        band *= 2
+
+
+def align_sentences(source_sentences, target_sentences, band=None):
+    beads = align_lengths([sentence_length(s) for s in source_sentences], [sentence_length(s) for s in target_sentences], band)
+    pairs, i, j = [], 0, 0
+    for source_count, target_count in beads:
+        source_text = join_sentences(source_sentences[i:i + source_count])
+        target_text = join_sentences(target_sentences[j:j + target_count])
+        pairs.append((source_text, target_text, f"aligned {source_count}-{target_count}"))
+        i, j = i + source_count, j + target_count
+    return pairs
+
+
+def align_texts(source_paragraphs, target_paragraphs, band=None):
+    # With matching paragraph counts the paragraphs act as hard anchors and each pair is aligned on its own.
+    if len(source_paragraphs) == len(target_paragraphs):
+        pairs = []
+        for source, target in zip(source_paragraphs, target_paragraphs):
+            pairs.extend(align_sentences(split_sentences(source), split_sentences(target), band))
+        return pairs
+    source_sentences = [s for p in source_paragraphs for s in split_sentences(p)]
+    target_sentences = [s for p in target_paragraphs for s in split_sentences(p)]
+    return align_sentences(source_sentences, target_sentences, band)
+
+
+def aligned_corpus_path(source_path):
+    dir_name = os.path.splitext(os.path.basename(source_path))[0]
+    output_dir = os.path.join(os.path.dirname(source_path), dir_name)
+    return output_dir, os.path.join(output_dir, f"{dir_name}_aligned_corpus.xlsx")
+
+
+def align_files(source_path, target_path, band=None):
+    from app_utils import split_text_into_paragraphs
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source_paragraphs = split_text_into_paragraphs(f.read())
+    with open(target_path, 'r', encoding='utf-8') as f:
+        target_paragraphs = split_text_into_paragraphs(f.read())
+    pairs = align_texts(source_paragraphs, target_paragraphs, band)
+    output_dir, excel_path = aligned_corpus_path(source_path)
+    os.makedirs(output_dir, exist_ok=True)
+    write_corpus(excel_path, [p[0] for p in pairs], [p[1] for p in pairs], [p[2] for p in pairs])
+    one_to_one = sum(1 for p in pairs if p[2] == "aligned 1-1")
+    return excel_path, len(pairs), one_to_one
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Align an existing translation with its source sentence by sentence (Gale-Church).")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--band", type=int, help="Initial search band in sentences; widened automatically when needed.")
+    args = parser.parse_args(argv)
+    excel_path, total, one_to_one = align_files(args.source, args.target, args.band)
+    print(f"Wrote {total} aligned segments ({one_to_one} one-to-one) to {excel_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
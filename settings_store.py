@@ -0,0 +1,234 @@
+import os
+import copy
+import json
+import time
+import atexit
+import tempfile
+import threading
+from contextlib import contextmanager
+
+_DELETED = object()
+
+
+@contextmanager
+def file_lock(lock_path, exclusive=True):
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            # msvcrt has no shared locks; LK_LOCK gives up after ~10 s, so keep trying.
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(10):
+            try:
+                os.replace(tmp_path, path)
+                break
+            except PermissionError:
+                # Windows refuses the rename while another process has the file open for reading.
+                if attempt == 9:
+                    raise
+                time.sleep(0.05)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def diff_settings(old, new, path=()):
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in old.keys() | new.keys():
+            if key not in new:
+                changes.append((path + (key,), _DELETED))
+            elif key not in old:
+                changes.append((path + (key,), copy.deepcopy(new[key])))
+            else:
+                changes.extend(diff_settings(old[key], new[key], path + (key,)))
+        return changes
+    return [] if old == new else [(path, copy.deepcopy(new))]
+
+
+def apply_changes(settings, changes):
+    for path, value in changes:
+        if not path:
+            continue
+        target = settings
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if value is _DELETED:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = copy.deepcopy(value)
+    return settings
+
+
+class SettingsStore:
+
+    def __init__(self, path, defaults, normalize=None, debounce=0.5, on_error=None):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.defaults = defaults
+        self.normalize = normalize or (lambda settings: settings)
+        self.debounce = debounce
+        self.on_error = on_error
+        self.lock = threading.RLock()
+        self.baseline = None
+        self.seen = None
+        self.changes = []
+        self.timer = None
+        self.stamp = None
+        self.listeners = []
+        self.watcher = None
+        atexit.register(self.flush)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read_disk(self):
+        if not os.path.exists(self.path):
+            return self.defaults()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return self.normalize(json.load(f))
+
+    def load(self):
+        with self.lock:
+            try:
+                with file_lock(self.lock_path, exclusive=False):
+                    settings = self._read_disk()
+                    self.stamp = self._stat()
+            except Exception as e:
+                self._report(f"Failed to load {self.path}: {e}. Using default settings.")
+                settings = self.defaults()
+            self.baseline = copy.deepcopy(settings)
+            self.seen = copy.deepcopy(settings)
+            return settings
+
+    def adopt(self, settings):
+        # Call after copying a change notification into the caller's settings, so those values are
+        # not mistaken for local edits on the next save.
+        with self.lock:
+            self.baseline = apply_changes(copy.deepcopy(settings), self.changes)
+
+    def save(self, settings):
+        with self.lock:
+            if self.baseline is None:
+                self.baseline = self.defaults()
+            # Only the keys this process changed are written, so edits from other processes survive.
+            changes = diff_settings(self.baseline, settings)
+            if not changes:
+                return
+            self.changes.extend(changes)
+            self.baseline = apply_changes(self.baseline, changes)
+            if self.debounce <= 0:
+                self.flush()
+                return
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.changes:
+                return True
+            try:
+                with file_lock(self.lock_path, exclusive=True):
+                    try:
+                        merged = self._read_disk()
+                    except (OSError, ValueError):
+                        merged = copy.deepcopy(self.baseline)
+                    apply_changes(merged, self.changes)
+                    atomic_write_json(self.path, merged)
+                    self.stamp = self._stat()
+            except Exception as e:
+                self._report(f"Failed to save {self.path}: {e}")
+                return False
+            external = merged != apply_changes(copy.deepcopy(self.seen), self.changes)
+            self.changes = []
+            self.seen = copy.deepcopy(merged)
+        if external:
+            self._notify(merged)
+        return True
+
+    def reload_if_changed(self):
+        with self.lock:
+            stamp = self._stat()
+            if stamp is None or stamp == self.stamp:
+                return None
+            try:
+                with file_lock(self.lock_path, exclusive=False):
+                    settings = self._read_disk()
+                    self.stamp = self._stat()
+            except (OSError, ValueError) as e:
+                self._report(f"Failed to reload {self.path}: {e}")
+                return None
+            # Changes still waiting for the debounce timer stay on top of what other processes wrote.
+            apply_changes(settings, self.changes)
+            if settings == self.seen:
+                return None
+            self.seen = copy.deepcopy(settings)
+        self._notify(settings)
+        return settings
+
+    def watch(self, callback, interval=1.0):
+        self.listeners.append(callback)
+        with self.lock:
+            if self.watcher is not None:
+                return
+            self.watcher = threading.Thread(target=self._watch_loop, args=(interval,), daemon=True)
+            self.watcher.start()
+
+    def _watch_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                self._report(f"Settings watcher failed: {e}")
+
+    def _notify(self, settings):
+        for callback in list(self.listeners):
+            try:
+                callback(copy.deepcopy(settings))
+            except Exception as e:
+                self._report(f"Settings change listener failed: {e}")
+
+    def _report(self, message):
+        if self.on_error:
+            self.on_error(message)
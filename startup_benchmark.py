@@ -0,0 +1,103 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import statistics
+import subprocess
+
+WINDOW_PROBE = """
+import sys, time, json
+launched = float(sys.argv[1])
+import main
+imported = time.time()
+try:
+    app = main.TranslationApp()
+    app.update()
+    while not app.winfo_ismapped():
+        app.update()
+    shown = time.time()
+    app.destroy()
+except Exception as e:
+    print(json.dumps({"import_s": imported - launched, "error": str(e)}))
+else:
+    print(json.dumps({"import_s": imported - launched, "window_s": shown - launched}))
+"""
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure_import_times(module="main"):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            _, cumulative_us, indent, name = match.groups()
+            # Deeper entries are already counted in their parent's cumulative time.
+            if len(indent) <= 3:
+                times[name] = int(cumulative_us) / 1e6
+    return times
+
+
+def measure_time_to_window():
+    launched = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", WINDOW_PROBE, str(launched)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    lines = result.stdout.strip().splitlines()
+    if not lines:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output"}
+    return json.loads(lines[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure AI-PTA cold-start time and per-module import cost.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level imports to list.")
+    parser.add_argument("--record", help="Append the results as one JSON line to this file to track startup over time.")
+    args = parser.parse_args(argv)
+
+    import_runs = [measure_import_times() for _ in range(args.runs)]
+    module_times = {
+        name: statistics.median(run.get(name, 0.0) for run in import_runs)
+        for name in set().union(*import_runs)
+    }
+    window_runs = [measure_time_to_window() for _ in range(args.runs)]
+    window_times = [r["window_s"] for r in window_runs if "window_s" in r]
+    process_import_times = [r["import_s"] for r in window_runs if "import_s" in r]
+
+    print(f"import main (median of {args.runs}): {module_times.get('main', 0.0) * 1000:.1f} ms")
+    if process_import_times:
+        print(f"interpreter start + import main:   {statistics.median(process_import_times) * 1000:.1f} ms")
+    if window_times:
+        print(f"time to window:                    {statistics.median(window_times) * 1000:.1f} ms")
+    else:
+        errors = {r.get("error") for r in window_runs}
+        print(f"time to window: unavailable ({'; '.join(e for e in errors if e)})")
+
+    print("\nSlowest top-level imports:")
+    for name, seconds in sorted(module_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    if args.record:
+        record = {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "import_main_s": module_times.get("main"),
+            "time_to_window_s": statistics.median(window_times) if window_times else None,
+            "modules_s": module_times
+        }
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import os
+import re
+import csv
+import sqlite3
+import threading
+
+TERM_DIR = "terminology"
+INDEX_DIR_NAME = ".index"
+_PREFIX_UPPER_BOUND = "\U0010ffff"
+
+
+def _build_trie(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[''] = True
+    return trie
+
+
+def _trie_to_pattern(node):
+    alternatives, single_chars = [], []
+    for ch in sorted(k for k in node if k):
+        sub_pattern = _trie_to_pattern(node[ch])
+        if sub_pattern:
+            alternatives.append(re.escape(ch) + sub_pattern)
+        else:
+            single_chars.append(re.escape(ch))
+    if single_chars:
+        alternatives.append(single_chars[0] if len(single_chars) == 1 else "[" + "".join(single_chars) + "]")
+    if not alternatives:
+        return ""
+    pattern = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    if '' in node:
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+class TermMatcher:
+
+    def __init__(self, terms, pattern=None):
+        self.terms = terms
+        if pattern is None:
+            pattern = _trie_to_pattern(_build_trie(t for t in terms if t))
+        self.pattern_source = pattern
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def finditer(self, text):
+        if self.pattern is None:
+            return
+        for match in self.pattern.finditer(text):
+            yield match.start(), match.end(), match.group()
+
+    def find_terms(self, *texts):
+        found = {}
+        for text in texts:
+            for _, _, source in self.finditer(text):
+                if source not in found:
+                    found[source] = self.terms[source]
+        return found
+
+    def annotate(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: f"{m.group()}{{{self.terms[m.group()]}}}", text)
+
+
+class TermStore:
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.name = os.path.basename(csv_path)
+        index_dir = os.path.join(os.path.dirname(csv_path), INDEX_DIR_NAME)
+        os.makedirs(index_dir, exist_ok=True)
+        self.db_path = os.path.join(index_dir, os.path.splitext(self.name)[0] + ".sqlite3")
+        self.lock = threading.RLock()
+        self._matcher = None
+
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS terms (
+                source TEXT PRIMARY KEY,
+                target TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        if self._csv_changed_since_import():
+            self.import_csv(self.csv_path, replace=True)
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _csv_signature(self):
+        stat = os.stat(self.csv_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _csv_changed_since_import(self):
+        if not os.path.exists(self.csv_path):
+            return False
+        return self._get_meta('csv_signature') != self._csv_signature()
+
+    def _invalidate(self):
+        self._matcher = None
+        self._set_meta('matcher_pattern', None)
+        self._set_meta('dirty', '1')
+
+    @property
+    def is_dirty(self):
+        return self._get_meta('dirty') == '1'
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+
+    def __contains__(self, source):
+        return self.get(source) is not None
+
+    def get(self, source):
+        with self.lock:
+            row = self.conn.execute("SELECT target FROM terms WHERE source = ?", (source,)).fetchone()
+            return row[0] if row else None
+
+    def set(self, source, target):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO terms (source, target) VALUES (?, ?)", (source, target))
+            self._invalidate()
+            self.conn.commit()
+
+    def delete(self, source):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM terms WHERE source = ?", (source,)).rowcount
+            if deleted:
+                self._invalidate()
+            self.conn.commit()
+            return bool(deleted)
+
+    def replace(self, old_source, new_source, new_target):
+        with self.lock:
+            self.conn.execute("DELETE FROM terms WHERE source = ?", (old_source,))
+            self.conn.execute("INSERT OR REPLACE INTO terms (source, target) VALUES (?, ?)", (new_source, new_target))
+            self._invalidate()
+            self.conn.commit()
+
+    def items(self):
+        with self.lock:
+            return self.conn.execute("SELECT source, target FROM terms ORDER BY source").fetchall()
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def _prefix_clause(self, prefix):
+        if not prefix:
+            return "", ()
+        return "WHERE source >= ? AND source < ?", (prefix, prefix + _PREFIX_UPPER_BOUND)
+
+    def count(self, prefix=""):
+        clause, params = self._prefix_clause(prefix)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM terms {clause}", params).fetchone()[0]
+
+    def rank(self, source, prefix=""):
+        clause, params = self._prefix_clause(prefix)
+        clause = f"{clause} AND source < ?" if clause else "WHERE source < ?"
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM terms {clause}", params + (source,)).fetchone()[0]
+
+    def search(self, prefix="", offset=0, limit=-1):
+        clause, params = self._prefix_clause(prefix)
+        with self.lock:
+            return self.conn.execute(
+                f"SELECT source, target FROM terms {clause} ORDER BY source LIMIT ? OFFSET ?", params + (limit, offset)
+            ).fetchall()
+
+    def import_csv(self, csv_path, replace=False):
+        rows, skipped = [], 0
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[0].strip() and row[1].strip():
+                    rows.append((row[0].strip(), row[1].strip()))
+                else:
+                    skipped += 1
+        with self.lock:
+            if replace:
+                self.conn.execute("DELETE FROM terms")
+            self.conn.executemany("INSERT OR REPLACE INTO terms (source, target) VALUES (?, ?)", rows)
+            self._matcher = None
+            self._set_meta('matcher_pattern', None)
+            if replace and os.path.abspath(csv_path) == os.path.abspath(self.csv_path):
+                self._set_meta('csv_signature', self._csv_signature())
+                self._set_meta('dirty', '0')
+            else:
+                self._set_meta('dirty', '1')
+            self.conn.commit()
+        return len(rows), skipped
+
+    def export_csv(self, csv_path=None):
+        csv_path = csv_path or self.csv_path
+        tmp_path = csv_path + ".tmp"
+        with self.lock:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerows(self.conn.execute("SELECT source, target FROM terms ORDER BY source"))
+            os.replace(tmp_path, csv_path)
+            if os.path.abspath(csv_path) == os.path.abspath(self.csv_path):
+                self._set_meta('csv_signature', self._csv_signature())
+                self._set_meta('dirty', '0')
+                self.conn.commit()
+
+    def sync_csv(self):
+        if self.is_dirty:
+            self.export_csv()
+            return True
+        return False
+
+    def matcher(self):
+        with self.lock:
+            if self._matcher is None:
+                terms = self.as_dict()
+                pattern = self._get_meta('matcher_pattern')
+                self._matcher = TermMatcher(terms, pattern)
+                if pattern is None:
+                    self._set_meta('matcher_pattern', self._matcher.pattern_source)
+                    self.conn.commit()
+            return self._matcher
+
+
+def format_term_list(terms):
+    return "\n".join(f"{source} → {target}" for source, target in terms.items())
+
+
+def list_term_files(term_dir=TERM_DIR):
+    if not os.path.isdir(term_dir):
+        return []
+    return sorted(f for f in os.listdir(term_dir) if f.endswith('.csv'))
@@ -0,0 +1,160 @@
+import re
+import zlib
+import random
+import sqlite3
+import hashlib
+import threading
+
+from corpus_io import read_corpus, is_error_display_value
+
+TM_FILE = "translation_memory.db"
+
+_HASH_PRIME = (1 << 32) + 15
+# Score for segments that match only after case and whitespace are normalized, so they stay below auto-apply at 1.0.
+NORMALIZED_MATCH_SCORE = 0.99
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_segment(text):
+    return _WHITESPACE.sub(' ', str(text)).strip().lower()
+
+
+def segment_hash(text):
+    return hashlib.sha1(normalize_segment(text).encode('utf-8')).hexdigest()
+
+
+def char_ngrams(text, n):
+    normalized = normalize_segment(text)
+    if len(normalized) <= n:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+
+def ngram_similarity(grams_a, grams_b):
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+class TranslationMemory:
+
+    def __init__(self, db_path=TM_FILE, ngram_size=3, bands=8, rows_per_band=4, max_candidates=200, max_scored=16):
+        self.db_path = db_path
+        self.ngram_size = ngram_size
+        self.bands = bands
+        self.rows_per_band = rows_per_band
+        self.max_candidates = max_candidates
+        self.max_scored = max_scored
+        self.lock = threading.Lock()
+
+        import numpy as np
+        rng = random.Random(20250101)
+        num_perm = bands * rows_per_band
+        self._perm_a = np.array([rng.randrange(1, 1 << 31) for _ in range(num_perm)], dtype=np.uint64)
+        self._perm_b = np.array([rng.randrange(0, 1 << 31) for _ in range(num_perm)], dtype=np.uint64)
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY,
+                source_hash TEXT UNIQUE NOT NULL,
+                source TEXT NOT NULL,
+                target TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                segment_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON lsh_buckets (band, bucket);
+        """)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def _band_buckets(self, grams):
+        if not grams:
+            return []
+        import numpy as np
+        hashes = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+        signature = ((self._perm_a[:, None] * hashes[None, :] + self._perm_b[:, None]) % _HASH_PRIME).min(axis=1)
+        bands = signature.reshape(self.bands, self.rows_per_band)
+        return [(band, zlib.crc32(bands[band].tobytes())) for band in range(self.bands)]
+
+    def add_many(self, pairs):
+        added = 0
+        with self.lock:
+            for source, target in pairs:
+                source, target = str(source).strip(), str(target).strip()
+                if not source or not target:
+                    continue
+                key = segment_hash(source)
+                row = self.conn.execute("SELECT id FROM segments WHERE source_hash = ?", (key,)).fetchone()
+                if row:
+                    self.conn.execute("UPDATE segments SET source = ?, target = ? WHERE id = ?", (source, target, row[0]))
+                    continue
+                segment_id = self.conn.execute(
+                    "INSERT INTO segments (source_hash, source, target) VALUES (?, ?, ?)", (key, source, target)
+                ).lastrowid
+                self.conn.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, segment_id) VALUES (?, ?, ?)",
+                    [(band, bucket, segment_id) for band, bucket in self._band_buckets(char_ngrams(source, self.ngram_size))]
+                )
+                added += 1
+            self.conn.commit()
+        return added
+
+    def add(self, source, target):
+        return self.add_many([(source, target)])
+
+    def import_corpus(self, excel_path):
+        sources, translations = read_corpus(excel_path)
+        pairs = [(s, t) for s, t in zip(sources, translations) if t and not is_error_display_value(t)]
+        return self.add_many(pairs)
+
+    def lookup(self, text, threshold=0.75, limit=3):
+        with self.lock:
+            exact = self.conn.execute("SELECT source, target FROM segments WHERE source_hash = ?", (segment_hash(text),)).fetchone()
+            if exact:
+                score = 1.0 if exact[0] == str(text).strip() else NORMALIZED_MATCH_SCORE
+                return [(score, exact[0], exact[1])]
+
+            grams = char_ngrams(text, self.ngram_size)
+            band_hits = {}
+            for band, bucket in self._band_buckets(grams):
+                rows = self.conn.execute(
+                    "SELECT segment_id FROM lsh_buckets WHERE band = ? AND bucket = ? LIMIT ?",
+                    (band, bucket, self.max_candidates)
+                ).fetchall()
+                for (segment_id,) in rows:
+                    band_hits[segment_id] = band_hits.get(segment_id, 0) + 1
+            if not band_hits:
+                return []
+
+            candidate_ids = sorted(band_hits, key=band_hits.get, reverse=True)[:self.max_scored]
+            placeholders = ",".join("?" * len(candidate_ids))
+            candidates = self.conn.execute(
+                f"SELECT source, target FROM segments WHERE id IN ({placeholders})", tuple(candidate_ids)
+            ).fetchall()
+
+        matches = []
+        for source, target in candidates:
+            score = min(ngram_similarity(grams, char_ngrams(source, self.ngram_size)), NORMALIZED_MATCH_SCORE)
+            if score >= threshold:
+                matches.append((score, source, target))
+        matches.sort(key=lambda m: m[0], reverse=True)
+        return matches[:limit]
+
+
+def format_tm_references(matches):
+    lines = ["[Translation Memory References]"]
+    for score, source, target in matches:
+        lines.append(f"({score:.0%} match) Source: {source}")
+        lines.append(f"Translation: {target}")
+    return lines
@@ -1,19 +1,26 @@
 import os
-import csv
 import json
 import time
 import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 
-import openai
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 
-from app_utils import log_error, save_settings, split_text_into_paragraphs, translate_single_paragraph
+from app_utils import log_error, save_settings, translate_single_paragraph, request_pacer, RunStats, AdaptiveLimiter, CancelToken
+from corpus_io import SheetAppender, open_sheet_rows, cell_text, is_error_display_value
+from quality_checks import triage_rows, load_previous_post_edits
+from prompt_templates import POST_EDIT_PLACEHOLDERS, PromptTemplateError, compile_template, build_prefix_cached_messages
+from term_store import TermStore, list_term_files
 
 RESUME_PE_FILE = "resume_post_edit.json"
+CLOSE_TIMEOUT = 15
+IN_FLIGHT_PER_WORKER = 4
+TRIAGE_CHUNK_ROWS = 500
+REORDER_LIMIT = 5000
+DUPLICATE_CACHE_ROWS = 10000
 
 class TermEditDialog(tk.Toplevel):
 
@@ -79,11 +86,124 @@ class TermEditDialog(tk.Toplevel):
     def _cancel(self, event=None):
         self.destroy()
 
+class VirtualTermList(ttk.Frame):
+
+    def __init__(self, parent, fetch_rows, count_rows, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.fetch_rows = fetch_rows
+        self.count_rows = count_rows
+        self.total = 0
+        self.offset = 0
+        self.visible_rows = []
+        self.selected_source = None
+
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.listbox = tk.Listbox(self, font=("Segoe UI", 10), height=5, activestyle="none", exportselection=False)
+        self.listbox.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.listbox.bind("<Configure>", lambda e: self._render())
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_mousewheel)
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(3))
+        self.listbox.bind("<Up>", lambda e: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda e: self._move_selection(1))
+        self.listbox.bind("<Prior>", lambda e: self._move_selection(-self._page_size()))
+        self.listbox.bind("<Next>", lambda e: self._move_selection(self._page_size()))
+
+    def _page_size(self):
+        height = self.listbox.winfo_height()
+        row_height = self.listbox.bbox(0)[3] if self.visible_rows and self.listbox.bbox(0) else 0
+        if height <= 1 or not row_height:
+            return int(self.listbox.cget("height"))
+        return max(1, height // (row_height + 1))
+
+    def refresh(self):
+        self.total = self.count_rows()
+        self._render()
+
+    def scroll(self, delta):
+        self.offset += delta
+        self._render()
+        return "break"
+
+    def scroll_to(self, index):
+        page = self._page_size()
+        if index < self.offset or index >= self.offset + page:
+            self.offset = index - page // 2
+        self._render()
+
+    def _render(self):
+        page = self._page_size()
+        self.offset = max(0, min(self.offset, self.total - page))
+        self.visible_rows = self.fetch_rows(self.offset, page) if self.total else []
+        self.listbox.delete(0, tk.END)
+        for position, (source, target) in enumerate(self.visible_rows):
+            self.listbox.insert(tk.END, f"{source} → {target}")
+            if source == self.selected_source:
+                self.listbox.selection_set(position)
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, min(1.0, (self.offset + len(self.visible_rows)) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def update_row(self, old_source, source, target):
+        for position, row in enumerate(self.visible_rows):
+            if row[0] == old_source and source == old_source:
+                self.visible_rows[position] = (source, target)
+                self.listbox.delete(position)
+                self.listbox.insert(position, f"{source} → {target}")
+                if source == self.selected_source:
+                    self.listbox.selection_set(position)
+                return True
+        return False
+
+    def _on_scrollbar(self, action, value, unit=None):
+        page = self._page_size()
+        if action == "moveto":
+            self.offset = int(float(value) * self.total)
+        elif action == "scroll":
+            self.offset += int(value) * (page if unit == "pages" else 1)
+        self._render()
+
+    def _on_mousewheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.visible_rows):
+            self.selected_source = self.visible_rows[selection[0]][0]
+
+    def _move_selection(self, delta):
+        selection = self.listbox.curselection()
+        position = (selection[0] if selection else 0) + delta
+        page = len(self.visible_rows)
+        if position < 0 or position >= page:
+            self.offset += delta
+            self._render()
+            position = max(0, min(position, len(self.visible_rows) - 1))
+        self.listbox.selection_clear(0, tk.END)
+        if self.visible_rows:
+            self.listbox.selection_set(position)
+            self.listbox.activate(position)
+            self._on_select()
+        return "break"
+
+    def selected(self):
+        selection = self.listbox.curselection()
+        if not selection or selection[0] >= len(self.visible_rows):
+            return None
+        return self.visible_rows[selection[0]]
+
 class TermAnnotatorApp:
 
     def __init__(self, root):
         self.root = root
-        self.current_terms = {}
+        self.term_store = None
+        self.search_var = tk.StringVar()
         self.source_file_path = tk.StringVar()
     
         self._setup_window()
@@ -153,15 +273,16 @@ class TermAnnotatorApp:
         ttk.Label(frame, text="Current Terms:").grid(row=1, column=0, padx=5, pady=5, sticky=(tk.W, tk.N))
         term_list_frame = ttk.Frame(frame)
         term_list_frame.grid(row=1, column=1, rowspan=2, padx=5, pady=5, sticky="nsew")
-        term_list_frame.rowconfigure(0, weight=1)
+        term_list_frame.rowconfigure(1, weight=1)
         term_list_frame.columnconfigure(0, weight=1)
+
+        search_entry = ttk.Entry(term_list_frame, textvariable=self.search_var)
+        search_entry.grid(row=0, column=0, sticky="ew", pady=(0, 5))
+        self.search_var.trace_add("write", self._on_search_changed)
+        self.search_after_id = None
         
-        self.term_listbox = tk.Listbox(term_list_frame, font=("Segoe UI", 10), height=5)
-        self.term_listbox.grid(row=0, column=0, sticky="nsew")
-        
-        scrollbar = ttk.Scrollbar(term_list_frame, orient=tk.VERTICAL, command=self.term_listbox.yview)
-        scrollbar.grid(row=0, column=1, sticky="ns")
-        self.term_listbox.config(yscrollcommand=scrollbar.set)
+        self.term_list = VirtualTermList(term_list_frame, self._fetch_terms, self._count_terms)
+        self.term_list.grid(row=1, column=0, sticky="nsew")
         
         frame.rowconfigure(1, weight=1)
     
@@ -172,7 +293,11 @@ class TermAnnotatorApp:
         self.modify_term_button = ttk.Button(term_actions_frame, text="Modify", command=self._modify_term, state=tk.DISABLED)
         self.modify_term_button.pack(side=tk.LEFT, padx=(0, 5))
         self.delete_term_button = ttk.Button(term_actions_frame, text="Delete", command=self._delete_term, state=tk.DISABLED)
-        self.delete_term_button.pack(side=tk.LEFT)
+        self.delete_term_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.import_terms_button = ttk.Button(term_actions_frame, text="Import CSV...", command=self._import_terms, state=tk.DISABLED)
+        self.import_terms_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.export_terms_button = ttk.Button(term_actions_frame, text="Export CSV...", command=self._export_terms, state=tk.DISABLED)
+        self.export_terms_button.pack(side=tk.LEFT)
     
         ttk.Label(frame, text="Select Source File:").grid(row=3, column=0, padx=5, pady=5, sticky=tk.W)
         entry = ttk.Entry(frame, textvariable=self.source_file_path, state="readonly")
@@ -230,7 +355,7 @@ class TermAnnotatorApp:
             return
     
         try:
-            csv_files = [f for f in os.listdir(term_dir) if f.endswith('.csv')]
+            csv_files = list_term_files(term_dir)
             self.term_db_combo['values'] = csv_files
             if csv_files:
                 self.term_db_combo.current(0)
@@ -247,21 +372,13 @@ class TermAnnotatorApp:
         if not filename: return
         
         filepath = os.path.join("terminology", filename)
-        self.current_terms = {}
-        self.term_listbox.delete(0, tk.END)
+        self._close_term_store()
     
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                for i, row in enumerate(reader):
-                    if len(row) >= 2 and row[0] and row[1]:
-                        source_term, target_term = row[0].strip(), row[1].strip()
-                        self.current_terms[source_term] = target_term
-                    else:
-                        print(f"Warning: Skipping invalid row {i+1} in file '{filename}': {row}")
+            self.term_store = TermStore(filepath)
             self._update_term_listbox()
-            self._update_status(f"Successfully loaded '{filename}' with {len(self.current_terms)} terms.", "green")
-            for btn in [self.add_term_button, self.modify_term_button, self.delete_term_button]:
+            self._update_status(f"Successfully loaded '{filename}' with {len(self.term_store)} terms.", "green")
+            for btn in [self.add_term_button, self.modify_term_button, self.delete_term_button, self.import_terms_button, self.export_terms_button]:
                 btn.config(state=tk.NORMAL)
         except FileNotFoundError:
             messagebox.showerror("Error", f"File '{filename}' not found.", parent=self.root)
@@ -269,88 +386,135 @@ class TermAnnotatorApp:
         except Exception as e:
             messagebox.showerror("Error", f"Error reading file '{filename}': {e}", parent=self.root)
             self._update_status(f"Failed to read file '{filename}'", "red")
-    
-    def _update_term_listbox(self):
-        self.term_listbox.delete(0, tk.END)
-        for source, target in sorted(self.current_terms.items()):
-            self.term_listbox.insert(tk.END, f"{source} → {target}")
-    
-    def _save_current_terms(self):
-        filename = self.term_db_combo.get()
-        if not filename:
-            self._update_status("Error: No terminology file selected for saving.", "red")
-            return False
-        
-        filepath = os.path.join("terminology", filename)
+
+    def _close_term_store(self):
+        if not self.term_store:
+            return
         try:
-            with open(filepath, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                for source, target in sorted(self.current_terms.items()):
-                    writer.writerow([source, target])
-            self._update_status(f"Terminology '{filename}' saved automatically.", "green")
-            return True
+            self.term_store.sync_csv()
         except Exception as e:
-            messagebox.showerror("Save Failed", f"Could not save terminology '{filename}':\n{e}", parent=self.root)
-            self._update_status(f"Failed to save terminology: {e}", "red")
-            return False
+            messagebox.showerror("Save Failed", f"Could not save terminology '{self.term_store.name}':\n{e}", parent=self.root)
+            log_error(f"Failed to export terminology '{self.term_store.name}': {e}")
+        self.term_store.close()
+        self.term_store = None
+    
+    def _fetch_terms(self, offset, limit):
+        if not self.term_store:
+            return []
+        return self.term_store.search(self.search_var.get().strip(), offset, limit)
+
+    def _count_terms(self):
+        if not self.term_store:
+            return 0
+        return self.term_store.count(self.search_var.get().strip())
+
+    def _on_search_changed(self, *args):
+        if self.search_after_id:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(150, self._apply_search)
+
+    def _apply_search(self):
+        self.search_after_id = None
+        self.term_list.offset = 0
+        self.term_list.refresh()
+
+    def _update_term_listbox(self):
+        self.term_list.refresh()
+
+    def _show_term(self, source):
+        self.term_list.selected_source = source
+        self.term_list.refresh()
+        prefix = self.search_var.get().strip()
+        if self.term_store and source.startswith(prefix):
+            self.term_list.scroll_to(self.term_store.rank(source, prefix))
     
     def _add_term(self):
         dialog = TermEditDialog(self.root, "Add New Term")
         if dialog.result:
             source, target = dialog.result
-            if source in self.current_terms:
+            if source in self.term_store:
                 if not messagebox.askyesno("Term Exists", f"Source term '{source}' already exists. Do you want to overwrite it?", parent=self.root):
                     return
             
-            self.current_terms[source] = target
-            if self._save_current_terms():
-                self._update_term_listbox()
-                self._update_status(f"Added term: {source} → {target}", "green")
+            exists = source in self.term_store
+            try:
+                self.term_store.set(source, target)
+            except Exception as e:
+                messagebox.showerror("Save Failed", f"Could not save term '{source}':\n{e}", parent=self.root)
+                return
+            if not (exists and self.term_list.update_row(source, source, target)):
+                self._show_term(source)
+            self._update_status(f"Added term: {source} → {target}", "green")
     
     def _modify_term(self):
-        selected_indices = self.term_listbox.curselection()
-        if not selected_indices:
+        selected = self.term_list.selected()
+        if not selected:
             messagebox.showwarning("Invalid Operation", "Please select a term to modify from the list first.", parent=self.root)
             return
     
-        selected_item = self.term_listbox.get(selected_indices[0])
-        try:
-            old_source, old_target = [s.strip() for s in selected_item.split('→')]
-        except ValueError:
-            messagebox.showerror("Format Error", "Could not parse the selected term line.", parent=self.root)
-            return
+        old_source, old_target = selected
     
         dialog = TermEditDialog(self.root, "Modify Term", old_source, old_target)
         if dialog.result:
             new_source, new_target = dialog.result
-            del self.current_terms[old_source]
-            self.current_terms[new_source] = new_target
-            
-            if self._save_current_terms():
-                self._update_term_listbox()
-                self._update_status(f"Modified term: {new_source} → {new_target}", "green")
-            else:
-                del self.current_terms[new_source]
-                self.current_terms[old_source] = old_target
+            try:
+                self.term_store.replace(old_source, new_source, new_target)
+            except Exception as e:
+                messagebox.showerror("Save Failed", f"Could not save term '{new_source}':\n{e}", parent=self.root)
+                return
+            if not self.term_list.update_row(old_source, new_source, new_target):
+                self._show_term(new_source)
+            self._update_status(f"Modified term: {new_source} → {new_target}", "green")
     
     def _delete_term(self):
-        selected_indices = self.term_listbox.curselection()
-        if not selected_indices:
+        selected = self.term_list.selected()
+        if not selected:
             messagebox.showwarning("Invalid Operation", "Please select a term to delete from the list first.", parent=self.root)
             return
             
-        selected_item = self.term_listbox.get(selected_indices[0])
-        if messagebox.askyesno("Confirm Deletion", f"Are you sure you want to delete the following term?\n\n{selected_item}", parent=self.root):
+        source_to_delete, target_to_delete = selected
+        if messagebox.askyesno("Confirm Deletion", f"Are you sure you want to delete the following term?\n\n{source_to_delete} → {target_to_delete}", parent=self.root):
             try:
-                source_to_delete = selected_item.split('→')[0].strip()
-                if source_to_delete in self.current_terms:
-                    del self.current_terms[source_to_delete]
-                    if self._save_current_terms():
-                        self._update_term_listbox()
-                        self._update_status(f"Deleted term: {source_to_delete}", "green")
+                if self.term_store.delete(source_to_delete):
+                    self.term_list.selected_source = None
+                    self._update_term_listbox()
+                    self._update_status(f"Deleted term: {source_to_delete}", "green")
             except Exception as e:
                 messagebox.showerror("Deletion Failed", f"An error occurred during deletion: {e}", parent=self.root)
     
+    def _import_terms(self):
+        filepath = filedialog.askopenfilename(
+            title="Import terms from CSV",
+            filetypes=(("CSV files", "*.csv"), ("All files", "*.*")),
+            parent=self.root
+        )
+        if not filepath:
+            return
+        try:
+            imported, skipped = self.term_store.import_csv(filepath)
+        except Exception as e:
+            messagebox.showerror("Import Failed", f"Could not import '{os.path.basename(filepath)}':\n{e}", parent=self.root)
+            return
+        self._update_term_listbox()
+        self._update_status(f"Imported {imported} terms ({skipped} invalid rows skipped) into '{self.term_store.name}'.", "green")
+
+    def _export_terms(self):
+        filepath = filedialog.asksaveasfilename(
+            title="Export terms to CSV",
+            defaultextension=".csv",
+            filetypes=(("CSV files", "*.csv"), ("All files", "*.*")),
+            initialfile=self.term_store.name,
+            parent=self.root
+        )
+        if not filepath:
+            return
+        try:
+            self.term_store.export_csv(filepath)
+        except Exception as e:
+            messagebox.showerror("Export Failed", f"Could not export terms:\n{e}", parent=self.root)
+            return
+        self._update_status(f"Exported {len(self.term_store)} terms to {os.path.basename(filepath)}.", "green")
+
     def _browse_source_file(self):
         filepath = filedialog.askopenfilename(
             title="Please select the source text file",
@@ -397,18 +561,12 @@ class TermAnnotatorApp:
                 messagebox.showerror("Export Failed", f"Could not write to file: {e}", parent=self.root)
                 self._update_status(f"File export failed: {e}", "red")
     
-    def _perform_annotation(self, source_text, term_dict):
-        sorted_terms = sorted(term_dict.keys(), key=len, reverse=True)
-        annotated_text = source_text
-        for source_term in sorted_terms:
-            target_term = term_dict[source_term]
-            annotation_tag = f"{source_term}{{{target_term}}}"
-            annotated_text = annotated_text.replace(source_term, annotation_tag)
-        return annotated_text
+    def _perform_annotation(self, source_text, term_store):
+        return term_store.matcher().annotate(source_text)
     
     def _start_annotation(self):
         source_text = self.source_text.get("1.0", tk.END).strip()
-        if not self.current_terms:
+        if not self.term_store or not len(self.term_store):
             messagebox.showwarning("Invalid Operation", "Please select and load a valid terminology first.", parent=self.root)
             return
         if not source_text:
@@ -419,7 +577,7 @@ class TermAnnotatorApp:
         self._update_status("Annotating, please wait...", "orange")
         
         try:
-            result = self._perform_annotation(source_text, self.current_terms)
+            result = self._perform_annotation(source_text, self.term_store)
             self.annotated_text.config(state=tk.NORMAL)
             self.annotated_text.delete("1.0", tk.END)
             self.annotated_text.insert("1.0", result)
@@ -432,6 +590,7 @@ class TermAnnotatorApp:
             self.annotate_button.config(state=tk.NORMAL)
     
     def _on_closing(self):
+        self._close_term_store()
         self.root.destroy()
 
 class PostEditingWindow(tk.Toplevel):
@@ -445,8 +604,9 @@ class PostEditingWindow(tk.Toplevel):
         self.rowconfigure(0, weight=1)
 
         self.selected_files = []
-        self.stop_requested = threading.Event()
+        self.stop_requested = CancelToken()
         self.is_processing = False
+        self.closing = False
         self.resume_data = None
         self.timer_id = None
     
@@ -459,10 +619,20 @@ class PostEditingWindow(tk.Toplevel):
         self.after(100, self._check_for_resume_task)
     
     def _on_closing(self):
+        if self.closing:
+            return
         if self.is_processing:
             if not messagebox.askyesno("Confirm Exit", "A post-editing task is in progress. Exiting now will stop it. Are you sure?", parent=self):
                 return
             self.stop_requested.set()
+            self._update_status("Stopping and saving progress before exit...", "orange")
+        self.closing = True
+        self._close_when_idle(time.monotonic() + CLOSE_TIMEOUT)
+
+    def _close_when_idle(self, deadline):
+        if self.is_processing and time.monotonic() < deadline:
+            self.after(100, self._close_when_idle, deadline)
+            return
         self.destroy()
     
     def _setup_style(self):
@@ -526,8 +696,19 @@ class PostEditingWindow(tk.Toplevel):
         prompt_scrollbar.grid(row=1, column=1, sticky="ns")
         self.prompt_text.config(yscrollcommand=prompt_scrollbar.set)
     
-        self.process_button = ttk.Button(main_frame, text="Start Post-editing", command=self._start_post_editing, style="Accent.TButton")
-        self.process_button.grid(row=2, column=0, pady=10, sticky="ew")
+        self.triage_var = tk.BooleanVar(value=self.parent.settings.get('post_edit_triage', {}).get('enabled', False))
+        ttk.Checkbutton(
+            main_frame, text="Triage rows first (copy numbers, headings, unchanged and previously edited rows without an API call)",
+            variable=self.triage_var, command=self._on_triage_toggled
+        ).grid(row=2, column=0, sticky="w", pady=(5, 0))
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=3, column=0, pady=10, sticky="ew")
+        button_frame.columnconfigure(0, weight=1)
+        self.process_button = ttk.Button(button_frame, text="Start Post-editing", command=self._start_post_editing, style="Accent.TButton")
+        self.process_button.grid(row=0, column=0, sticky="ew")
+        self.pause_button = ttk.Button(button_frame, text="Pause", command=self._toggle_pause, state=tk.DISABLED)
+        self.pause_button.grid(row=0, column=1, sticky="e", padx=(5, 0))
     
         status_bar = ttk.Frame(self)
         status_bar.grid(row=1, column=0, sticky="ew")
@@ -573,6 +754,10 @@ class PostEditingWindow(tk.Toplevel):
             self.timer_id = None
         self.timer_label.config(text="")
     
+    def _on_triage_toggled(self):
+        self.parent.settings.setdefault('post_edit_triage', {})['enabled'] = self.triage_var.get()
+        save_settings(self.parent.settings)
+
     def _update_prompt_combo(self):
         self.prompt_combo['values'] = list(self.parent.settings['post_editing_prompts'].keys())
     
@@ -641,11 +826,11 @@ class PostEditingWindow(tk.Toplevel):
             self.file_listbox.insert(tk.END, os.path.basename(f))
         self._update_status(f"Ready to resume. {len(self.selected_files)} files loaded.", "blue")
     
-    def _save_resume_state(self, current_file, last_index, edited_paras, all_files):
+    def _save_resume_state(self, current_file, last_index, partial_path, all_files):
         state = {
             'current_file': current_file,
             'last_row_index': last_index,
-            'edited_paragraphs': edited_paras,
+            'partial_path': partial_path,
             'all_files': all_files
         }
         try:
@@ -653,16 +838,40 @@ class PostEditingWindow(tk.Toplevel):
         except Exception as e:
             log_error(f"Failed to save post-edit resume state: {e}")
     
+    def _previous_post_edits(self, resume_data):
+        # Rows finished before the stop are read back from the partial output rather than stored in the resume
+        # file; resume files written by older versions still carry them as a list.
+        if 'edited_paragraphs' in resume_data:
+            for edited_text in resume_data['edited_paragraphs']:
+                yield edited_text, ""
+            return
+        partial_path = resume_data.get('partial_path')
+        if not partial_path or not os.path.exists(partial_path):
+            raise ValueError(f"The partial output of the interrupted task ({partial_path}) is missing; start the file again instead of resuming.")
+        header, rows, _ = open_sheet_rows(partial_path)
+        edited_col = header.index('Post-edited')
+        triage_col = header.index('Triage') if 'Triage' in header else None
+        try:
+            for values in rows:
+                yield cell_text(values[edited_col]), cell_text(values[triage_col]) if triage_col is not None else ""
+        finally:
+            rows.close()
+
     def _start_post_editing(self):
         if not self.selected_files: return messagebox.showerror("Error", "Please select one or more Excel files.", parent=self)
         prompt = self.prompt_text.get("1.0", tk.END).strip()
         if not prompt: return messagebox.showerror("Error", "Prompt cannot be empty.", parent=self)
         if "{source}" not in prompt or "{target}" not in prompt:
             return messagebox.showerror("Error", "Prompt must contain {source} and {target} placeholders.", parent=self)
+        try:
+            compile_template(prompt, POST_EDIT_PLACEHOLDERS)
+        except PromptTemplateError as e:
+            return messagebox.showerror("Invalid Prompt", str(e), parent=self)
     
         self.is_processing = True
         self.stop_requested.clear()
         self.process_button.config(text="Stop Processing", command=self._stop_post_editing)
+        self.pause_button.config(text="Pause", state=tk.NORMAL)
         self._update_status("Processing...", "orange")
     
         threading.Thread(target=self._post_editing_task, args=(self.resume_data,), daemon=True).start()
@@ -670,19 +879,44 @@ class PostEditingWindow(tk.Toplevel):
     
     def _stop_post_editing(self):
         self.stop_requested.set()
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
         self._cancel_timer()
         self._update_status("Stopping...", "orange")
+
+    def _toggle_pause(self):
+        if self.stop_requested.paused:
+            self.stop_requested.resume()
+            self.pause_button.config(text="Pause")
+            self._update_status("Resumed.", "orange")
+        else:
+            self.stop_requested.pause()
+            self.pause_button.config(text="Resume")
+            self._update_status("Paused. Requests already sent will finish; no new ones start until you resume.", "blue")
+
+    def _finish_task_buttons(self):
+        self.process_button.config(text="Start Post-editing", command=self._start_post_editing)
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
     
     def _post_editing_task(self, resume_data=None):
+        import pandas as pd
+        executor, client, writer = None, None, None
         try:
             model_name = self.parent.model_name_var.get().strip()
             max_tokens = self.parent.settings.get('max_tokens', 8000)
             retry_attempts = self.parent.settings.get('retry_attempts', 3)
             paragraph_timeout = self.parent.settings.get('paragraph_timeout', 300)
-            request_interval_value = self.parent.settings.get('request_interval', 5)
-            prompt_template = self.prompt_text.get("1.0", tk.END).strip()
+            pacer = request_pacer(self.parent.settings)
+            max_workers = max(1, self.parent.settings.get('max_workers', 4))
+            limiter = AdaptiveLimiter(max_workers) if self.parent.settings.get('adaptive_concurrency') else None
+            prompt_template = compile_template(self.prompt_text.get("1.0", tk.END).strip(), POST_EDIT_PLACEHOLDERS)
+            cache_friendly = self.parent.settings.get('cache_friendly_prompts', False)
+            triage_settings = self.parent.settings.get('post_edit_triage', {})
+            triage = triage_settings.get('enabled', False)
+            skip_patterns = triage_settings.get('skip_patterns')
+            triage_counts, triaged_rows, triage_total_rows = {}, 0, 0
             
             client = self.parent._create_client()
+            stats = RunStats()
             
             total_files = len(self.selected_files)
             start_file_index = 0
@@ -692,87 +926,164 @@ class PostEditingWindow(tk.Toplevel):
                 except ValueError:
                     log_error(f"Resumed file '{resume_data.get('current_file')}' not found in selection.")
 
+            def edit_one(i, source_text, target_text, file_name):
+                if not pacer.wait(self.stop_requested):
+                    return None
+                if cache_friendly:
+                    values = {"source": source_text, "target": target_text}
+                    if "file_name" in prompt_template: values["file_name"] = file_name
+                    if "index" in prompt_template: values["index"] = str(i + 1)
+                    full_prompt = build_prefix_cached_messages(prompt_template, values)
+                else:
+                    full_prompt = prompt_template.render(source=source_text, target=target_text, file_name=file_name, index=i + 1)
+                return translate_single_paragraph(client, model_name, full_prompt, max_tokens, retry_attempts, paragraph_timeout, stats, self.stop_requested, limiter)
+
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            window = max_workers * IN_FLIGHT_PER_WORKER
             for file_idx in range(start_file_index, total_files):
                 file_path = self.selected_files[file_idx]
                 file_name = os.path.basename(file_path)
 
                 self.after(0, self._update_status, f"[{file_idx+1}/{total_files}] Reading: {file_name}", "orange")
-                df = pd.read_excel(file_path)
-                
-                if 'Source' not in df.columns or 'Translation' not in df.columns:
+                header, rows, total_rows = open_sheet_rows(file_path)
+                if 'Source' not in header or 'Translation' not in header:
+                    rows.close()
                     log_error(f"File {file_name} skipped: must contain 'Source' and 'Translation' columns.")
                     continue
-    
-                edited_paragraphs = []
-                total_rows = len(df)
-                start_row = 0
+                source_col, target_col = header.index('Source'), header.index('Translation')
+                # Columns from an earlier post-editing pass are replaced, not duplicated.
+                kept_cols = [k for k, name in enumerate(header) if name not in ('Post-edited', 'Triage')]
+
+                base_name = os.path.splitext(file_name)[0]
+                output_dir = os.path.dirname(file_path)
+                excel_path = os.path.join(output_dir, f"{base_name}_postedited.xlsx")
+                txt_path = os.path.join(output_dir, f"{base_name}_postedited.txt")
+                partial_path = os.path.join(output_dir, f"{base_name}_postedited.partial.xlsx")
+                partial_txt_path = os.path.join(output_dir, f"{base_name}_postedited.partial.txt")
+
+                start_row, previous = 0, None
                 if resume_data and file_path == resume_data.get('current_file'):
                     start_row = resume_data.get('last_row_index', -1) + 1
-                    edited_paragraphs = resume_data.get('edited_paragraphs', [])
+                    previous = self._previous_post_edits(resume_data)
                     resume_data = None
-    
-                for i, row in df.iloc[start_row:].iterrows():
-                    if self.stop_requested.is_set():
-                        self._save_resume_state(file_path, i - 1, edited_paragraphs, self.selected_files)
-                        self.after(0, self._update_status, f"Stopped. Progress for '{file_name}' saved.", "blue")
-                        return
-    
-                    self.after(0, self._update_status, f"[{file_idx+1}/{total_files}] Editing {file_name} (row {i + 1}/{total_rows})", "orange")
-                    start_time = time.time()
-                    self.after(0, self._update_timer, start_time)
-    
-                    source_text, target_text = str(row['Source']), str(row['Translation'])
-                    full_prompt = prompt_template.format(source=source_text, target=target_text)
-                    
-                    edited_para = translate_single_paragraph(client, model_name, full_prompt, max_tokens, retry_attempts, paragraph_timeout)
-                    
-                    self.after(0, self._cancel_timer)
-                    edited_paragraphs.append(edited_para)
-                    
-                    if request_interval_value > 0 and i < total_rows - 1:
-                        time.sleep(request_interval_value)
-                
+
+                writer = SheetAppender(
+                    partial_path, [header[k] for k in kept_cols] + ['Post-edited'] + (['Triage'] if triage else []),
+                    error_columns=[len(kept_cols)], text_path=partial_txt_path, text_column=len(kept_cols)
+                )
+                cache = load_previous_post_edits(excel_path) if triage else None
+                # Rows wait here until every earlier row is done, then go to the output in order.
+                waiting, futures, leaders, followers, recent = {}, {}, {}, {}, OrderedDict()
+                written, file_triaged, exhausted = 0, 0, False
+
+                def write_ready():
+                    nonlocal written
+                    while written in waiting and waiting[written][1] is not None:
+                        values, edited_text, reason = waiting.pop(written)
+                        writer.append([values[k] for k in kept_cols] + [edited_text] + ([reason] if triage else []))
+                        written += 1
+
+                def collect(done):
+                    nonlocal file_triaged
+                    for future in done:
+                        i, key = futures.pop(future)
+                        result = future.result()
+                        if key is not None:
+                            del leaders[key]
+                        if result is None:
+                            continue
+                        waiting[i][1] = result
+                        if key is not None:
+                            recent[key] = result
+                            if len(recent) > DUPLICATE_CACHE_ROWS:
+                                recent.popitem(last=False)
+                            for follower in followers.pop(i, ()):
+                                waiting[follower][1:] = [result, "duplicate"]
+                                triage_counts["duplicate"] = triage_counts.get("duplicate", 0) + 1
+                                file_triaged += 1
+                    write_ready()
+                    parallel = f", {limiter.current} parallel" if limiter else ""
+                    skipped = f", {file_triaged} skipped by triage" if triage else ""
+                    progress = f"{written}/{total_rows}" if total_rows else f"{written} rows"
+                    self.after(0, self._update_status, f"[{file_idx+1}/{total_files}] Editing {file_name} ({progress}{parallel}{skipped})", "orange")
+
+                self.after(0, self._update_timer, time.time())
+                row_index = 0
+                while not exhausted and not self.stop_requested.is_set():
+                    chunk = list(islice(rows, TRIAGE_CHUNK_ROWS))
+                    exhausted = len(chunk) < TRIAGE_CHUNK_ROWS
+                    first = row_index
+                    row_index += len(chunk)
+                    reasons = copied = None
+                    if triage and row_index > start_row:
+                        reasons, copied = triage_rows(pd.DataFrame({
+                            'Source': [cell_text(values[source_col]) for values in chunk],
+                            'Translation': [cell_text(values[target_col]) for values in chunk]
+                        }), skip_patterns, cache)
+                        triage_total_rows += row_index - max(first, start_row)
+                    for offset, values in enumerate(chunk):
+                        i = first + offset
+                        if i < start_row:
+                            edited_text, reason = next(previous, ("", ""))
+                            waiting[i] = [values, edited_text, reason]
+                            if triage and edited_text and not is_error_display_value(edited_text):
+                                recent[(cell_text(values[source_col]), cell_text(values[target_col]))] = edited_text
+                            continue
+                        source_text, target_text = cell_text(values[source_col]), cell_text(values[target_col])
+                        if not source_text.strip() and not target_text.strip():
+                            waiting[i] = [values, "", ""]
+                            continue
+                        if reasons is not None and reasons[offset]:
+                            waiting[i] = [values, copied[offset], reasons[offset]]
+                            triage_counts[reasons[offset]] = triage_counts.get(reasons[offset], 0) + 1
+                            file_triaged += 1
+                            continue
+                        key = (source_text, target_text) if triage else None
+                        if key is not None and key in recent:
+                            waiting[i] = [values, recent[key], "duplicate"]
+                            triage_counts["duplicate"] = triage_counts.get("duplicate", 0) + 1
+                            file_triaged += 1
+                            continue
+                        waiting[i] = [values, None, ""]
+                        if key in leaders:
+                            # Repeated rows are edited once and copied, like the "cached" triage rule.
+                            followers.setdefault(leaders[key], []).append(i)
+                            continue
+                        if key is not None:
+                            leaders[key] = i
+                        futures[executor.submit(edit_one, i, source_text, target_text, file_name)] = (i, key)
+                        # Reading pauses while the window is full, so memory stays bounded by the rows in flight.
+                        while len(futures) >= window or (futures and len(waiting) >= REORDER_LIMIT):
+                            collect(wait(futures, return_when=FIRST_COMPLETED)[0])
+                    write_ready()
+                rows.close()
+                if previous is not None:
+                    previous.close()
+                while futures:
+                    collect(wait(futures, return_when=FIRST_COMPLETED)[0])
+                triaged_rows += file_triaged
+                self.after(0, self._cancel_timer)
+
+                if self.stop_requested.is_set() and (waiting or not exhausted):
+                    writer.close()
+                    self._save_resume_state(file_path, written - 1, partial_path, self.selected_files)
+                    self.after(0, self._update_status, f"Stopped. Progress for '{file_name}' saved.", "blue")
+                    return
+
                 self.after(0, self._update_status, f"[{file_idx+1}/{total_files}] Saving output for {file_name}...", "orange")
-                
-                df['Post-edited'] = pd.Series(edited_paragraphs)
-                output_df = df
-                base_name = os.path.splitext(file_name)[0]
-                output_dir = os.path.dirname(file_path)
-    
-                excel_path = os.path.join(output_dir, f"{base_name}_postedited.xlsx")
-                output_df.to_excel(excel_path, index=False, engine='openpyxl')
-                
-                red_bold_font = Font(color="FF0000", bold=True)
-                wb = load_workbook(excel_path)
-                ws = wb.active
-                post_edited_col_idx = -1
-                for col_idx, cell in enumerate(ws[1]):
-                    if cell.value == 'Post-edited':
-                        post_edited_col_idx = col_idx
-                        break
-                
-                if post_edited_col_idx != -1:
-                    for row_ws in ws.iter_rows(min_row=2, max_row=ws.max_row):
-                        cell = row_ws[post_edited_col_idx]
-                        if not isinstance(cell.value, str): continue
-                        if cell.value == "[ERROR_CONTENT_FILTER]":
-                            cell.value = "Rejected by API (content policy)"
-                            cell.font = red_bold_font
-                        elif cell.value == "[ERROR_NETWORK]":
-                            cell.value = "Network Issue"
-                            cell.font = red_bold_font
-                        elif cell.value.startswith("[ERROR_OTHER:"):
-                            cell.value = f"Failed: {cell.value[13:-3]}"
-                            cell.font = red_bold_font
-                wb.save(excel_path)
-                
-                if 'Post-edited' in output_df.columns and not output_df['Post-edited'].isnull().all():
-                    full_edited_text = "\n\n".join(output_df['Post-edited'].astype(str).tolist())
-                    txt_path = os.path.join(output_dir, f"{base_name}_postedited.txt")
-                    with open(txt_path, 'w', encoding='utf-8') as f: f.write(full_edited_text)
-            
+                writer.close(excel_path, txt_path)
+                writer = None
+                for path in (partial_path, partial_txt_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
             if os.path.exists(RESUME_PE_FILE): os.remove(RESUME_PE_FILE)
-            self.after(0, self._update_status, "Post-editing complete! All files saved.", "green")
+            triage_summary = ""
+            if triage and triage_total_rows:
+                breakdown = ", ".join(f"{reason} {count}" for reason, count in triage_counts.items())
+                triage_summary = f"triage skipped {triaged_rows}/{triage_total_rows} rows ({triaged_rows / triage_total_rows:.0%}" + (f": {breakdown})" if breakdown else ")")
+            summary = ", ".join(part for part in (triage_summary, stats.summary(), limiter.summary() if limiter else "") if part)
+            self.after(0, self._update_status, "Post-editing complete! All files saved." + (f" ({summary})" if summary else ""), "green")
     
         except Exception as e:
             error_message = f"Processing failed: {e}"
@@ -781,6 +1092,12 @@ class PostEditingWindow(tk.Toplevel):
             self.after(0, messagebox.showerror, "An Error Occurred", f"{e}\n\nDetails logged to error_log.txt", parent=self)
         
         finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+            if client is not None:
+                client.close()
+            if writer is not None:
+                writer.discard()
             self.is_processing = False
-            self.after(0, lambda: self.process_button.config(text="Start Post-editing", command=self._start_post_editing))
+            self.after(0, self._finish_task_buttons)
             self.after(0, self._cancel_timer)
\ No newline at end of file
@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from app_utils import SETTINGS_STORE, load_settings, log_error, build_paragraph_prompt, translate_single_paragraph, create_client, RequestPacer, RunStats
+from corpus_io import corpus_paths, write_corpus, write_translated_text
+from paragraph_index import index_path_for, split_file_with_index, save_index
+from prompt_templates import PromptTemplateError, compile_template
+from segment_filter import SegmentFilter, passthrough_settings
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class WorkQueue:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout = 60000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                output_dir TEXT NOT NULL,
+                dir_name TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                options TEXT NOT NULL,
+                index_json TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                job_id INTEGER NOT NULL,
+                paragraph_index INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                origin TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_claim ON items (status, lease_expires);
+            CREATE INDEX IF NOT EXISTS idx_items_job ON items (job_id, paragraph_index);
+        """)
+        if 'origin' not in {row[1] for row in self.conn.execute("PRAGMA table_info(items)")}:
+            self.conn.execute("ALTER TABLE items ADD COLUMN origin TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue_file(self, file_path, prompt_template, options, term_matcher=None):
+        file_name = os.path.basename(file_path)
+        dir_name = os.path.splitext(file_name)[0]
+        output_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), dir_name)
+        paragraphs, index = split_file_with_index(file_path)
+        if not paragraphs:
+            return None
+
+        context_before = options.get('context_before', 1)
+        context_after = options.get('context_after', 1)
+        segment_filter = SegmentFilter.from_settings(options.get('passthrough'))
+        passthrough = segment_filter.classify_range(paragraphs, 0, len(paragraphs)) if segment_filter else {}
+        # Non-translatable paragraphs are stored as already done, so no worker ever claims them.
+        rows = [
+            (j, paragraphs[j], "", 'done', paragraphs[j], f"passthrough ({passthrough[j]})") if j in passthrough else
+            (j, paragraphs[j], json.dumps(build_paragraph_prompt(
+                prompt_template, paragraphs, j, context_before, context_after, term_matcher,
+                cache_friendly=options.get('cache_friendly_prompts', False), file_name=file_name
+            )), 'pending', None, "translated")
+            for j in range(len(paragraphs))
+        ]
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            job_id = self.conn.execute(
+                "INSERT INTO jobs (file_path, output_dir, dir_name, total, options, index_json, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(file_path), output_dir, dir_name, len(paragraphs), json.dumps(options), json.dumps(index), time.time())
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO items (job_id, paragraph_index, source, prompt, status, result, origin) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_id,) + row for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, limit=1, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # An item that keeps crashing or stalling its workers is given up on, so it cannot hold its job open forever.
+            self.conn.execute(
+                "UPDATE items SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE attempts >= ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))",
+                (f"[ERROR_OTHER: Gave up after {max_attempts} attempts...]", max_attempts, now)
+            )
+            rows = self.conn.execute(
+                "SELECT items.id, items.job_id, items.prompt, jobs.options FROM items JOIN jobs ON jobs.id = items.job_id "
+                "WHERE items.status = 'pending' OR (items.status = 'leased' AND items.lease_expires < ?) "
+                "ORDER BY items.job_id, items.paragraph_index LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE items SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker_id, now + lease_seconds, row[0]) for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [(item_id, job_id, json.loads(prompt), json.loads(options)) for item_id, job_id, prompt, options in rows]
+
+    def renew(self, item_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        updated = self.conn.execute(
+            "UPDATE items SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (time.time() + lease_seconds, item_id, worker_id)
+        ).rowcount
+        return bool(updated)
+
+    def complete(self, item_id, worker_id, result):
+        # A worker whose lease expired and was taken over must not overwrite the new owner's result.
+        updated = self.conn.execute(
+            "UPDATE items SET status = 'done', result = ?, lease_expires = NULL WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (result, item_id, worker_id)
+        ).rowcount
+        return bool(updated)
+
+    def release(self, item_id, worker_id):
+        self.conn.execute(
+            "UPDATE items SET status = 'pending', lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (item_id, worker_id)
+        )
+
+    def status(self):
+        return self.conn.execute(
+            "SELECT jobs.id, jobs.file_path, jobs.status, jobs.total, "
+            "SUM(CASE WHEN items.status = 'done' THEN 1 ELSE 0 END), "
+            "SUM(CASE WHEN items.status = 'leased' THEN 1 ELSE 0 END) "
+            "FROM jobs JOIN items ON items.job_id = jobs.id GROUP BY jobs.id ORDER BY jobs.id"
+        ).fetchall()
+
+    def has_open_items(self):
+        return self.conn.execute("SELECT 1 FROM items WHERE status != 'done' LIMIT 1").fetchone() is not None
+
+    def assemble_ready_jobs(self):
+        assembled = []
+        ready = self.conn.execute(
+            "SELECT id, output_dir, dir_name, options, index_json FROM jobs WHERE status = 'queued' AND NOT EXISTS "
+            "(SELECT 1 FROM items WHERE items.job_id = jobs.id AND items.status != 'done')"
+        ).fetchall()
+        for job_id, output_dir, dir_name, options, index_json in ready:
+            # Several machines may run assemble at once; only the one that moves the job out of 'queued' writes it.
+            if not self.conn.execute("UPDATE jobs SET status = 'assembling' WHERE id = ? AND status = 'queued'", (job_id,)).rowcount:
+                continue
+            try:
+                rows = self.conn.execute(
+                    "SELECT source, result, COALESCE(origin, 'translated') FROM items WHERE job_id = ? ORDER BY paragraph_index", (job_id,)
+                ).fetchall()
+                paragraphs = [r[0] for r in rows]
+                translations = [r[1] for r in rows]
+                # As in the GUI, the Origin column is written whenever passthrough was enabled for the job.
+                write_origins = SegmentFilter.from_settings(json.loads(options).get('passthrough')) is not None
+
+                os.makedirs(output_dir, exist_ok=True)
+                translated_file_path, excel_path = corpus_paths(output_dir, dir_name)
+                write_translated_text(translated_file_path, translations)
+                write_corpus(excel_path, paragraphs, translations, [r[2] for r in rows] if write_origins else None)
+                save_index(index_path_for(output_dir, dir_name), json.loads(index_json))
+            except Exception:
+                self.conn.execute("UPDATE jobs SET status = 'queued' WHERE id = ?", (job_id,))
+                raise
+
+            self.conn.execute("UPDATE jobs SET status = 'assembled' WHERE id = ?", (job_id,))
+            assembled.append(excel_path)
+        return assembled
+
+
+def run_worker(queue, client, model_name, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, request_interval=0, exit_when_empty=True, idle_sleep=5, stats=None, pacer=None):
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    pacer = pacer or RequestPacer(request_interval)
+    processed = 0
+    # Retries and back-off can keep one paragraph busy for longer than a lease, so the request runs on a helper
+    # thread while this one keeps renewing the lease; the queue connection stays on this thread.
+    call_pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            claimed = queue.claim(worker_id, lease_seconds)
+            if not claimed:
+                if exit_when_empty and not queue.has_open_items():
+                    return processed
+                time.sleep(idle_sleep)
+                continue
+
+            for item_id, job_id, prompt, options in claimed:
+                pacer.wait()
+                future = call_pool.submit(
+                    translate_single_paragraph, client, model_name, prompt,
+                    options.get('max_tokens', 8000), options.get('retry_attempts', 3), options.get('paragraph_timeout', 300), stats
+                )
+                while not wait_futures([future], timeout=lease_seconds / 3).done:
+                    queue.renew(item_id, worker_id, lease_seconds)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_error(f"Worker {worker_id} failed on item {item_id}: {e}")
+                    queue.release(item_id, worker_id)
+                    continue
+                if queue.complete(item_id, worker_id, result):
+                    processed += 1
+                else:
+                    log_error(f"Worker {worker_id} lost the lease on item {item_id}; its result was discarded.")
+    finally:
+        call_pool.shutdown(wait=False)
+
+
+def _resolve_api_key(settings, provider, key_name):
+    if key_name:
+        keys = settings['api_providers'].get(provider, {}).get('api_keys', {})
+        if key_name not in keys:
+            raise ValueError(f"No saved API key named '{key_name}' for {provider}.")
+        return keys[key_name]
+    return os.environ.get("AIPTA_API_KEY", "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI-PTA distributed translation work queue.")
+    parser.add_argument("--queue", required=True, help="Path to the shared queue database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Split TXT files into paragraph work items.")
+    enqueue_parser.add_argument("files", nargs="+")
+    enqueue_parser.add_argument("--prompt", required=True, help="Name of a translation prompt saved in settings.json.")
+    enqueue_parser.add_argument("--glossary", help="Terminology CSV used to fill {terms}.")
+
+    worker_parser = subparsers.add_parser("work", help="Claim and translate work items until the queue is drained.")
+    worker_parser.add_argument("--provider", required=True)
+    worker_parser.add_argument("--model", required=True)
+    worker_parser.add_argument("--key-name", help="Name of a saved API key; defaults to the AIPTA_API_KEY environment variable.")
+    worker_parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS)
+    worker_parser.add_argument("--keep-running", action="store_true", help="Wait for new work instead of exiting when the queue is empty.")
+
+    subparsers.add_parser("status", help="Show progress per job.")
+    subparsers.add_parser("assemble", help="Write outputs for every finished job.")
+
+    args = parser.parse_args(argv)
+    settings = load_settings()
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            prompt_text = settings['prompts'].get(args.prompt)
+            if prompt_text is None:
+                parser.error(f"Prompt '{args.prompt}' not found in settings.")
+            try:
+                prompt_template = compile_template(prompt_text)
+            except PromptTemplateError as e:
+                parser.error(str(e))
+            term_matcher = None
+            if args.glossary:
+                from term_store import TermStore
+                term_store = TermStore(args.glossary)
+                term_matcher = term_store.matcher()
+                term_store.close()
+            options = {key: settings.get(key) for key in ('context_before', 'context_after', 'max_tokens', 'retry_attempts', 'paragraph_timeout', 'cache_friendly_prompts')}
+            options['passthrough'] = passthrough_settings(settings, args.prompt)
+            for file_path in args.files:
+                job_id = queue.enqueue_file(file_path, prompt_template, options, term_matcher)
+                print(f"{file_path}: " + (f"job {job_id}" if job_id else "no paragraphs, skipped"))
+        elif args.command == "work":
+            client = create_client(settings, args.provider, _resolve_api_key(settings, args.provider, args.key_name))
+            stats = RunStats()
+            pacer = RequestPacer(settings.get('request_interval', 0))
+            # Long-running workers follow request-interval edits made in the GUI without a restart.
+            SETTINGS_STORE.watch(lambda changed: setattr(pacer, 'interval', changed.get('request_interval', 0)))
+            processed = run_worker(queue, client, args.model, lease_seconds=args.lease,
+                                   exit_when_empty=not args.keep_running, stats=stats, pacer=pacer)
+            print(f"Worker finished, {processed} items translated. {stats.summary()}")
+        elif args.command == "status":
+            for job_id, file_path, status, total, done, leased in queue.status():
+                print(f"job {job_id} [{status}] {os.path.basename(file_path)}: {done}/{total} done, {leased} leased")
+        elif args.command == "assemble":
+            for excel_path in queue.assemble_ready_jobs():
+                print(f"Assembled {excel_path}")
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())